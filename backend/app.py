@@ -5,7 +5,12 @@ JMComicReaderProject 后端主应用
 
 import os
 import sys
-from flask import Flask, render_template, jsonify, request, send_file
+import hashlib
+import io
+import mimetypes
+import struct
+from urllib.parse import quote
+from flask import Flask, render_template, jsonify, request, send_file, Response
 from flask_cors import CORS
 import json
 import sqlite3
@@ -47,24 +52,45 @@ if IS_FROZEN:
 
 try:
     from services.jm_crawler import JMCrawler
-    from services.download_manager import DownloadManager
+    from services.download_manager import DownloadManager, STAGING_DIRNAME
+    from services.download_scheduler import DownloadScheduler
     from services.comic_manager import ComicManager
-    from models.database import init_database
+    from services.library_scanner import LibraryScanner
+    from services.trash_manager import TrashManager
+    from services.image_cache import ImageDerivativeCache, negotiate_format
+    from services.pdf_cache import PdfExportCache
+    from services.page_store import PageRef
+    from services.storage_converter import StorageConverter
+    from models.database import init_database, get_system_config, release_db_connections
 except ImportError:
     # Fallback for when running in PyInstaller but imports fail
     # Try importing from backend package if available
     try:
         from backend.services.jm_crawler import JMCrawler
-        from backend.services.download_manager import DownloadManager
+        from backend.services.download_manager import DownloadManager, STAGING_DIRNAME
+        from backend.services.download_scheduler import DownloadScheduler
         from backend.services.comic_manager import ComicManager
-        from backend.models.database import init_database
+        from backend.services.library_scanner import LibraryScanner
+        from backend.services.trash_manager import TrashManager
+        from backend.services.image_cache import ImageDerivativeCache, negotiate_format
+        from backend.services.pdf_cache import PdfExportCache
+        from backend.services.page_store import PageRef
+        from backend.services.storage_converter import StorageConverter
+        from backend.models.database import init_database, get_system_config, release_db_connections
     except ImportError:
          # Last resort: try adding the parent directory to path
          sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
          from services.jm_crawler import JMCrawler
-         from services.download_manager import DownloadManager
+         from services.download_manager import DownloadManager, STAGING_DIRNAME
+         from services.download_scheduler import DownloadScheduler
          from services.comic_manager import ComicManager
-         from models.database import init_database
+         from services.library_scanner import LibraryScanner
+         from services.trash_manager import TrashManager
+         from services.image_cache import ImageDerivativeCache, negotiate_format
+         from services.pdf_cache import PdfExportCache
+         from services.page_store import PageRef
+         from services.storage_converter import StorageConverter
+         from models.database import init_database, get_system_config, release_db_connections
 
 # Determine absolute paths for frontend assets
 template_dir = os.path.join(PROJECT_ROOT, "frontend", "templates")
@@ -98,13 +124,159 @@ CORS(app)
 def inject_app_version():
     return {"app_version": APP_VERSION}
 
+
+@app.teardown_request
+def release_request_db_connections(exc=None):
+    """请求结束后把数据库连接归还连接池，下一个请求线程直接复用"""
+    release_db_connections()
+
 # 初始化服务
-jm_crawler = JMCrawler()
-download_manager = DownloadManager()
 comic_manager = ComicManager()
+disk_usage = comic_manager.disk_usage
+disk_usage.register_cache("temp", TEMP_CACHE_DIR)
+# 整个应用共用一个 JMCrawler：同一份 JmOption，同一个客户端和连接池
+jm_crawler = JMCrawler(
+    disk_usage=disk_usage,
+    staging_dir=os.path.join(comic_manager.downloaded_dir, STAGING_DIRNAME),
+)
+comic_manager.jm_crawler = jm_crawler
+download_manager = DownloadManager(comic_manager, jm_crawler)
+download_scheduler = DownloadScheduler(download_manager, comic_manager.db_file)
+library_scanner = LibraryScanner(comic_manager, download_manager)
+trash_manager = TrashManager(comic_manager, download_manager)
+storage_converter = StorageConverter(comic_manager, download_manager)
+page_cache = ImageDerivativeCache(
+    os.path.join(TEMP_CACHE_DIR, "derivatives"), comic_manager.db_file, disk_usage
+)
+pdf_cache = PdfExportCache(
+    os.path.join(TEMP_CACHE_DIR, "pdf"), comic_manager.db_file, comic_manager, disk_usage
+)
+
+
+_background_started = False
+_background_lock = threading.Lock()
+
+
+def start_background_services():
+    """
+    启动后台线程（下载队列、书架扫描、回收区清理、磁盘占用校准）
+
+    由启动入口调用而不是在导入时启动：调试模式的自动重载会在父子两个进程中导入本模块，
+    在导入时启动会让两个进程的工作线程同时消费同一个下载队列。重复调用不会重复启动。
+    """
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+
+    disk_usage.start_reconciler()
+    download_scheduler.start()
+    library_scanner.start()
+    trash_manager.start()
+
 
-# 全局变量存储下载进度
-download_progress = {}
+# 带版本号的图片URL的缓存时间（一年）
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# 批量预取单次最多返回的页数
+PAGE_BUNDLE_MAX = 20
+
+
+def negotiated_image_format():
+    """按 Accept 头和转码开关选择输出格式"""
+    if get_system_config("enable_image_transcoding") != "true":
+        return "JPEG"
+    return negotiate_format(request.headers.get("Accept"))
+
+
+def offload_file(path, mimetype=None):
+    """
+    交给反向代理发送文件（system_config.file_offload_mode）
+
+    - x-accel-redirect：返回 X-Accel-Redirect 指向 nginx 的 internal location，
+      书架目录映射为 <file_offload_prefix>/library/，缓存目录映射为 <file_offload_prefix>/cache/
+    - x-sendfile：返回 X-Sendfile 绝对路径（Apache mod_xsendfile、lighttpd）
+
+    文件内容和 Range 由代理直接发送，Python 只负责查找路径。
+    未开启卸载或文件不在上述目录下时返回 None，由调用方自行发送。
+    """
+    mode = get_system_config("file_offload_mode")
+    if mode not in ("x-accel-redirect", "x-sendfile"):
+        return None
+
+    path = os.path.abspath(path)
+    for area, root in (
+        ("library", comic_manager.downloaded_dir),
+        ("cache", TEMP_CACHE_DIR),
+    ):
+        root = os.path.abspath(root)
+        if not path.startswith(root + os.sep):
+            continue
+
+        response = Response(
+            mimetype=mimetype
+            or mimetypes.guess_type(path)[0]
+            or "application/octet-stream"
+        )
+        if mode == "x-sendfile":
+            response.headers["X-Sendfile"] = path
+        else:
+            prefix = (get_system_config("file_offload_prefix") or "/_offload").rstrip("/")
+            relative = os.path.relpath(path, root).replace(os.sep, "/")
+            response.headers["X-Accel-Redirect"] = quote(f"{prefix}/{area}/{relative}")
+        return response
+    return None
+
+
+def send_image(image, cache_key, width=None, height=None, version=None):
+    """
+    返回图片，按 w/h 缩放并按 Accept 头转码为 WebP/AVIF（结果走派生缓存）
+
+    image 为 PageRef；打包章节中的原图直接从容器的 mmap 切片返回，
+    磁盘上的文件（散图和派生图）在开启卸载时交给反向代理发送。
+    ETag 和 Last-Modified 取自原图的大小和修改时间，派生图被淘汰重建后依然不变；
+    请求携带的 v 参数与 version 一致时按不可变资源长期缓存，否则每次重新验证。
+    条件请求（304）和 Range 由 send_file 处理。
+    """
+    path, mimetype = page_cache.get_derivative(
+        image, cache_key, width, height, negotiated_image_format()
+    )
+
+    etag = hashlib.sha1(
+        f"{image.size}-{image.mtime}-{image.offset}-{width}-{height}-{mimetype}".encode()
+    ).hexdigest()
+    immutable = version is not None and request.args.get("v") == version
+
+    if path is None and not image.packed:
+        path = image.path
+    response = None
+    if path is not None:
+        response = offload_file(path, mimetype or mimetypes.guess_type(image.name)[0])
+
+    if response is not None:
+        # 条件请求仍在这里处理，304 不需要经过代理读文件
+        response.set_etag(etag)
+        response.last_modified = image.mtime
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        else:
+            response.cache_control.no_cache = True
+        response.make_conditional(request)
+    else:
+        response = send_file(
+            path if path is not None else io.BytesIO(image.read()),
+            mimetype=mimetype,
+            download_name=image.name,
+            etag=etag,
+            last_modified=image.mtime,
+            max_age=IMMUTABLE_MAX_AGE if immutable else None,
+        )
+    response.vary.add("Accept")
+    if immutable:
+        response.cache_control.immutable = True
+    return response
 
 
 @app.route("/")
@@ -176,16 +348,14 @@ def get_comic_cover(jm_id):
     """获取漫画封面（懒加载）"""
     try:
         # 首先检查是否已下载漫画的封面
-        if comic_manager.is_comic_downloaded(jm_id):
-            # 查找已下载漫画的封面
-            downloaded_comics = comic_manager.get_downloaded_comics()
-            for comic in downloaded_comics:
-                if comic["id"] == jm_id and comic.get("cover_path"):
-                    cover_path = comic["cover_path"]
-                    if os.path.exists(cover_path):
-                        print(f"返回已下载漫画封面: {cover_path}")
-                        return send_file(cover_path)
-        
+        comic = comic_manager.get_downloaded_comic(jm_id)
+        if comic and comic.get("cover_path"):
+            cover_path = comic["cover_path"]
+            if os.path.exists(cover_path):
+                print(f"返回已下载漫画封面: {cover_path}")
+                return send_image(PageRef.from_file(cover_path), f"covers/{jm_id}")
+
+
         # 如果没有已下载封面，从JM获取
         cover_url = jm_crawler.get_cover_url(jm_id)
         if cover_url:
@@ -211,14 +381,13 @@ def get_downloaded_comic_cover(jm_id):
     """获取已下载漫画的封面"""
     try:
         # 查找已下载漫画的封面
-        downloaded_comics = comic_manager.get_downloaded_comics()
-        for comic in downloaded_comics:
-            if comic["id"] == jm_id and comic.get("cover_path"):
-                cover_path = comic["cover_path"]
-                if os.path.exists(cover_path):
-                    print(f"返回已下载漫画封面: {cover_path}")
-                    return send_file(cover_path)
-        
+        comic = comic_manager.get_downloaded_comic(jm_id)
+        if comic and comic.get("cover_path"):
+            cover_path = comic["cover_path"]
+            if os.path.exists(cover_path):
+                print(f"返回已下载漫画封面: {cover_path}")
+                return send_image(PageRef.from_file(cover_path), f"covers/{jm_id}")
+
         return jsonify({"success": False, "message": "封面不存在"})
     except Exception as e:
         return jsonify({"success": False, "message": f"获取封面失败: {str(e)}"})
@@ -226,7 +395,7 @@ def get_downloaded_comic_cover(jm_id):
 
 @app.route("/api/download/<int:jm_id>", methods=["POST"])
 def download_comic(jm_id):
-    """下载漫画"""
+    """下载漫画（加入下载队列）"""
     try:
         # 检查是否已下载
         if comic_manager.is_comic_downloaded(jm_id):
@@ -239,67 +408,170 @@ def download_comic(jm_id):
         if not comic_info:
             return jsonify({"success": False, "message": "未找到对应的漫画"})
 
-        # 启动异步下载任务
-        download_id = f"{jm_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        download_progress[download_id] = {
-            "progress": 0,
-            "status": "starting",
-            "message": "开始下载...",
-        }
-
-        # 在新线程中执行下载
-        def download_task():
-            try:
-                download_manager.download_comic(
-                    jm_id,
-                    comic_info,
-                    lambda p, s, m: update_download_progress(download_id, p, s, m),
-                )
-                # 下载完成后添加到已下载列表
-                # 注意：数据库更新已在download_manager中处理
-                print(f"漫画 {jm_id} 下载任务完成")
-            except Exception as e:
-                update_download_progress(download_id, 0, "error", str(e))
-
-        thread = threading.Thread(target=download_task)
-        thread.daemon = True
-        thread.start()
+        data = request.get_json(silent=True) or {}
+        priority = data.get("priority", request.args.get("priority", 0, type=int))
+        job = download_scheduler.enqueue(jm_id, comic_info, int(priority or 0))
 
         return jsonify(
-            {"success": True, "download_id": download_id, "message": "下载任务已启动"}
+            {
+                "success": True,
+                "download_id": job["download_id"],
+                "data": job,
+                "message": "已加入下载队列",
+            }
         )
 
     except Exception as e:
         return jsonify({"success": False, "message": f"下载失败: {str(e)}"})
 
 
-def update_download_progress(download_id, progress, status, message):
-    """更新下载进度"""
-    if download_id in download_progress:
-        download_progress[download_id].update(
-            {"progress": progress, "status": status, "message": message}
-        )
-
-
 @app.route("/api/download/progress/<download_id>")
 def get_download_progress(download_id):
-    """获取下载进度"""
-    if download_id in download_progress:
-        return jsonify({"success": True, "data": download_progress[download_id]})
+    """获取下载进度（排队中的任务包含排队位置）"""
+    job = download_scheduler.get_job(download_id)
+    if job:
+        return jsonify({"success": True, "data": job})
     else:
         return jsonify({"success": False, "message": "下载任务不存在"})
 
 
+@app.route("/api/download/queue")
+def get_download_queue():
+    """获取下载队列（未结束的任务）和工作线程数"""
+    try:
+        return jsonify(
+            {
+                "success": True,
+                "data": {
+                    "workers": download_scheduler.workers,
+                    "jobs": download_scheduler.list_jobs(),
+                },
+            }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "message": f"获取下载队列失败: {str(e)}"})
+
+
+@app.route("/api/download/queue/<download_id>/<action>", methods=["POST"])
+def control_download(download_id, action):
+    """暂停（pause）、恢复（resume）、取消（cancel）下载任务或调整优先级（priority）"""
+    try:
+        if action == "pause":
+            changed = download_scheduler.pause(download_id)
+        elif action == "resume":
+            changed = download_scheduler.resume(download_id)
+        elif action == "cancel":
+            changed = download_scheduler.cancel(download_id)
+        elif action == "priority":
+            data = request.get_json(silent=True) or {}
+            changed = download_scheduler.set_priority(
+                download_id, int(data.get("priority", 0))
+            )
+        else:
+            return jsonify({"success": False, "message": f"未知操作: {action}"})
+
+        if not changed:
+            return jsonify({"success": False, "message": "任务不存在或当前状态不支持该操作"})
+        return jsonify({"success": True, "data": download_scheduler.get_job(download_id)})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"操作下载任务失败: {str(e)}"})
+
+
+@app.route("/api/download/workers", methods=["POST"])
+def resize_download_workers():
+    """调整同时下载数（写回 max_concurrent_downloads）"""
+    data = request.get_json(silent=True) or {}
+    try:
+        workers = download_scheduler.resize(int(data.get("workers")))
+        return jsonify({"success": True, "data": {"workers": workers}})
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "workers 参数无效"})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"调整下载线程数失败: {str(e)}"})
+
+
 @app.route("/api/downloaded")
 def get_downloaded_comics():
-    """获取已下载的漫画列表"""
+    """
+    获取已下载的漫画列表
+
+    带 limit/cursor/sort/order/author/tag/unread 任一参数时按分页返回，
+    否则返回完整列表（兼容旧接口）
+    """
+    paged_params = ("limit", "cursor", "sort", "order", "author", "tag", "unread")
     try:
-        comics = comic_manager.get_downloaded_comics()
-        return jsonify({"success": True, "data": comics})
+        if not any(name in request.args for name in paged_params):
+            comics = comic_manager.get_downloaded_comics()
+            return jsonify({"success": True, "data": comics})
+
+        result = comic_manager.query_downloaded_comics(
+            limit=request.args.get("limit", 50, type=int),
+            cursor=request.args.get("cursor") or None,
+            sort=request.args.get("sort", "download_time"),
+            order=request.args.get("order", "desc"),
+            author=request.args.get("author", "").strip() or None,
+            tag=request.args.get("tag", "").strip() or None,
+            unread=request.args.get("unread", "0") in ("1", "true"),
+        )
+        return jsonify({"success": True, "data": result})
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)})
     except Exception as e:
         return jsonify({"success": False, "message": f"获取列表失败: {str(e)}"})
 
 
+@app.route("/api/downloaded/search")
+def search_downloaded_comics():
+    """全文搜索本地书架"""
+    keyword = request.args.get("q", "").strip()
+    if not keyword:
+        return jsonify({"success": False, "message": "关键词不能为空"})
+
+    try:
+        comics = comic_manager.search_downloaded_comics(
+            keyword, limit=request.args.get("limit", 50, type=int)
+        )
+        return jsonify({"success": True, "data": comics})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"搜索失败: {str(e)}"})
+
+
+@app.route("/api/downloaded/facets/tags")
+def get_tag_facets():
+    """本地书架标签统计"""
+    try:
+        facets = comic_manager.get_tag_facets(
+            limit=request.args.get("limit", 100, type=int)
+        )
+        return jsonify({"success": True, "data": facets})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"获取标签统计失败: {str(e)}"})
+
+
+@app.route("/api/downloaded/facets/authors")
+def get_author_facets():
+    """本地书架作者统计"""
+    try:
+        facets = comic_manager.get_author_facets(
+            limit=request.args.get("limit", 100, type=int)
+        )
+        return jsonify({"success": True, "data": facets})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"获取作者统计失败: {str(e)}"})
+
+
+@app.route("/api/downloaded/<int:jm_id>")
+def get_downloaded_comic(jm_id):
+    """获取单本已下载漫画的信息"""
+    try:
+        comic = comic_manager.get_downloaded_comic(jm_id)
+        if comic:
+            return jsonify({"success": True, "data": comic})
+        return jsonify({"success": False, "message": "该漫画尚未下载"})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"获取漫画信息失败: {str(e)}"})
+
+
 @app.route("/api/read/<int:jm_id>")
 def read_comic(jm_id):
     """阅读漫画"""
@@ -325,11 +597,9 @@ def read_comic(jm_id):
         # 获取漫画标题
         comic_title = f"JM-{jm_id}"
         try:
-            downloaded_comics = comic_manager.get_downloaded_comics()
-            for comic in downloaded_comics:
-                if comic["id"] == jm_id:
-                    comic_title = comic["title"]
-                    break
+            comic = comic_manager.get_downloaded_comic(jm_id)
+            if comic:
+                comic_title = comic["title"]
         except Exception as e:
             print(f"获取漫画标题失败: {e}")
         
@@ -342,6 +612,8 @@ def read_comic(jm_id):
                 "current_chapter_pages": first_chapter["pages"],
                 "total_chapters": len(chapters),
                 "comic_path": first_chapter["path"],
+                "page_version": comic_manager.get_page_version(jm_id),
+                "pages": comic_manager.get_chapter_page_meta(jm_id, first_chapter["id"]),
             },
         }
         
@@ -382,11 +654,9 @@ def read_comic_chapter(jm_id, chapter_id):
         # 获取漫画标题
         comic_title = f"JM-{jm_id}"
         try:
-            downloaded_comics = comic_manager.get_downloaded_comics()
-            for comic in downloaded_comics:
-                if comic["id"] == jm_id:
-                    comic_title = comic["title"]
-                    break
+            comic = comic_manager.get_downloaded_comic(jm_id)
+            if comic:
+                comic_title = comic["title"]
         except Exception as e:
             print(f"获取漫画标题失败: {e}")
 
@@ -399,6 +669,8 @@ def read_comic_chapter(jm_id, chapter_id):
                 "current_chapter_pages": target_chapter["pages"],
                 "total_chapters": len(chapters),
                 "comic_path": target_chapter["path"],
+                "page_version": comic_manager.get_page_version(jm_id),
+                "pages": comic_manager.get_chapter_page_meta(jm_id, target_chapter["id"]),
             },
         }
         
@@ -412,21 +684,48 @@ def read_comic_chapter(jm_id, chapter_id):
         return jsonify({"success": False, "message": f"获取章节数据失败: {str(e)}"})
 
 
+@app.route("/api/read/<int:jm_id>/chapters/refresh", methods=["POST"])
+def refresh_comic_chapters(jm_id):
+    """从JM刷新章节元数据（限频）"""
+    try:
+        if not comic_manager.is_comic_downloaded(jm_id):
+            return jsonify({"success": False, "message": "该漫画尚未下载"})
+
+        refreshed = comic_manager.refresh_chapter_metadata(jm_id)
+        if refreshed is None:
+            return jsonify({"success": False, "message": "刷新过于频繁，请稍后再试"})
+        if not refreshed:
+            return jsonify({"success": False, "message": "从JM获取章节信息失败"})
+
+        chapters = comic_manager.get_comic_chapters(jm_id)
+        return jsonify({"success": True, "data": {"chapters": chapters}})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"刷新章节信息失败: {str(e)}"})
+
+
 @app.route("/api/comic/<int:jm_id>/page/<int:page_num>")
 def get_comic_page(jm_id, page_num):
     """获取漫画页面"""
     try:
         # 获取章节参数
         chapter_id = request.args.get("chapter", None)
+        width = request.args.get("w", None, type=int)
+        height = request.args.get("h", None, type=int)
         print(f"请求漫画页面: {jm_id}-{page_num}, 章节: {chapter_id}")
         
-        page_path = comic_manager.get_comic_page_path(jm_id, page_num, chapter_id)
-
-        if page_path and os.path.exists(page_path):
-            print(f"返回页面: {page_path}")
-            return send_file(page_path)
+        page = comic_manager.get_page_ref(jm_id, page_num, chapter_id)
+
+        if page:
+            print(f"返回页面: {page.path} {page.name}")
+            return send_image(
+                page,
+                f"{jm_id}/{page_num}",
+                width,
+                height,
+                version=comic_manager.get_page_version(jm_id),
+            )
         else:
-            print(f"页面不存在: {page_path}")
+            print(f"页面不存在: {jm_id}-{page_num}")
             return jsonify({"success": False, "message": "页面不存在"})
     except Exception as e:
         print(f"获取页面失败 {jm_id}-{page_num}: {e}")
@@ -435,29 +734,274 @@ def get_comic_page(jm_id, page_num):
         return jsonify({"success": False, "message": f"获取页面失败: {str(e)}"})
 
 
+@app.route("/api/comic/<int:jm_id>/pages")
+def get_comic_page_bundle(jm_id):
+    """
+    批量获取连续页面（长度前缀的二进制包）
+
+    响应格式：4 字节大端头部长度 + UTF-8 JSON 头部 [{"page", "mime", "length"}, ...]，
+    随后按头部顺序拼接各页图片数据。参数 chapter/w/h/v 与单页接口相同。
+    """
+    chapter_id = request.args.get("chapter", None)
+    start = max(1, request.args.get("start", 1, type=int))
+    count = max(1, min(request.args.get("count", 6, type=int), PAGE_BUNDLE_MAX))
+    width = request.args.get("w", None, type=int)
+    height = request.args.get("h", None, type=int)
+
+    try:
+        pages = comic_manager.get_page_window(jm_id, start, count, chapter_id)
+        if not pages:
+            return jsonify({"success": False, "message": "页面不存在"})
+
+        image_format = negotiated_image_format()
+        entries = []
+        handles = []
+
+        def close_handles():
+            for f in handles:
+                f.close()
+
+        try:
+            for page_num, page in pages:
+                path, mimetype = page_cache.get_derivative(
+                    page,
+                    f"{jm_id}/{page_num}",
+                    width,
+                    height,
+                    image_format,
+                )
+                if path is None:
+                    # 原图：打包章节直接读容器切片，散图按文件发送
+                    mimetype = mimetypes.guess_type(page.name)[0] or "image/jpeg"
+                    if page.packed:
+                        entries.append((page_num, page.read(), mimetype, page.size))
+                        continue
+                    path = page.path
+                # 响应开始前打开所有文件，长度取自打开的句柄：
+                # 之后派生图被淘汰或替换，已打开的文件内容和长度都不会变
+                f = open(path, "rb")
+                handles.append(f)
+                entries.append((page_num, f, mimetype, os.fstat(f.fileno()).st_size))
+        except Exception:
+            close_handles()
+            raise
+
+        header = json.dumps(
+            [
+                {"page": page_num, "mime": mimetype, "length": size}
+                for page_num, _, mimetype, size in entries
+            ]
+        ).encode("utf-8")
+
+        def generate():
+            try:
+                yield struct.pack(">I", len(header)) + header
+                for _, body, _, _ in entries:
+                    if isinstance(body, bytes):
+                        yield body
+                        continue
+                    while True:
+                        chunk = body.read(256 * 1024)
+                        if not chunk:
+                            break
+                        yield chunk
+            finally:
+                close_handles()
+
+        response = Response(generate(), mimetype="application/octet-stream")
+        # 客户端中途断开或响应没有被迭代时也会调用
+        response.call_on_close(close_handles)
+        response.content_length = 4 + len(header) + sum(entry[3] for entry in entries)
+        response.vary.add("Accept")
+        if request.args.get("v") == comic_manager.get_page_version(jm_id):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+    except Exception as e:
+        print(f"批量获取页面失败 {jm_id}-{start}: {e}")
+        return jsonify({"success": False, "message": f"批量获取页面失败: {str(e)}"})
+
+
+@app.route("/api/comic/<int:jm_id>/pdf")
+def export_comic_pdf(jm_id):
+    """
+    导出 PDF（首次请求时生成并缓存）
+
+    参数 chapter 指定单个章节，缺省时合并全部章节并按章节添加书签；
+    download=1 时作为附件下载。条件请求和 Range 由 send_file 或反向代理处理。
+    """
+    if get_system_config("enable_pdf_generation") == "false":
+        return jsonify({"success": False, "message": "PDF 导出已关闭"})
+
+    chapter_id = request.args.get("chapter", None)
+    try:
+        path = pdf_cache.get_pdf(jm_id, chapter_id)
+        if not path:
+            return jsonify({"success": False, "message": "漫画不存在或没有页面"})
+
+        comic = comic_manager.get_downloaded_comic(jm_id)
+        download_name = f"{jm_id}_{comic['title']}" if comic else str(jm_id)
+        if chapter_id:
+            download_name += f"_{chapter_id}"
+        for char in '\\/:*?"<>|':
+            download_name = download_name.replace(char, "_")
+        download_name += ".pdf"
+        as_attachment = request.args.get("download") == "1"
+
+        response = offload_file(path, "application/pdf")
+        if response is not None:
+            disposition = "attachment" if as_attachment else "inline"
+            response.headers["Content-Disposition"] = (
+                f"{disposition}; filename*=UTF-8''{quote(download_name)}"
+            )
+            # 缓存文件名包含页面版本，内容变化后路径随之变化
+            response.set_etag(os.path.basename(path))
+            response.cache_control.no_cache = True
+            response.make_conditional(request)
+            return response
+
+        return send_file(
+            path,
+            mimetype="application/pdf",
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,
+        )
+    except Exception as e:
+        print(f"导出 PDF 失败 {jm_id}: {e}")
+        return jsonify({"success": False, "message": f"导出 PDF 失败: {str(e)}"})
+
+
 @app.route("/api/delete/<int:jm_id>", methods=["DELETE"])
 def delete_comic(jm_id):
     """删除漫画"""
     try:
-        if comic_manager.delete_comic(jm_id):
-            return jsonify({"success": True, "message": "删除成功"})
+        # 目录移入回收区后立即返回，空间由后台线程回收
+        job = trash_manager.delete_comics([jm_id])
+        if jm_id in job["removed"]:
+            pdf_cache.invalidate(jm_id)
+            return jsonify({"success": True, "message": "删除成功", "data": job})
         else:
             return jsonify({"success": False, "message": "删除失败"})
     except Exception as e:
         return jsonify({"success": False, "message": f"删除失败: {str(e)}"})
 
 
+@app.route("/api/delete/bulk", methods=["POST"])
+def delete_comics_bulk():
+    """批量删除漫画"""
+    data = request.get_json(silent=True) or {}
+    try:
+        jm_ids = [int(jm_id) for jm_id in data.get("ids", [])]
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "ids 参数无效"})
+
+    if not jm_ids:
+        return jsonify({"success": False, "message": "请选择要删除的漫画"})
+
+    try:
+        job = trash_manager.delete_comics(jm_ids)
+        for removed_id in job["removed"]:
+            pdf_cache.invalidate(removed_id)
+        return jsonify(
+            {
+                "success": True,
+                "data": job,
+                "message": f"已删除 {len(job['removed'])} 本，正在后台回收空间",
+            }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "message": f"批量删除失败: {str(e)}"})
+
+
+@app.route("/api/delete/jobs/<job_id>")
+def get_delete_job(job_id):
+    """获取批量删除的空间回收进度"""
+    job = trash_manager.get_job(job_id)
+    if job:
+        return jsonify({"success": True, "data": job})
+    return jsonify({"success": False, "message": "删除任务不存在"})
+
+
+@app.route("/api/library/scan", methods=["POST"])
+def start_library_scan():
+    """手动触发书架与磁盘目录同步，deep 为 true 时同时检查章节子目录的变化"""
+    try:
+        data = request.get_json(silent=True) or {}
+        started = library_scanner.start(deep=bool(data.get("deep")))
+        return jsonify(
+            {
+                "success": True,
+                "data": {"started": started},
+                "message": "书架扫描已启动" if started else "书架扫描正在进行",
+            }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "message": f"启动书架扫描失败: {str(e)}"})
+
+
+@app.route("/api/library/scan")
+def get_library_scan_status():
+    """获取书架扫描状态和最近的新增/移除/更新事件"""
+    try:
+        return jsonify(
+            {
+                "success": True,
+                "data": {
+                    "running": library_scanner.is_running,
+                    "last_result": library_scanner.last_result,
+                    "events": library_scanner.get_events(
+                        request.args.get("since", 0, type=int)
+                    ),
+                },
+            }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "message": f"获取扫描状态失败: {str(e)}"})
+
+
+@app.route("/api/library/pack", methods=["POST"])
+def start_library_pack():
+    """把书架中的散图漫画转换为打包章节（后台执行）"""
+    try:
+        started = storage_converter.start()
+        return jsonify(
+            {
+                "success": True,
+                "data": {"started": started},
+                "message": "章节打包已启动" if started else "章节打包正在进行",
+            }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "message": f"启动章节打包失败: {str(e)}"})
+
+
+@app.route("/api/library/pack")
+def get_library_pack_status():
+    """获取章节打包进度"""
+    try:
+        return jsonify({"success": True, "data": storage_converter.status})
+    except Exception as e:
+        return jsonify({"success": False, "message": f"获取打包进度失败: {str(e)}"})
+
+
 @app.route("/api/cache/status")
 def get_cache_status():
     """获取缓存状态"""
     try:
-        cache_size = get_directory_size(TEMP_CACHE_DIR)
+        # 直接返回增量统计的结果，与磁盘的校准交给后台 reconciler
+        staging_size = disk_usage.get_usage("cache", "staging")
+        cache_size = disk_usage.get_usage("cache", "temp") + staging_size
         return jsonify(
             {
                 "success": True,
                 "data": {
                     "cache_size": cache_size,
                     "cache_size_mb": round(cache_size / (1024 * 1024), 2),
+                    # 未完成下载的暂存数据（包含在 cache_size 中）
+                    "staging_size": staging_size,
+                    "staging_size_mb": round(staging_size / (1024 * 1024), 2),
                     "need_cleanup": cache_size > 100 * 1024 * 1024,  # 100MB
                 },
             }
@@ -473,7 +1017,13 @@ def clear_cache():
         cache_dir = TEMP_CACHE_DIR
 
         # 获取清理前的缓存大小
-        original_size = get_directory_size(cache_dir)
+        disk_usage.refresh(cache_dir)
+        original_size = disk_usage.get_usage("cache", "temp") + disk_usage.get_usage(
+            "cache", "staging"
+        )
+
+        # 没有排队、暂停或进行中任务的下载暂存目录不会再被续传
+        download_manager.sweep_staging(download_scheduler.resumable_ids())
 
         # 清理缓存目录（保留已下载漫画的封面和cover_cache.json）
         if os.path.exists(cache_dir):
@@ -508,12 +1058,19 @@ def clear_cache():
 
                 try:
                     if os.path.isfile(item_path):
+                        file_size = os.path.getsize(item_path)
                         os.remove(item_path)
+                        disk_usage.record_file(item_path, -file_size, -1)
                         deleted_count += 1
                         print(f"删除文件: {item}")
                     elif os.path.isdir(item_path):
                         import shutil
                         shutil.rmtree(item_path)
+                        disk_usage.forget(item_path)
+                        if item_path == page_cache.cache_dir:
+                            page_cache.clear()
+                        elif item_path == pdf_cache.cache_dir:
+                            pdf_cache.clear()
                         print(f"删除目录: {item}")
                 except Exception as e:
                     print(f"删除 {item_path} 失败: {e}")
@@ -522,7 +1079,9 @@ def clear_cache():
             print(f"缓存清理完成，共删除 {deleted_count} 个文件/目录")
 
         # 获取清理后的缓存大小
-        final_size = get_directory_size(cache_dir)
+        final_size = disk_usage.get_usage("cache", "temp") + disk_usage.get_usage(
+            "cache", "staging"
+        )
         cleared_size = original_size - final_size
 
         return jsonify(
@@ -544,20 +1103,6 @@ def clear_cache():
         return jsonify({"success": False, "message": f"清理缓存失败: {str(e)}"})
 
 
-def get_directory_size(directory):
-    """获取目录大小"""
-    total_size = 0
-    try:
-        for dirpath, dirnames, filenames in os.walk(directory):
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                if os.path.exists(filepath):
-                    total_size += os.path.getsize(filepath)
-    except:
-        pass
-    return total_size
-
-
 def clear_directory(directory):
     """清理目录"""
     try:
@@ -612,6 +1157,10 @@ def main():
     # 初始化数据库
     init_database()
 
+    # 自动重载时父进程只负责监视文件，后台线程只在实际提供服务的子进程中启动
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
+
     # 启动应用
     app.run(debug=True, host="0.0.0.0", port=5000)
 
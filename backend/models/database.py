@@ -3,24 +3,130 @@
 数据库模型和初始化
 """
 
+import queue
 import sqlite3
 import os
+import threading
 from datetime import datetime
-from typing import Optional
-
-
-def init_database():
-    """初始化数据库"""
+from typing import Dict, Optional
+
+# 线程正在使用的连接（db_file -> 连接），请求结束时归还连接池
+_thread_local = threading.local()
+
+# 每个数据库文件的空闲连接池；请求线程用完即归还，下一个请求线程直接复用
+_pools: Dict[str, queue.Queue] = {}
+_pools_lock = threading.Lock()
+
+# 本进程内已完成建表的数据库文件
+_initialized_db_files = set()
+_init_lock = threading.Lock()
+
+# 连接参数
+DB_BUSY_TIMEOUT = 30  # 秒，写锁竞争时等待而不是立即报 database is locked
+DB_CACHED_STATEMENTS = 256  # 每条连接缓存的预编译语句数
+DB_POOL_SIZE = 8  # 每个数据库文件最多保留的空闲连接数
+# 每条新连接执行的 PRAGMA；journal_mode=WAL 写入数据库文件，只在 init_database 中设置一次
+DB_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",  # 约 16MB 页缓存
+    "PRAGMA mmap_size=268435456",  # 256MB 内存映射读
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def get_db_file() -> str:
+    """获取数据库文件路径"""
     base_dir = os.environ.get(
         "BASE_DIR",
         os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
     )
-    db_file = os.path.join(base_dir, "backend", "comics.db")
+    return os.path.join(base_dir, "backend", "comics.db")
+
+
+def _open_connection(db_file: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        db_file,
+        timeout=DB_BUSY_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=DB_CACHED_STATEMENTS,
+    )
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _get_pool(db_file: str) -> queue.Queue:
+    pool = _pools.get(db_file)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_file, queue.Queue(maxsize=DB_POOL_SIZE))
+    return pool
+
+
+def get_db_connection(db_file: Optional[str] = None) -> sqlite3.Connection:
+    """
+    获取当前线程的数据库连接
+
+    线程内多次调用返回同一条连接，首次调用时从连接池取出（池为空才新建）。
+    不要调用 close()；请求结束时由 release_db_connections() 归还连接池，
+    后台线程一直持有自己的连接。写操作使用 ``with conn:`` 提交或回滚。
+    """
+    db_file = db_file or get_db_file()
+
+    connections = getattr(_thread_local, "connections", None)
+    if connections is None:
+        connections = _thread_local.connections = {}
+
+    conn = connections.get(db_file)
+    if conn is None:
+        try:
+            conn = _get_pool(db_file).get_nowait()
+        except queue.Empty:
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
+            conn = _open_connection(db_file)
+        connections[db_file] = conn
+    return conn
+
+
+def release_db_connections():
+    """把当前线程持有的连接归还连接池（每个请求结束时调用），池已满时关闭"""
+    connections = getattr(_thread_local, "connections", None)
+    if not connections:
+        return
+
+    for db_file, conn in list(connections.items()):
+        del connections[db_file]
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            _get_pool(db_file).put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+
+def close_db_connection(db_file: Optional[str] = None):
+    """关闭当前线程的数据库连接（线程退出前可选调用）"""
+    connections = getattr(_thread_local, "connections", None) or {}
+    conn = connections.pop(db_file or get_db_file(), None)
+    if conn is not None:
+        conn.close()
+
+
+def init_database(db_file: Optional[str] = None):
+    """初始化数据库（每个进程每个数据库文件只建表一次）"""
+    db_file = db_file or get_db_file()
+
+    with _init_lock:
+        if db_file in _initialized_db_files:
+            return
+        # WAL 模式记录在数据库文件中，设置一次后所有连接都生效
+        get_db_connection(db_file).execute("PRAGMA journal_mode=WAL")
+        _create_tables(db_file)
+        _initialized_db_files.add(db_file)
 
-    # 确保目录存在
-    os.makedirs(os.path.dirname(db_file), exist_ok=True)
 
-    conn = sqlite3.connect(db_file)
+def _create_tables(db_file: str):
+    conn = get_db_connection(db_file)
     cursor = conn.cursor()
 
     # 创建已下载漫画表
@@ -43,6 +149,221 @@ def init_database():
         )
     """)
 
+    # 书架分页排序/筛选使用的索引
+    cursor.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_downloaded_comics_download_time
+            ON downloaded_comics (download_time, jm_id);
+        CREATE INDEX IF NOT EXISTS idx_downloaded_comics_last_read_time
+            ON downloaded_comics (COALESCE(last_read_time, ''), jm_id);
+        CREATE INDEX IF NOT EXISTS idx_downloaded_comics_title
+            ON downloaded_comics (title, jm_id);
+        CREATE INDEX IF NOT EXISTS idx_downloaded_comics_file_size
+            ON downloaded_comics (file_size, jm_id);
+        CREATE INDEX IF NOT EXISTS idx_downloaded_comics_favorites
+            ON downloaded_comics (favorites, jm_id);
+        CREATE INDEX IF NOT EXISTS idx_downloaded_comics_author
+            ON downloaded_comics (author);
+    """)
+
+    # 本地书架全文索引（外部内容表，由触发器与 downloaded_comics 同步）
+    _create_search_index(cursor)
+
+    # 创建标签/作者规范化表，用于按标签、作者筛选和分面统计
+    cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS comic_tags (
+            jm_id INTEGER NOT NULL,
+            tag_id INTEGER NOT NULL,
+            PRIMARY KEY (jm_id, tag_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_comic_tags_tag ON comic_tags (tag_id, jm_id);
+
+        CREATE TABLE IF NOT EXISTS authors (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS comic_authors (
+            jm_id INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            PRIMARY KEY (jm_id, author_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_comic_authors_author
+            ON comic_authors (author_id, jm_id);
+    """)
+
+    # 磁盘占用统计：disk_usage_dirs 记录每个目录直接包含的文件大小和 mtime，
+    # disk_usage 按 (scope, key) 汇总（书架漫画 album/jm_id、缓存区 cache/名称），
+    # 由触发器随目录记录增量维护
+    cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS disk_usage_dirs (
+            path TEXT PRIMARY KEY,
+            parent TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            file_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_disk_usage_dirs_parent
+            ON disk_usage_dirs (parent);
+
+        CREATE TABLE IF NOT EXISTS disk_usage (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            file_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, key)
+        );
+
+        CREATE TRIGGER IF NOT EXISTS disk_usage_dirs_ai AFTER INSERT ON disk_usage_dirs BEGIN
+            INSERT INTO disk_usage (scope, key, bytes, file_count)
+            VALUES (new.scope, new.key, new.bytes, new.file_count)
+            ON CONFLICT(scope, key) DO UPDATE SET
+                bytes = bytes + excluded.bytes,
+                file_count = file_count + excluded.file_count;
+        END;
+        CREATE TRIGGER IF NOT EXISTS disk_usage_dirs_ad AFTER DELETE ON disk_usage_dirs BEGIN
+            UPDATE disk_usage SET
+                bytes = bytes - old.bytes,
+                file_count = file_count - old.file_count
+            WHERE scope = old.scope AND key = old.key;
+        END;
+        CREATE TRIGGER IF NOT EXISTS disk_usage_dirs_au AFTER UPDATE OF bytes, file_count ON disk_usage_dirs BEGIN
+            UPDATE disk_usage SET
+                bytes = bytes - old.bytes,
+                file_count = file_count - old.file_count
+            WHERE scope = old.scope AND key = old.key;
+            INSERT INTO disk_usage (scope, key, bytes, file_count)
+            VALUES (new.scope, new.key, new.bytes, new.file_count)
+            ON CONFLICT(scope, key) DO UPDATE SET
+                bytes = bytes + excluded.bytes,
+                file_count = file_count + excluded.file_count;
+        END;
+
+        -- 书架排序用的 downloaded_comics.file_size 跟随漫画占用同步
+        CREATE TRIGGER IF NOT EXISTS disk_usage_album_ai AFTER INSERT ON disk_usage
+        WHEN new.scope = 'album' BEGIN
+            UPDATE downloaded_comics SET file_size = new.bytes
+            WHERE jm_id = CAST(new.key AS INTEGER);
+        END;
+        CREATE TRIGGER IF NOT EXISTS disk_usage_album_au AFTER UPDATE OF bytes ON disk_usage
+        WHEN new.scope = 'album' BEGIN
+            UPDATE downloaded_comics SET file_size = new.bytes
+            WHERE jm_id = CAST(new.key AS INTEGER);
+        END;
+    """)
+
+    # 创建漫画目录索引表（jm_id -> DownloadedComics 下的目录名）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS comic_dirs (
+            jm_id INTEGER PRIMARY KEY,
+            dirname TEXT NOT NULL,
+            update_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # 书架扫描状态：记录每本漫画目录的 inode、mtime 和各章节子目录的 mtime（JSON），
+    # 未变化的目录不再深入扫描
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS library_scan_state (
+            jm_id INTEGER PRIMARY KEY,
+            dirname TEXT NOT NULL,
+            inode INTEGER,
+            mtime_ns INTEGER,
+            chapter_mtimes TEXT
+        )
+    """)
+
+    # 待回收的已删除漫画目录（已重命名到回收区，由后台线程删除）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS trash_queue (
+            id INTEGER PRIMARY KEY,
+            jm_id INTEGER,
+            trash_path TEXT NOT NULL,
+            size INTEGER DEFAULT 0,
+            job_id TEXT,
+            create_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # 下载队列（按优先级从高到低、同优先级先进先出，重启后继续）
+    cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS download_queue (
+            id INTEGER PRIMARY KEY,
+            download_id TEXT UNIQUE NOT NULL,
+            jm_id INTEGER NOT NULL,
+            comic_info TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress INTEGER DEFAULT 0,
+            message TEXT,
+            create_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+            update_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_download_queue_status
+            ON download_queue (status, priority DESC, id);
+        CREATE INDEX IF NOT EXISTS idx_download_queue_jm_id
+            ON download_queue (jm_id);
+    """)
+
+    # 页面缩略图缓存索引（LRU 淘汰依据）
+    cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS derivative_cache (
+            key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_derivative_cache_last_access
+            ON derivative_cache (last_access);
+    """)
+
+    # PDF 导出缓存索引（LRU 淘汰依据）
+    cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS pdf_cache (
+            key TEXT PRIMARY KEY,
+            jm_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_pdf_cache_last_access
+            ON pdf_cache (last_access);
+        CREATE INDEX IF NOT EXISTS idx_pdf_cache_jm_id
+            ON pdf_cache (jm_id);
+    """)
+
+    # 创建页面清单表（每章节 页码 -> 文件名），根目录图片的章节记为 ""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS comic_pages (
+            jm_id INTEGER NOT NULL,
+            chapter_id TEXT NOT NULL,
+            page_num INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            file_size INTEGER DEFAULT 0,
+            mtime REAL DEFAULT 0,
+            data_offset INTEGER,
+            width INTEGER,
+            height INTEGER,
+            PRIMARY KEY (jm_id, chapter_id, page_num)
+        )
+    """)
+
+    # 创建章节表（下载时记录的JM章节顺序）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chapters (
+            jm_id INTEGER NOT NULL,
+            chapter_id TEXT NOT NULL,
+            title TEXT,
+            sort_index INTEGER NOT NULL,
+            update_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (jm_id, chapter_id)
+        )
+    """)
+
     # 创建搜索历史表
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS search_history (
@@ -99,7 +420,13 @@ def init_database():
         ("auto_cleanup_cache", "false", "自动清理缓存"),
         ("cache_size_limit", "104857600", "缓存大小限制(字节)"),
         ("image_quality", "85", "图片质量"),
-        ("enable_pdf_generation", "true", "启用PDF生成"),
+        ("derivative_cache_size_limit", "536870912", "页面缩略图缓存大小限制(字节)"),
+        ("enable_image_transcoding", "false", "按浏览器支持转码为WebP/AVIF"),
+        ("page_storage_mode", "loose", "章节存储方式(loose散图/packed打包为CBZ)"),
+        ("file_offload_mode", "none", "图片交给反向代理发送(none/x-accel-redirect/x-sendfile)"),
+        ("file_offload_prefix", "/_offload", "X-Accel-Redirect 内部路径前缀"),
+        ("enable_pdf_generation", "true", "启用PDF导出（首次导出时生成）"),
+        ("pdf_cache_size_limit", "2147483648", "PDF导出缓存大小限制(字节)"),
         ("theme", "light", "界面主题"),
     ]
 
@@ -113,38 +440,165 @@ def init_database():
         )
 
     conn.commit()
-    conn.close()
 
+    _run_migrations(conn)
+
+
+# 数据迁移，按 PRAGMA user_version 顺序执行
+SCHEMA_VERSION = 4
+
+
+def _run_migrations(conn: sqlite3.Connection):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    if version < 1:
+        # 把 downloaded_comics.tags / author 回填到规范化的标签、作者表
+        rows = conn.execute(
+            "SELECT jm_id, tags, author FROM downloaded_comics"
+        ).fetchall()
+        with conn:
+            for jm_id, tags, author in rows:
+                replace_comic_facets(
+                    conn,
+                    jm_id,
+                    tags.split(",") if tags else [],
+                    [author] if author else [],
+                )
+        if rows:
+            print(f"已回填 {len(rows)} 本漫画的标签和作者")
+
+    if version < 2:
+        # 页面清单记录打包章节中的数据偏移（散图为 NULL）
+        _add_column(conn, "comic_pages", "data_offset", "INTEGER")
+
+    if version < 3:
+        # 页面尺寸，旧清单在下次重建时补齐
+        _add_column(conn, "comic_pages", "width", "INTEGER")
+        _add_column(conn, "comic_pages", "height", "INTEGER")
+
+    if version < 4:
+        # 章节子目录的 mtime，旧记录在下次扫描时补齐
+        _add_column(conn, "library_scan_state", "chapter_mtimes", "TEXT")
+
+    if version < SCHEMA_VERSION:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """表中没有该列时添加（新库建表时已包含）"""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        with conn:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def replace_comic_facets(conn: sqlite3.Connection, jm_id: int, tags, authors):
+    """
+    替换漫画的标签和作者关联（需在调用方的事务内执行）
+
+    Args:
+        conn: 数据库连接
+        jm_id: 漫画ID
+        tags: 标签名列表
+        authors: 作者名列表
+    """
+    tags = [tag.strip() for tag in tags if tag and tag.strip()]
+    authors = [author.strip() for author in authors if author and author.strip()]
+
+    conn.execute("DELETE FROM comic_tags WHERE jm_id = ?", (jm_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO tags (name) VALUES (?)", [(tag,) for tag in tags]
+    )
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO comic_tags (jm_id, tag_id)
+        SELECT ?, id FROM tags WHERE name = ?
+    """,
+        [(jm_id, tag) for tag in tags],
+    )
 
-def get_db_connection():
-    """获取数据库连接"""
-    base_dir = os.environ.get(
-        "BASE_DIR",
-        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    conn.execute("DELETE FROM comic_authors WHERE jm_id = ?", (jm_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO authors (name) VALUES (?)",
+        [(author,) for author in authors],
     )
-    db_file = os.path.join(base_dir, "backend", "comics.db")
-    return sqlite3.connect(db_file, check_same_thread=False)
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO comic_authors (jm_id, author_id)
+        SELECT ?, id FROM authors WHERE name = ?
+    """,
+        [(jm_id, author) for author in authors],
+    )
+
+
+def _create_search_index(cursor):
+    """创建 FTS5 全文索引；SQLite 不支持 trigram 分词时退回 unicode61"""
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'downloaded_comics_fts'"
+    ).fetchone()
+    if not exists:
+        # trigram 支持中日文任意位置的子串匹配，unicode61 只能按词前缀匹配
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                cursor.execute(f"""
+                    CREATE VIRTUAL TABLE downloaded_comics_fts USING fts5(
+                        title, author, tags, description,
+                        content='downloaded_comics',
+                        content_rowid='id',
+                        tokenize='{tokenizer}'
+                    )
+                """)
+                break
+            except sqlite3.OperationalError as e:
+                print(f"创建全文索引失败 ({tokenizer}): {e}")
+        else:
+            return
+
+        # 为已有记录建立索引
+        cursor.execute(
+            "INSERT INTO downloaded_comics_fts(downloaded_comics_fts) VALUES ('rebuild')"
+        )
+
+    cursor.executescript("""
+        CREATE TRIGGER IF NOT EXISTS downloaded_comics_fts_ai
+        AFTER INSERT ON downloaded_comics BEGIN
+            INSERT INTO downloaded_comics_fts (rowid, title, author, tags, description)
+            VALUES (new.id, new.title, new.author, new.tags, new.description);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS downloaded_comics_fts_ad
+        AFTER DELETE ON downloaded_comics BEGIN
+            INSERT INTO downloaded_comics_fts
+                (downloaded_comics_fts, rowid, title, author, tags, description)
+            VALUES ('delete', old.id, old.title, old.author, old.tags, old.description);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS downloaded_comics_fts_au
+        AFTER UPDATE OF title, author, tags, description ON downloaded_comics BEGIN
+            INSERT INTO downloaded_comics_fts
+                (downloaded_comics_fts, rowid, title, author, tags, description)
+            VALUES ('delete', old.id, old.title, old.author, old.tags, old.description);
+            INSERT INTO downloaded_comics_fts (rowid, title, author, tags, description)
+            VALUES (new.id, new.title, new.author, new.tags, new.description);
+        END;
+    """)
 
 
 def add_search_history(search_type: str, search_content: str, results_count: int = 0):
     """添加搜索历史"""
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     try:
-        cursor.execute(
-            """
-            INSERT INTO search_history (search_type, search_content, results_count)
-            VALUES (?, ?, ?)
-        """,
-            (search_type, search_content, results_count),
-        )
-
-        conn.commit()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO search_history (search_type, search_content, results_count)
+                VALUES (?, ?, ?)
+            """,
+                (search_type, search_content, results_count),
+            )
     except Exception as e:
         print(f"添加搜索历史失败: {e}")
-    finally:
-        conn.close()
 
 
 def add_download_history(
@@ -152,117 +606,99 @@ def add_download_history(
 ):
     """添加下载历史"""
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     try:
-        if status == "completed":
-            cursor.execute(
-                """
-                INSERT INTO download_history (jm_id, title, download_status, complete_time)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            """,
-                (jm_id, title, status),
-            )
-        else:
-            cursor.execute(
-                """
-                INSERT INTO download_history (jm_id, title, download_status, error_message)
-                VALUES (?, ?, ?, ?)
-            """,
-                (jm_id, title, status, error_message),
-            )
-
-        conn.commit()
+        with conn:
+            if status == "completed":
+                conn.execute(
+                    """
+                    INSERT INTO download_history (jm_id, title, download_status, complete_time)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                """,
+                    (jm_id, title, status),
+                )
+            else:
+                conn.execute(
+                    """
+                    INSERT INTO download_history (jm_id, title, download_status, error_message)
+                    VALUES (?, ?, ?, ?)
+                """,
+                    (jm_id, title, status, error_message),
+                )
     except Exception as e:
         print(f"添加下载历史失败: {e}")
-    finally:
-        conn.close()
 
 
 def add_reading_history(jm_id: int, page_number: int):
     """添加阅读历史"""
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     try:
-        cursor.execute(
-            """
-            INSERT INTO reading_history (jm_id, page_number)
-            VALUES (?, ?)
-        """,
-            (jm_id, page_number),
-        )
-
-        conn.commit()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO reading_history (jm_id, page_number)
+                VALUES (?, ?)
+            """,
+                (jm_id, page_number),
+            )
     except Exception as e:
         print(f"添加阅读历史失败: {e}")
-    finally:
-        conn.close()
 
 
 def get_system_config(key: str) -> Optional[str]:
     """获取系统配置"""
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     try:
-        cursor.execute("SELECT value FROM system_config WHERE key = ?", (key,))
-        result = cursor.fetchone()
+        result = conn.execute(
+            "SELECT value FROM system_config WHERE key = ?", (key,)
+        ).fetchone()
         return result[0] if result else None
     except Exception as e:
         print(f"获取系统配置失败: {e}")
         return None
-    finally:
-        conn.close()
 
 
 def set_system_config(key: str, value: str):
     """设置系统配置"""
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     try:
-        cursor.execute(
-            """
-            INSERT OR REPLACE INTO system_config (key, value, update_time)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        """,
-            (key, value),
-        )
-
-        conn.commit()
+        with conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO system_config (key, value, update_time)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            """,
+                (key, value),
+            )
     except Exception as e:
         print(f"设置系统配置失败: {e}")
-    finally:
-        conn.close()
 
 
 def cleanup_old_records(days: int = 30):
     """清理旧记录"""
     conn = get_db_connection()
-    cursor = conn.cursor()
 
     try:
-        # 清理30天前的搜索历史
-        cursor.execute(
-            """
-            DELETE FROM search_history 
-            WHERE search_time < datetime('now', '-' || ? || ' days')
-        """,
-            (days,),
-        )
-
-        # 清理30天前的阅读历史
-        cursor.execute(
-            """
-            DELETE FROM reading_history 
-            WHERE read_time < datetime('now', '-' || ? || ' days')
-        """,
-            (days,),
-        )
+        with conn:
+            # 清理30天前的搜索历史
+            conn.execute(
+                """
+                DELETE FROM search_history 
+                WHERE search_time < datetime('now', '-' || ? || ' days')
+            """,
+                (days,),
+            )
 
-        conn.commit()
+            # 清理30天前的阅读历史
+            conn.execute(
+                """
+                DELETE FROM reading_history 
+                WHERE read_time < datetime('now', '-' || ? || ' days')
+            """,
+                (days,),
+            )
     except Exception as e:
         print(f"清理旧记录失败: {e}")
-    finally:
-        conn.close()
@@ -5,11 +5,82 @@
 """
 
 import os
+import base64
+import hashlib
+import html
 import json
+import re
 import shutil
-from typing import List, Dict, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterable, Optional, Tuple
 from datetime import datetime
-import jmcomic
+from PIL import Image
+
+try:
+    from models.database import (
+        get_db_connection,
+        init_database,
+        replace_comic_facets,
+    )
+except ImportError:
+    from backend.models.database import (
+        get_db_connection,
+        init_database,
+        replace_comic_facets,
+    )
+
+try:
+    from services.disk_usage import DiskUsageTracker
+    from services.pdf_builder import build_pdf
+    from services.page_store import (
+        PageRef,
+        container_chapter_id,
+        container_path,
+        container_reader,
+        pack_chapter,
+        read_container_index,
+    )
+except ImportError:
+    from backend.services.disk_usage import DiskUsageTracker
+    from backend.services.pdf_builder import build_pdf
+    from backend.services.page_store import (
+        PageRef,
+        container_chapter_id,
+        container_path,
+        container_reader,
+        pack_chapter,
+        read_container_index,
+    )
+
+# 支持的图片扩展名
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
+
+# 读取页面尺寸（只解析图片头部）的并发线程数
+PAGE_PROBE_WORKERS = 8
+
+# 同一漫画两次刷新章节元数据之间的最小间隔（秒）
+CHAPTER_REFRESH_INTERVAL = 600
+
+# 索引未命中时两次重建目录索引之间的最小间隔（秒），其余时间由书架扫描负责同步
+DIR_INDEX_REBUILD_INTERVAL = 30
+
+# 书架列表可用的排序字段 -> SQL 排序表达式（均有对应索引）
+LIBRARY_SORT_KEYS = {
+    "download_time": "download_time",
+    "last_read_time": "COALESCE(last_read_time, '')",
+    "title": "title",
+    "file_size": "file_size",
+    "favorites": "favorites",
+}
+
+# 书架分页的最大每页数量
+LIBRARY_MAX_PAGE_SIZE = 200
+
+# 全文搜索高亮标记（渲染前替换为 <mark>，避免与标题中的HTML冲突）
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
 
 
 class ComicManager:
@@ -32,238 +103,719 @@ class ComicManager:
         os.makedirs(self.downloaded_dir, exist_ok=True)
         os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
 
+        # jm_id -> 漫画目录名 的内存索引，与 comic_dirs 表保持一致
+        self._dir_index: Dict[int, str] = {}
+        self._dir_index_lock = threading.Lock()
+        # 上次因索引未命中而重建的时间（time.monotonic）
+        self._last_index_rebuild = 0.0
+
+        # 全文索引使用的分词器，首次搜索时检测
+        self._search_tokenizer: Optional[str] = None
+
+        # jm_id -> 上次从JM刷新章节元数据的时间
+        self._chapter_refresh_times: Dict[int, float] = {}
+        # 访问JM使用的 JMCrawler，由应用注入共享实例，未注入时首次使用时创建
+        self.jm_crawler = None
+
+        # jm_id -> 页面版本号，页面清单重建时失效
+        self._page_versions: Dict[int, str] = {}
+
         # 初始化数据库
         self._init_database()
+        self._load_dir_index()
+
+        # 书架磁盘占用统计（按漫画增量维护）
+        self.disk_usage = DiskUsageTracker(self.db_file)
+        self.disk_usage.register_library(self.downloaded_dir)
 
     def _init_database(self):
-        """初始化数据库"""
-        import sqlite3
-
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        # 创建已下载漫画表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS downloaded_comics (
-                id INTEGER PRIMARY KEY,
-                jm_id INTEGER UNIQUE NOT NULL,
-                title TEXT NOT NULL,
-                author TEXT,
-                tags TEXT,
-                description TEXT,
-                favorites INTEGER DEFAULT 0,
-                pages INTEGER DEFAULT 0,
-                cover_path TEXT,
-                comic_path TEXT,
-                download_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_read_time DATETIME,
-                read_progress INTEGER DEFAULT 0,
-                file_size INTEGER DEFAULT 0
-            )
-        """)
+        """初始化数据库（建表在每个进程内只执行一次）"""
+        init_database(self.db_file)
 
-        conn.commit()
-        conn.close()
+    def _load_dir_index(self):
+        """从数据库加载目录索引，索引为空时扫描一次目录重建"""
+        conn = get_db_connection(self.db_file)
+        rows = conn.execute("SELECT jm_id, dirname FROM comic_dirs").fetchall()
 
-    def is_comic_downloaded(self, jm_id: int) -> bool:
-        """检查漫画是否已下载"""
-        import sqlite3
+        with self._dir_index_lock:
+            self._dir_index = {jm_id: dirname for jm_id, dirname in rows}
+
+        if not rows:
+            self.rebuild_dir_index()
+
+    def rebuild_dir_index(
+        self, listing: Optional[Dict[int, str]] = None, keep: Iterable[int] = ()
+    ) -> int:
+        """
+        重建目录索引，返回索引条目数
+
+        Args:
+            listing: 已列出的 jm_id -> 目录名（书架扫描传入），为 None 时扫描 DownloadedComics
+            keep: 保留现有索引条目的 jm_id（例如扫描期间正在下载、刚登记的漫画）
+        """
+
+        if listing is not None:
+            index = dict(listing)
+        else:
+            index = {}
+            try:
+                for dirname in os.listdir(self.downloaded_dir):
+                    match = re.match(r"^(\d+)_", dirname)
+                    if not match:
+                        continue
+                    if not os.path.isdir(os.path.join(self.downloaded_dir, dirname)):
+                        continue
+                    index.setdefault(int(match.group(1)), dirname)
+            except Exception as e:
+                print(f"扫描漫画目录失败: {e}")
+                return len(self._dir_index)
+
+        for jm_id in keep:
+            if jm_id in self._dir_index:
+                index[jm_id] = self._dir_index[jm_id]
+
+        conn = get_db_connection(self.db_file)
+        try:
+            with conn:
+                conn.execute("DELETE FROM comic_dirs")
+                conn.executemany(
+                    "INSERT INTO comic_dirs (jm_id, dirname) VALUES (?, ?)",
+                    index.items(),
+                )
+        except Exception as e:
+            print(f"保存目录索引失败: {e}")
+
+        with self._dir_index_lock:
+            self._dir_index = index
+
+        print(f"重建漫画目录索引，共 {len(index)} 个目录")
+        return len(index)
+
+    def _register_comic_dir(self, jm_id: int, comic_dir: str):
+        """登记漫画目录到索引"""
+
+        dirname = os.path.basename(os.path.normpath(comic_dir))
+        with self._dir_index_lock:
+            self._dir_index[jm_id] = dirname
+
+        conn = get_db_connection(self.db_file)
+        try:
+            with conn:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO comic_dirs (jm_id, dirname, update_time)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                """,
+                    (jm_id, dirname),
+                )
+        except Exception as e:
+            print(f"登记漫画目录失败 {jm_id}: {e}")
+
+    def _unregister_comic_dir(self, jm_id: int):
+        """从索引移除漫画目录"""
+
+        with self._dir_index_lock:
+            self._dir_index.pop(jm_id, None)
+
+        conn = get_db_connection(self.db_file)
+        try:
+            with conn:
+                conn.execute("DELETE FROM comic_dirs WHERE jm_id = ?", (jm_id,))
+        except Exception as e:
+            print(f"移除漫画目录索引失败 {jm_id}: {e}")
 
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+    def find_comic_dir(self, jm_id: int, rebuild: bool = True) -> Optional[str]:
+        """
+        通过索引查找漫画目录
 
-        cursor.execute("SELECT id FROM downloaded_comics WHERE jm_id = ?", (jm_id,))
-        result = cursor.fetchone()
+        Args:
+            jm_id: 漫画ID
+            rebuild: 索引未命中或已失效时是否重建索引后再查一次；
+                重建最多每 DIR_INDEX_REBUILD_INTERVAL 秒一次，其余未命中直接返回 None
 
-        conn.close()
+        Returns:
+            漫画目录绝对路径，不存在则返回None
+        """
+        dirname = self._dir_index.get(jm_id)
+        if dirname:
+            comic_dir = os.path.join(self.downloaded_dir, dirname)
+            if os.path.isdir(comic_dir):
+                return comic_dir
+
+        if not rebuild:
+            return None
 
+        # 不存在的漫画每次请求都会未命中，限制重建频率，避免每个请求都扫描书架目录
+        with self._dir_index_lock:
+            now = time.monotonic()
+            if now - self._last_index_rebuild < DIR_INDEX_REBUILD_INTERVAL:
+                return None
+            self._last_index_rebuild = now
+
+        self.rebuild_dir_index()
+        dirname = self._dir_index.get(jm_id)
+        return os.path.join(self.downloaded_dir, dirname) if dirname else None
+
+    def has_comic_record(self, jm_id: int) -> bool:
+        """数据库中是否有该漫画的记录（不检查目录是否存在）"""
+        conn = get_db_connection(self.db_file)
+        result = conn.execute(
+            "SELECT id FROM downloaded_comics WHERE jm_id = ?", (jm_id,)
+        ).fetchone()
+        return result is not None
+
+    def is_comic_downloaded(self, jm_id: int) -> bool:
+        """检查漫画是否已下载"""
         # 同时检查文件是否存在
-        if result:
-            comic_dir = os.path.join(self.downloaded_dir, f"{jm_id}_")
-            for dirname in os.listdir(self.downloaded_dir):
-                if dirname.startswith(f"{jm_id}_"):
-                    return True
+        if self.has_comic_record(jm_id):
+            return self.find_comic_dir(jm_id) is not None
 
         return False
 
-    def add_downloaded_comic(self, jm_id: int, comic_info: dict):
+    def add_downloaded_comic(
+        self, jm_id: int, comic_info: dict, comic_dir: Optional[str] = None
+    ):
         """添加已下载漫画到数据库"""
-        import sqlite3
-
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        conn = get_db_connection(self.db_file)
 
         try:
             # 找到漫画目录
-            comic_dir = None
-            for dirname in os.listdir(self.downloaded_dir):
-                if dirname.startswith(f"{jm_id}_"):
-                    comic_dir = os.path.join(self.downloaded_dir, dirname)
-                    break
+            if not comic_dir or not os.path.isdir(comic_dir):
+                comic_dir = self.find_comic_dir(jm_id)
 
             if not comic_dir:
                 return False
 
-            # 查找PDF文件
-            pdf_path = None
-            for filename in os.listdir(comic_dir):
-                if filename.endswith(".pdf"):
-                    pdf_path = os.path.join(comic_dir, filename)
-                    break
+            self._register_comic_dir(jm_id, comic_dir)
+            self.build_page_manifest(jm_id, comic_dir)
+            if comic_info.get("chapters"):
+                self.save_chapter_order(jm_id, comic_info["chapters"])
 
-            # 查找封面
-            cover_path = None
-            if os.path.exists(os.path.join(comic_dir, "cover.jpg")):
-                cover_path = os.path.join(comic_dir, "cover.jpg")
+            cover_path, pdf_path = self._find_comic_files(comic_dir)
 
-            # 计算文件总大小
-            file_size = 0
-            try:
-                for root, dirs, files in os.walk(comic_dir):
-                    for filename in files:
-                        file_path = os.path.join(root, filename)
-                        if os.path.isfile(file_path):
-                            file_size += os.path.getsize(file_path)
-            except Exception as e:
-                print(f"计算文件大小失败: {e}")
-                file_size = 0
+            # 文件总大小取自磁盘占用统计，只扫描新写入或变化过的目录
+            self.disk_usage.refresh(comic_dir)
+            file_size = self.disk_usage.get_usage("album", jm_id)
 
             # 插入数据库
-            cursor.execute(
+            with conn:
+                # 使用 UPSERT 而不是 INSERT OR REPLACE，保证全文索引触发器生效
+                conn.execute(
+                    """
+                    INSERT INTO downloaded_comics 
+                    (jm_id, title, author, tags, description, favorites, pages, cover_path, comic_path, file_size)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(jm_id) DO UPDATE SET
+                        title = excluded.title,
+                        author = excluded.author,
+                        tags = excluded.tags,
+                        description = excluded.description,
+                        favorites = excluded.favorites,
+                        pages = excluded.pages,
+                        cover_path = excluded.cover_path,
+                        comic_path = excluded.comic_path,
+                        file_size = excluded.file_size,
+                        download_time = CURRENT_TIMESTAMP,
+                        last_read_time = NULL,
+                        read_progress = 0
+                """,
+                    (
+                        jm_id,
+                        comic_info.get("title", ""),
+                        comic_info.get("author", ""),
+                        ",".join(comic_info.get("tags", [])),
+                        comic_info.get("description", ""),
+                        comic_info.get("favorites", 0),
+                        comic_info.get("pages", 0),
+                        cover_path,
+                        pdf_path,
+                        file_size,
+                    ),
+                )
+                replace_comic_facets(
+                    conn,
+                    jm_id,
+                    comic_info.get("tags", []),
+                    comic_info.get("authors") or [comic_info.get("author", "")],
+                )
+            self.save_scan_state(jm_id, comic_dir)
+
+            return True
+
+        except Exception as e:
+            print(f"添加已下载漫画失败 {jm_id}: {e}")
+            return False
+
+    def _find_comic_files(self, comic_dir: str) -> tuple:
+        """查找漫画目录下的封面和PDF，返回 (cover_path, pdf_path)"""
+        pdf_path = None
+        for filename in os.listdir(comic_dir):
+            if filename.endswith(".pdf"):
+                pdf_path = os.path.join(comic_dir, filename)
+                break
+
+        cover_path = None
+        if os.path.exists(os.path.join(comic_dir, "cover.jpg")):
+            cover_path = os.path.join(comic_dir, "cover.jpg")
+
+        return cover_path, pdf_path
+
+    def refresh_comic_files(self, jm_id: int, comic_dir: str) -> bool:
+        """
+        漫画目录内容变化后同步数据库（页面清单、占用空间、封面和PDF路径）
+
+        不会重置下载时间和阅读进度。
+        """
+        try:
+            self._register_comic_dir(jm_id, comic_dir)
+            self.build_page_manifest(jm_id, comic_dir)
+            self.disk_usage.refresh(comic_dir)
+            cover_path, pdf_path = self._find_comic_files(comic_dir)
+
+            conn = get_db_connection(self.db_file)
+            with conn:
+                conn.execute(
+                    """
+                    UPDATE downloaded_comics
+                    SET cover_path = ?, comic_path = ?, file_size = ?
+                    WHERE jm_id = ?
+                """,
+                    (
+                        cover_path,
+                        pdf_path,
+                        self.disk_usage.get_usage("album", jm_id),
+                        jm_id,
+                    ),
+                )
+            self.save_scan_state(jm_id, comic_dir)
+            return True
+        except Exception as e:
+            print(f"同步漫画文件失败 {jm_id}: {e}")
+            return False
+
+    @staticmethod
+    def chapter_mtimes(comic_dir: str) -> str:
+        """
+        章节子目录的 mtime（JSON，按目录名排序）
+
+        章节内增删图片只改变章节子目录的 mtime，不改变漫画目录本身，书架扫描需要同时比较。
+        """
+        mtimes = {}
+        with os.scandir(comic_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    mtimes[entry.name] = entry.stat(follow_symlinks=False).st_mtime_ns
+        return json.dumps(mtimes, sort_keys=True)
+
+    def save_scan_state(self, jm_id: int, comic_dir: str):
+        """记录漫画目录和章节子目录的 inode、mtime，书架扫描据此跳过未变化的目录"""
+        try:
+            stat = os.stat(comic_dir)
+            chapter_mtimes = self.chapter_mtimes(comic_dir)
+        except OSError:
+            return
+
+        conn = get_db_connection(self.db_file)
+        with conn:
+            conn.execute(
                 """
-                INSERT OR REPLACE INTO downloaded_comics 
-                (jm_id, title, author, tags, description, favorites, pages, cover_path, comic_path, file_size)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT OR REPLACE INTO library_scan_state
+                (jm_id, dirname, inode, mtime_ns, chapter_mtimes)
+                VALUES (?, ?, ?, ?, ?)
             """,
                 (
                     jm_id,
-                    comic_info.get("title", ""),
-                    comic_info.get("author", ""),
-                    ",".join(comic_info.get("tags", [])),
-                    comic_info.get("description", ""),
-                    comic_info.get("favorites", 0),
-                    comic_info.get("pages", 0),
-                    cover_path,
-                    pdf_path,
-                    file_size,
+                    os.path.basename(os.path.normpath(comic_dir)),
+                    stat.st_ino,
+                    stat.st_mtime_ns,
+                    chapter_mtimes,
                 ),
             )
 
-            conn.commit()
-            return True
+    def remove_comic_record(self, jm_id: int):
+        """从数据库和索引中移除漫画（不删除文件）"""
+        comic_dir = None
+        dirname = self._dir_index.get(jm_id)
+        if dirname:
+            comic_dir = os.path.join(self.downloaded_dir, dirname)
+
+        conn = get_db_connection(self.db_file)
+        with conn:
+            conn.execute("DELETE FROM downloaded_comics WHERE jm_id = ?", (jm_id,))
+            conn.execute("DELETE FROM comic_pages WHERE jm_id = ?", (jm_id,))
+            conn.execute("DELETE FROM chapters WHERE jm_id = ?", (jm_id,))
+            conn.execute("DELETE FROM comic_tags WHERE jm_id = ?", (jm_id,))
+            conn.execute("DELETE FROM comic_authors WHERE jm_id = ?", (jm_id,))
+            conn.execute("DELETE FROM library_scan_state WHERE jm_id = ?", (jm_id,))
+
+        self._unregister_comic_dir(jm_id)
+        self._page_versions.pop(jm_id, None)
+        if comic_dir:
+            container_reader.close_under(comic_dir)
+            if not os.path.exists(comic_dir):
+                self.disk_usage.forget(comic_dir)
+
+    # 列表查询使用的字段，顺序与 _row_to_comic 一致
+    _COMIC_COLUMNS = """
+        jm_id, title, author, tags, favorites, pages, cover_path,
+        download_time, last_read_time, read_progress, file_size
+    """
+
+    @classmethod
+    def _qualified_columns(cls, alias: str) -> str:
+        return ", ".join(
+            f"{alias}.{column.strip()}" for column in cls._COMIC_COLUMNS.split(",")
+        )
 
-        except Exception as e:
-            print(f"添加已下载漫画失败 {jm_id}: {e}")
-            return False
-        finally:
-            conn.close()
+    def _row_to_comic(self, row) -> Dict:
+        (
+            jm_id,
+            title,
+            author,
+            tags,
+            favorites,
+            pages,
+            cover_path,
+            download_time,
+            last_read_time,
+            read_progress,
+            file_size,
+        ) = row
+        return {
+            "id": jm_id,
+            "title": title,
+            "author": author,
+            "tags": tags.split(",") if tags else [],
+            "favorites": favorites,
+            "pages": pages,
+            "cover_path": cover_path,
+            "download_time": download_time,
+            "last_read_time": last_read_time,
+            "read_progress": read_progress,
+            "file_size": file_size,
+        }
+
+    def _visible_comics(self, rows) -> List[Dict]:
+        """
+        过滤掉目录已不存在的记录（只查内存索引，不访问文件系统）
+
+        索引与磁盘不一致的记录由书架扫描（LibraryScanner）同步，这里不重建索引。
+        """
+        return [self._row_to_comic(row) for row in rows if row[0] in self._dir_index]
 
     def get_downloaded_comics(self) -> List[Dict]:
         """获取已下载漫画列表"""
-        import sqlite3
-
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        conn = get_db_connection(self.db_file)
 
         try:
-            cursor.execute("""
-                SELECT jm_id, title, author, tags, favorites, pages,
-                       download_time, last_read_time, read_progress, file_size
+            rows = conn.execute(f"""
+                SELECT {self._COMIC_COLUMNS}
                 FROM downloaded_comics
                 ORDER BY download_time DESC
+            """).fetchall()
+            return self._visible_comics(rows)
+
+        except Exception as e:
+            print(f"获取已下载漫画列表失败: {e}")
+            return []
+
+    def get_downloaded_comic(self, jm_id: int) -> Optional[Dict]:
+        """获取单本已下载漫画的信息"""
+        conn = get_db_connection(self.db_file)
+        row = conn.execute(
+            f"SELECT {self._COMIC_COLUMNS} FROM downloaded_comics WHERE jm_id = ?",
+            (jm_id,),
+        ).fetchone()
+        if not row or not self.find_comic_dir(jm_id):
+            return None
+        return self._row_to_comic(row)
+
+    def query_downloaded_comics(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        sort: str = "download_time",
+        order: str = "desc",
+        author: Optional[str] = None,
+        tag: Optional[str] = None,
+        unread: bool = False,
+    ) -> Dict:
+        """
+        分页查询已下载漫画（键集分页，排序和筛选都在SQL中完成）
+
+        Args:
+            limit: 每页数量
+            cursor: 上一页返回的 next_cursor
+            sort: 排序字段，见 LIBRARY_SORT_KEYS
+            order: asc 或 desc
+            author: 按作者筛选
+            tag: 按标签筛选
+            unread: 只返回未读漫画
+
+        Returns:
+            {"items": [...], "next_cursor": str|None, "stats": {...}}
+        """
+        sort_expr = LIBRARY_SORT_KEYS.get(sort, LIBRARY_SORT_KEYS["download_time"])
+        descending = order != "asc"
+        direction = "DESC" if descending else "ASC"
+        limit = max(1, min(int(limit), LIBRARY_MAX_PAGE_SIZE))
+
+        where = []
+        params = []
+        if author:
+            where.append("""
+                jm_id IN (
+                    SELECT ca.jm_id FROM comic_authors ca
+                    JOIN authors a ON a.id = ca.author_id
+                    WHERE a.name = ?
+                )
             """)
+            params.append(author)
+        if tag:
+            where.append("""
+                jm_id IN (
+                    SELECT ct.jm_id FROM comic_tags ct
+                    JOIN tags t ON t.id = ct.tag_id
+                    WHERE t.name = ?
+                )
+            """)
+            params.append(tag)
+        if unread:
+            where.append("last_read_time IS NULL")
+
+        conn = get_db_connection(self.db_file)
+
+        # 统计信息只按筛选条件计算，与游标无关
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        count, total_pages, total_size = conn.execute(
+            f"""
+            SELECT COUNT(*), COALESCE(SUM(pages), 0), COALESCE(SUM(file_size), 0)
+            FROM downloaded_comics {where_sql}
+        """,
+            params,
+        ).fetchone()
+
+        if cursor:
+            last_value, last_id = self._decode_cursor(cursor)
+            where.append(f"({sort_expr}, jm_id) {'<' if descending else '>'} (?, ?)")
+            params.extend([last_value, last_id])
+
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        rows = conn.execute(
+            f"""
+            SELECT {self._COMIC_COLUMNS}, {sort_expr}
+            FROM downloaded_comics {where_sql}
+            ORDER BY {sort_expr} {direction}, jm_id {direction}
+            LIMIT ?
+        """,
+            params + [limit + 1],
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1][-1], rows[-1][0])
+
+        return {
+            "items": self._visible_comics([row[:-1] for row in rows]),
+            "next_cursor": next_cursor,
+            "stats": {
+                "count": count,
+                "pages": total_pages,
+                "file_size": total_size,
+            },
+        }
+
+    def get_tag_facets(self, limit: int = 100) -> List[Dict]:
+        """按漫画数量统计标签（走 comic_tags 的 tag_id 索引分组）"""
+        return self._get_facets("tags", "comic_tags", "tag_id", limit)
+
+    def get_author_facets(self, limit: int = 100) -> List[Dict]:
+        """按漫画数量统计作者"""
+        return self._get_facets("authors", "comic_authors", "author_id", limit)
+
+    def _get_facets(
+        self, table: str, link_table: str, key: str, limit: int
+    ) -> List[Dict]:
+        limit = max(1, min(int(limit), LIBRARY_MAX_PAGE_SIZE * 5))
+        conn = get_db_connection(self.db_file)
+        rows = conn.execute(
+            f"""
+            SELECT f.name, c.count
+            FROM (
+                SELECT {key}, COUNT(*) AS count
+                FROM {link_table}
+                GROUP BY {key}
+            ) c
+            JOIN {table} f ON f.id = c.{key}
+            ORDER BY c.count DESC, f.name
+            LIMIT ?
+        """,
+            (limit,),
+        ).fetchall()
+        return [{"name": name, "count": count} for name, count in rows]
+
+    def search_downloaded_comics(self, keyword: str, limit: int = 50) -> List[Dict]:
+        """
+        全文搜索本地书架（标题、作者、标签、简介）
 
-            comics = []
-            for row in cursor.fetchall():
-                (
-                    jm_id,
-                    title,
-                    author,
-                    tags,
-                    favorites,
-                    pages,
-                    download_time,
-                    last_read_time,
-                    read_progress,
-                    file_size,
-                ) = row
-
-                # 检查文件是否存在
-                comic_dir = None
-                for dirname in os.listdir(self.downloaded_dir):
-                    if dirname.startswith(f"{jm_id}_"):
-                        comic_dir = os.path.join(self.downloaded_dir, dirname)
-                        break
+        Args:
+            keyword: 搜索关键词，空格分隔多个词，全部命中才返回
+            limit: 最大返回数量
 
-                if comic_dir:
-                    # 查找封面
-                    cover_path = None
-                    if os.path.exists(os.path.join(comic_dir, "cover.jpg")):
-                        cover_path = os.path.join(comic_dir, "cover.jpg")
+        Returns:
+            按相关度排序的漫画列表，每项附带 highlight（标题高亮与简介片段）
+        """
+        terms = keyword.split()
+        if not terms:
+            return []
+        limit = max(1, min(int(limit), LIBRARY_MAX_PAGE_SIZE))
+
+        conn = get_db_connection(self.db_file)
+        if self._search_tokenizer is None:
+            row = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'downloaded_comics_fts'"
+            ).fetchone()
+            self._search_tokenizer = (
+                "trigram" if row and "trigram" in row[0] else "unicode61"
+            )
 
-                    comics.append(
-                        {
-                            "id": jm_id,
-                            "title": title,
-                            "author": author,
-                            "tags": tags.split(",") if tags else [],
-                            "favorites": favorites,
-                            "pages": pages,
-                            "cover_path": cover_path,
-                            "download_time": download_time,
-                            "last_read_time": last_read_time,
-                            "read_progress": read_progress,
-                            "file_size": file_size,
-                        }
-                    )
+        # trigram 至少需要3个字符，短词退回 LIKE 查询
+        if self._search_tokenizer == "trigram" and any(len(t) < 3 for t in terms):
+            return self._search_downloaded_comics_like(conn, terms, limit)
 
-            return comics
+        # 每个词作为短语匹配；unicode61 分词下再加前缀匹配
+        suffix = "" if self._search_tokenizer == "trigram" else "*"
+        match_expr = " ".join(
+            '"' + term.replace('"', '""') + '"' + suffix for term in terms
+        )
+
+        rows = conn.execute(
+            f"""
+            SELECT {self._qualified_columns("c")},
+                   highlight(downloaded_comics_fts, 0, ?, ?),
+                   snippet(downloaded_comics_fts, 3, ?, ?, '…', 24)
+            FROM downloaded_comics_fts
+            JOIN downloaded_comics c ON c.id = downloaded_comics_fts.rowid
+            WHERE downloaded_comics_fts MATCH ?
+            ORDER BY bm25(downloaded_comics_fts, 10.0, 5.0, 3.0, 1.0)
+            LIMIT ?
+        """,
+            (
+                HIGHLIGHT_START,
+                HIGHLIGHT_END,
+                HIGHLIGHT_START,
+                HIGHLIGHT_END,
+                match_expr,
+                limit,
+            ),
+        ).fetchall()
+
+        comics = self._visible_comics([row[:-2] for row in rows])
+        highlights = {
+            row[0]: {
+                "title": self._render_highlight(row[-2]),
+                "snippet": self._render_highlight(row[-1]),
+            }
+            for row in rows
+        }
+        for comic in comics:
+            comic["highlight"] = highlights[comic["id"]]
+        return comics
+
+    def _search_downloaded_comics_like(self, conn, terms: List[str], limit: int):
+        """短关键词的后备搜索：LIKE 匹配，按下载时间排序"""
+        where = []
+        params = []
+        for term in terms:
+            escaped = (
+                term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            )
+            pattern = f"%{escaped}%"
+            where.append(
+                "(" + " OR ".join(
+                    f"{column} LIKE ? ESCAPE '\\'"
+                    for column in ("title", "author", "tags", "description")
+                ) + ")"
+            )
+            params.extend([pattern] * 4)
+
+        rows = conn.execute(
+            f"""
+            SELECT {self._COMIC_COLUMNS} FROM downloaded_comics
+            WHERE {" AND ".join(where)}
+            ORDER BY download_time DESC
+            LIMIT ?
+        """,
+            params + [limit],
+        ).fetchall()
+
+        comics = self._visible_comics(rows)
+        for comic in comics:
+            comic["highlight"] = {
+                "title": self._highlight_terms(comic["title"] or "", terms),
+                "snippet": "",
+            }
+        return comics
+
+    @staticmethod
+    def _render_highlight(text: Optional[str]) -> str:
+        """转义HTML后把高亮标记替换为 <mark>"""
+        escaped = html.escape(text or "")
+        return escaped.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>")
+
+    @staticmethod
+    def _highlight_terms(text: str, terms: List[str]) -> str:
+        pattern = "|".join(re.escape(term) for term in terms)
+        marked = re.sub(
+            f"({pattern})",
+            lambda m: HIGHLIGHT_START + m.group(1) + HIGHLIGHT_END,
+            text,
+            flags=re.IGNORECASE,
+        )
+        return ComicManager._render_highlight(marked)
 
+    @staticmethod
+    def _encode_cursor(sort_value, jm_id: int) -> str:
+        raw = json.dumps([sort_value, jm_id], ensure_ascii=False).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> tuple:
+        try:
+            sort_value, jm_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return sort_value, int(jm_id)
         except Exception as e:
-            print(f"获取已下载漫画列表失败: {e}")
-            return []
-        finally:
-            conn.close()
+            raise ValueError(f"无效的分页游标: {cursor}") from e
 
     def get_comic_path(self, jm_id: int) -> Optional[str]:
         """获取漫画路径"""
-        for dirname in os.listdir(self.downloaded_dir):
-            if dirname.startswith(f"{jm_id}_"):
-                comic_dir = os.path.join(self.downloaded_dir, dirname)
-
-                # 查找PDF文件
-                for filename in os.listdir(comic_dir):
-                    if filename.endswith(".pdf"):
-                        return os.path.join(comic_dir, filename)
-
-                # 如果没有PDF，查找图片目录
-                # 先检查是否有以jm_id命名的子目录
-                subdir_path = os.path.join(comic_dir, str(jm_id))
-                if os.path.exists(subdir_path) and os.path.isdir(subdir_path):
-                    return subdir_path
-
-                # 如果没有子目录，返回漫画目录本身
-                return comic_dir
+        comic_dir = self.find_comic_dir(jm_id)
+        if not comic_dir:
+            return None
 
-        return None
+        # 查找PDF文件
+        for filename in os.listdir(comic_dir):
+            if filename.endswith(".pdf"):
+                return os.path.join(comic_dir, filename)
+
+        # 如果没有PDF，查找图片目录
+        # 先检查是否有以jm_id命名的子目录
+        subdir_path = os.path.join(comic_dir, str(jm_id))
+        if os.path.exists(subdir_path) and os.path.isdir(subdir_path):
+            return subdir_path
+
+        # 如果没有子目录，返回漫画目录本身
+        return comic_dir
 
     def get_comic_pages(self, jm_id: int) -> int:
         """获取漫画页数"""
-        import sqlite3
-
         # 先从数据库获取
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        db_pages = 0
-
-        try:
-            cursor.execute(
-                "SELECT pages FROM downloaded_comics WHERE jm_id = ?", (jm_id,)
-            )
-            result = cursor.fetchone()
-            db_pages = result[0] if result else 0
-        finally:
-            conn.close()
+        conn = get_db_connection(self.db_file)
+        result = conn.execute(
+            "SELECT pages FROM downloaded_comics WHERE jm_id = ?", (jm_id,)
+        ).fetchone()
+        db_pages = result[0] if result else 0
 
         # 如果数据库中有页数，返回数据库值
         if db_pages > 0:
@@ -281,18 +833,27 @@ class ComicManager:
             comic_dir = comic_path
 
         # 计算图片文件数量
-        image_extensions = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
         page_count = 0
 
         if os.path.exists(comic_dir) and os.path.isdir(comic_dir):
             for filename in os.listdir(comic_dir):
                 file_ext = os.path.splitext(filename)[1].lower()
-                if file_ext in image_extensions:
+                if file_ext in IMAGE_EXTENSIONS:
                     page_count += 1
 
         return page_count
 
-    def _get_chapter_order_from_jm(self, jm_id: int) -> Optional[List[str]]:
+    def _get_jm_crawler(self):
+        if self.jm_crawler is None:
+            try:
+                from services.jm_crawler import JMCrawler
+            except ImportError:
+                from backend.services.jm_crawler import JMCrawler
+
+            self.jm_crawler = JMCrawler(disk_usage=self.disk_usage)
+        return self.jm_crawler
+
+    def _get_chapter_order_from_jm(self, jm_id: int) -> Optional[List[Dict]]:
         """
         从JM网站获取章节顺序
 
@@ -300,68 +861,133 @@ class ComicManager:
             jm_id: 漫画ID
 
         Returns:
-            章节ID列表，如果获取失败则返回None
+            章节列表（id、title、index），如果获取失败则返回None
         """
         try:
-            # 使用JMComic客户端获取专辑详情
-            client = jmcomic.JmOption.default().new_jm_client()
-            album_detail = client.get_album_detail(jm_id)
+            album_detail = self._get_jm_crawler().get_client().get_album_detail(jm_id)
 
             # 提取章节顺序
             chapter_order = []
-            for photo in album_detail:
-                chapter_order.append(str(photo.photo_id))
+            for index, episode in enumerate(album_detail.episode_list):
+                photo_id, _, photo_title = episode
+                chapter_order.append(
+                    {"id": str(photo_id), "title": photo_title, "index": index}
+                )
 
             return chapter_order
         except Exception as e:
             print(f"从JM获取章节顺序失败 {jm_id}: {e}")
             return None
 
+    def save_chapter_order(self, jm_id: int, chapters: List[Dict]):
+        """保存章节顺序到数据库"""
+        conn = get_db_connection(self.db_file)
+        try:
+            with conn:
+                conn.execute("DELETE FROM chapters WHERE jm_id = ?", (jm_id,))
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO chapters (jm_id, chapter_id, title, sort_index)
+                    VALUES (?, ?, ?, ?)
+                """,
+                    [
+                        (
+                            jm_id,
+                            str(chapter["id"]),
+                            chapter.get("title", ""),
+                            chapter.get("index", i),
+                        )
+                        for i, chapter in enumerate(chapters)
+                    ],
+                )
+        except Exception as e:
+            print(f"保存章节顺序失败 {jm_id}: {e}")
+
+    def get_chapter_order(self, jm_id: int) -> List[Dict]:
+        """从数据库读取已保存的章节顺序"""
+        conn = get_db_connection(self.db_file)
+        try:
+            rows = conn.execute(
+                """
+                SELECT chapter_id, title, sort_index FROM chapters
+                WHERE jm_id = ?
+                ORDER BY sort_index
+            """,
+                (jm_id,),
+            ).fetchall()
+        except Exception as e:
+            print(f"读取章节顺序失败 {jm_id}: {e}")
+            rows = []
+
+        return [
+            {"id": chapter_id, "title": title, "index": sort_index}
+            for chapter_id, title, sort_index in rows
+        ]
+
+    def refresh_chapter_metadata(self, jm_id: int) -> Optional[bool]:
+        """
+        从JM重新获取章节元数据并保存
+
+        Returns:
+            True 刷新成功，False 获取失败，None 距上次刷新太近被跳过
+        """
+        now = time.time()
+        last_refresh = self._chapter_refresh_times.get(jm_id, 0)
+        if now - last_refresh < CHAPTER_REFRESH_INTERVAL:
+            return None
+
+        self._chapter_refresh_times[jm_id] = now
+        chapter_order = self._get_chapter_order_from_jm(jm_id)
+        if not chapter_order:
+            return False
+
+        self.save_chapter_order(jm_id, chapter_order)
+        return True
+
     def get_comic_chapters(self, jm_id: int) -> List[Dict]:
         """获取漫画章节列表"""
         chapters = []
 
         try:
             # 查找漫画目录
-            comic_dir = None
-            for dirname in os.listdir(self.downloaded_dir):
-                if dirname.startswith(f"{jm_id}_"):
-                    comic_dir = os.path.join(self.downloaded_dir, dirname)
-                    break
+            comic_dir = self.find_comic_dir(jm_id)
 
             if not comic_dir or not os.path.exists(comic_dir):
                 print(f"漫画目录不存在: {comic_dir}")
                 return chapters
 
-            # 检查是否有子目录（章节）
-            subdirs = [
-                d
-                for d in os.listdir(comic_dir)
-                if os.path.isdir(os.path.join(comic_dir, d))
-            ]
-
-            # 支持的图片扩展名
-            image_extensions = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
+            # 检查是否有子目录或打包的章节容器（章节）
+            subdirs = []
+            with os.scandir(comic_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        chapter_key = entry.name
+                    else:
+                        chapter_key = container_chapter_id(entry.name)
+                    if chapter_key and chapter_key not in subdirs:
+                        subdirs.append(chapter_key)
 
             if subdirs:
                 # 多章节漫画
                 print(f"检测到多章节漫画，章节数: {len(subdirs)}")
                 
-                # 尝试从JM网站获取章节顺序
-                chapter_order = self._get_chapter_order_from_jm(jm_id)
+                # 使用下载时保存的章节顺序
+                chapter_order = self.get_chapter_order(jm_id)
+                chapter_titles = {
+                    chapter["id"]: chapter["title"] for chapter in chapter_order
+                }
 
                 if chapter_order:
-                    # 使用从JM获取的章节顺序
                     ordered_subdirs = []
-                    for chapter_id in chapter_order:
-                        if chapter_id in subdirs:
-                            ordered_subdirs.append(chapter_id)
+                    for chapter in chapter_order:
+                        if chapter["id"] in subdirs:
+                            ordered_subdirs.append(chapter["id"])
                     # 添加任何不在顺序中的章节（例如新下载的章节）
                     for subdir in subdirs:
                         if subdir not in ordered_subdirs:
                             ordered_subdirs.append(subdir)
                 else:
-                    # 如果无法从JM获取，使用数字排序作为后备
+                    # 没有保存的章节顺序时，使用数字排序作为后备
                     def sort_key(dirname):
                         try:
                             return int(dirname)
@@ -373,21 +999,17 @@ class ComicManager:
                 # 多章节漫画
                 for i, subdir in enumerate(ordered_subdirs):
                     subdir_path = os.path.join(comic_dir, subdir)
+                    if not os.path.isdir(subdir_path):
+                        subdir_path = container_path(comic_dir, subdir)
 
-                    # 计算该章节的页数
-                    page_count = 0
-                    try:
-                        for filename in os.listdir(subdir_path):
-                            file_ext = os.path.splitext(filename)[1].lower()
-                            if file_ext in image_extensions:
-                                page_count += 1
-                    except Exception as e:
-                        print(f"计算章节 {subdir} 页数失败: {e}")
+                    # 从页面清单获取该章节的页数
+                    page_count = len(self.get_page_manifest(jm_id, subdir))
 
                     chapters.append(
                         {
                             "id": subdir,
                             "name": f"第{i + 1}章",
+                            "title": chapter_titles.get(subdir, ""),
                             "pages": page_count,
                             "path": subdir_path,
                             "index": i,
@@ -397,16 +1019,7 @@ class ComicManager:
             else:
                 # 单章节漫画
                 print(f"检测到单章节漫画")
-                page_count = 0
-                try:
-                    for filename in os.listdir(comic_dir):
-                        file_ext = os.path.splitext(filename)[1].lower()
-                        if file_ext in image_extensions and not filename.startswith(
-                            "cover"
-                        ):
-                            page_count += 1
-                except Exception as e:
-                    print(f"计算单章节页数失败: {e}")
+                page_count = len(self.get_page_manifest(jm_id, ""))
 
                 if page_count > 0:
                     chapters.append(
@@ -429,127 +1042,542 @@ class ComicManager:
             traceback.print_exc()
             return chapters
 
-    def get_comic_page_path(
-        self, jm_id: int, page_num: int, chapter_id: Optional[str] = None
-    ) -> Optional[str]:
-        """获取漫画页面路径（支持章节）"""
+    @staticmethod
+    def _page_number(filename: str, skip_cover: bool) -> Optional[int]:
+        """从图片文件名提取页码，不是页面图片时返回 None"""
+        base_name, file_ext = os.path.splitext(filename)
+        if file_ext.lower() not in IMAGE_EXTENSIONS:
+            return None
+        if skip_cover and filename.startswith("cover"):
+            return None
+
+        # 从文件名提取页码，无法提取的文件跳过
+        digits = "".join(filter(str.isdigit, base_name))
+        return int(digits) if digits else None
+
+    def _scan_chapter_pages(self, chapter_dir: str, skip_cover: bool) -> List[tuple]:
+        """扫描章节目录，返回按页码排序的 (页码, 文件名, 大小, 修改时间, 数据偏移) 列表"""
+        pages = []
+        with os.scandir(chapter_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                page_num = self._page_number(entry.name, skip_cover)
+                if page_num is None:
+                    continue
+
+                stat = entry.stat()
+                pages.append(
+                    (page_num, entry.name, stat.st_size, stat.st_mtime, None)
+                )
+
+        pages.sort(key=lambda page: (page[0], page[1]))
+        return pages
+
+    def _scan_container_pages(self, path: str) -> List[tuple]:
+        """读取章节容器索引，返回格式与 _scan_chapter_pages 相同（修改时间取容器的）"""
+        mtime = os.stat(path).st_mtime
+        pages = []
+        for filename, offset, size in read_container_index(path):
+            page_num = self._page_number(filename, skip_cover=False)
+            if page_num is not None:
+                pages.append((page_num, filename, size, mtime, offset))
+
+        pages.sort(key=lambda page: (page[0], page[1]))
+        return pages
+
+    def build_page_manifest(self, jm_id: int, comic_dir: Optional[str] = None) -> int:
+        """
+        为漫画的每个章节生成页面清单（页码 -> 文件名、大小、修改时间）
+
+        Args:
+            jm_id: 漫画ID
+            comic_dir: 漫画目录，不传则通过索引查找
+
+        Returns:
+            写入清单的页面总数
+        """
+
+        comic_dir = comic_dir or self.find_comic_dir(jm_id)
+        if not comic_dir:
+            return 0
+
+        rows = []
         try:
-            # 查找漫画目录
-            comic_dir = None
-            for dirname in os.listdir(self.downloaded_dir):
-                if dirname.startswith(f"{jm_id}_"):
-                    comic_dir = os.path.join(self.downloaded_dir, dirname)
-                    break
+            # 根目录图片记为章节 ""，子目录图片以子目录名作为章节；
+            # 打包的章节容器先入清单，同一页同时存在散图时以容器为准
+            containers = []
+            loose = [("", self._scan_chapter_pages(comic_dir, skip_cover=True))]
+            with os.scandir(comic_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        loose.append(
+                            (
+                                entry.name,
+                                self._scan_chapter_pages(entry.path, skip_cover=False),
+                            )
+                        )
+                        continue
+                    chapter_key = container_chapter_id(entry.name)
+                    if chapter_key is not None and entry.is_file():
+                        containers.append(
+                            (chapter_key, self._scan_container_pages(entry.path))
+                        )
+
+            seen = set()
+            for chapter_key, pages in containers + loose:
+                for page_num, filename, size, mtime, offset in pages:
+                    if (chapter_key, page_num) in seen:
+                        continue
+                    seen.add((chapter_key, page_num))
+                    rows.append(
+                        [jm_id, chapter_key, page_num, filename, size, mtime, offset]
+                    )
+        except Exception as e:
+            print(f"扫描漫画页面失败 {jm_id}: {e}")
+            return 0
+
+        conn = get_db_connection(self.db_file)
+        try:
+            # 文件名和大小未变的页面沿用已记录的尺寸（例如打包前后），其余页面读取图片头部
+            known_sizes = {
+                (chapter_key, filename, size): (width, height)
+                for chapter_key, filename, size, width, height in conn.execute(
+                    """
+                    SELECT chapter_id, filename, file_size, width, height
+                    FROM comic_pages
+                    WHERE jm_id = ? AND width IS NOT NULL
+                """,
+                    (jm_id,),
+                )
+            }
+            unknown = []
+            for row in rows:
+                dimensions = known_sizes.get((row[1], row[3], row[4]))
+                if dimensions is None:
+                    unknown.append(row)
+                    dimensions = (None, None)
+                row.extend(dimensions)
+
+            probed = self._probe_pages(
+                [self._page_ref(comic_dir, row[1], *row[3:7]) for row in unknown]
+            )
+            for row, (width, height) in zip(unknown, probed):
+                row[7:9] = [width, height]
+
+            with conn:
+                conn.execute("DELETE FROM comic_pages WHERE jm_id = ?", (jm_id,))
+                conn.executemany(
+                    """
+                    INSERT OR IGNORE INTO comic_pages
+                    (jm_id, chapter_id, page_num, filename, file_size, mtime, data_offset,
+                     width, height)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                    rows,
+                )
+        except Exception as e:
+            print(f"保存页面清单失败 {jm_id}: {e}")
+            return 0
+        finally:
+            self._page_versions.pop(jm_id, None)
+
+        print(f"漫画 {jm_id} 页面清单已生成，共 {len(rows)} 页")
+        return len(rows)
+
+    @staticmethod
+    def _probe_page(page: PageRef) -> tuple:
+        """只解析图片头部获取 (宽, 高)，读取失败时记为 (0, 0)"""
+        try:
+            with Image.open(page.open()) as image:
+                return image.size
+        except Exception as e:
+            print(f"读取页面尺寸失败 {page.path} {page.name}: {e}")
+            return 0, 0
+
+    def _probe_pages(self, pages: List[PageRef]) -> List[tuple]:
+        """并行读取多个页面的尺寸"""
+        if len(pages) <= 1:
+            return [self._probe_page(page) for page in pages]
+
+        with ThreadPoolExecutor(
+            max_workers=min(PAGE_PROBE_WORKERS, len(pages))
+        ) as executor:
+            return list(executor.map(self._probe_page, pages))
+
+    def get_chapter_page_meta(
+        self, jm_id: int, chapter_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        获取章节每页的宽高、字节数和方向（章节回退规则与 _lookup_page 一致）
+
+        旧版本生成的清单没有尺寸，首次请求时补齐。
+        """
+        conn = get_db_connection(self.db_file)
+        rows = []
+        for chapter_key in [chapter_id if chapter_id else str(jm_id), ""]:
+            rows = conn.execute(
+                """
+                SELECT page_num, filename, file_size, mtime, data_offset, width, height
+                FROM comic_pages
+                WHERE jm_id = ? AND chapter_id = ?
+                ORDER BY page_num
+            """,
+                (jm_id, chapter_key),
+            ).fetchall()
+            if rows:
+                break
+
+        missing = [row for row in rows if row[5] is None]
+        comic_dir = self.find_comic_dir(jm_id) if missing else None
+        if comic_dir:
+            probed = self._probe_pages(
+                [self._page_ref(comic_dir, chapter_key, *row[1:5]) for row in missing]
+            )
+            with conn:
+                conn.executemany(
+                    """
+                    UPDATE comic_pages SET width = ?, height = ?
+                    WHERE jm_id = ? AND chapter_id = ? AND page_num = ?
+                """,
+                    [
+                        (width, height, jm_id, chapter_key, row[0])
+                        for row, (width, height) in zip(missing, probed)
+                    ],
+                )
+            dimensions = {row[0]: size for row, size in zip(missing, probed)}
+            rows = [row[:5] + dimensions.get(row[0], row[5:]) for row in rows]
+
+        pages = []
+        for page_num, _, size, _, _, width, height in rows:
+            orientation = None
+            if width and height:
+                if width > height:
+                    orientation = "landscape"
+                elif width < height:
+                    orientation = "portrait"
+                else:
+                    orientation = "square"
+            pages.append(
+                {
+                    "page": page_num,
+                    "width": width or None,
+                    "height": height or None,
+                    "size": size,
+                    "orientation": orientation,
+                }
+            )
+        return pages
+
+    def get_page_version(self, jm_id: int) -> str:
+        """
+        页面版本号（页面清单中文件数、大小和修改时间的摘要）
+
+        页面图片变化后版本号随之变化，可用于带版本的图片URL长期缓存。
+        """
+        version = self._page_versions.get(jm_id)
+        if version is None:
+            conn = get_db_connection(self.db_file)
+            row = conn.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(file_size), 0), COALESCE(MAX(mtime), 0)
+                FROM comic_pages WHERE jm_id = ?
+            """,
+                (jm_id,),
+            ).fetchone()
+            version = hashlib.sha1(repr(tuple(row)).encode("utf-8")).hexdigest()[:12]
+            self._page_versions[jm_id] = version
+        return version
+
+    def get_page_manifest(self, jm_id: int, chapter_id: str = "") -> List[Dict]:
+        """获取章节页面清单，清单不存在时先生成"""
+
+        query = """
+            SELECT page_num, filename, file_size, mtime
+            FROM comic_pages
+            WHERE jm_id = ? AND chapter_id = ?
+            ORDER BY page_num
+        """
+
+        conn = get_db_connection(self.db_file)
+        rows = conn.execute(query, (jm_id, chapter_id)).fetchall()
+        if not rows and not self._has_page_manifest(conn, jm_id):
+            self.build_page_manifest(jm_id)
+            rows = conn.execute(query, (jm_id, chapter_id)).fetchall()
+
+        return [
+            {"page": page_num, "filename": filename, "size": size, "mtime": mtime}
+            for page_num, filename, size, mtime in rows
+        ]
+
+    def _has_page_manifest(self, conn, jm_id: int) -> bool:
+        row = conn.execute(
+            "SELECT 1 FROM comic_pages WHERE jm_id = ? LIMIT 1", (jm_id,)
+        ).fetchone()
+        return row is not None
+
+    def _lookup_page(
+        self, jm_id: int, page_num: int, chapter_id: Optional[str]
+    ) -> Optional[tuple]:
+        """在页面清单中查找页面，返回 (章节, 文件名, 大小, 修改时间, 数据偏移)"""
+
+        # 与旧逻辑一致：指定章节不存在时回退到根目录；
+        # 未指定章节时优先使用以jm_id命名的子目录（向后兼容）
+        candidates = [chapter_id if chapter_id else str(jm_id), ""]
+
+        conn = get_db_connection(self.db_file)
+        for chapter_key in candidates:
+            row = conn.execute(
+                """
+                SELECT filename, file_size, mtime, data_offset FROM comic_pages
+                WHERE jm_id = ? AND chapter_id = ? AND page_num = ?
+            """,
+                (jm_id, chapter_key, page_num),
+            ).fetchone()
+            if row:
+                return (chapter_key, *row)
+
+            # 找不到指定页码时返回最接近的页码
+            row = conn.execute(
+                """
+                SELECT filename, file_size, mtime, data_offset, page_num FROM comic_pages
+                WHERE jm_id = ? AND chapter_id = ?
+                ORDER BY ABS(page_num - ?), page_num
+                LIMIT 1
+            """,
+                (jm_id, chapter_key, page_num),
+            ).fetchone()
+            if row:
+                print(f"使用最接近的页面: {row[0]} (请求: {page_num}, 实际: {row[4]})")
+                return (chapter_key, *row[:4])
 
+        return None
+
+    @staticmethod
+    def _page_ref(
+        comic_dir: str,
+        chapter_key: str,
+        filename: str,
+        size: int,
+        mtime: float,
+        offset: Optional[int],
+    ) -> PageRef:
+        """由页面清单记录得到页面数据位置"""
+        if offset is not None:
+            return PageRef(
+                container_path(comic_dir, chapter_key), offset, size, mtime, filename
+            )
+        path = os.path.join(comic_dir, chapter_key, filename)
+        return PageRef(path, None, size, mtime, filename)
+
+    @staticmethod
+    def _page_exists(page: PageRef) -> bool:
+        # 打包章节信任清单（清单随容器重建），不再逐页 stat
+        return page.packed or os.path.isfile(page.path)
+
+    def get_page_ref(
+        self, jm_id: int, page_num: int, chapter_id: Optional[str] = None
+    ) -> Optional[PageRef]:
+        """获取漫画页面的数据位置（支持章节和打包章节）"""
+        try:
+            comic_dir = self.find_comic_dir(jm_id)
             if not comic_dir:
                 print(f"找不到漫画目录: {jm_id}")
                 return None
 
-            # 如果指定了章节，进入章节目录
-            if chapter_id:
-                chapter_path = os.path.join(comic_dir, chapter_id)
-                if os.path.exists(chapter_path) and os.path.isdir(chapter_path):
-                    comic_dir = chapter_path
-                    print(f"使用章节目录: {chapter_path}")
-                else:
-                    print(f"章节目录不存在: {chapter_path}")
-            else:
-                # 先检查是否有以jm_id命名的子目录（向后兼容）
-                subdir_path = os.path.join(comic_dir, str(jm_id))
-                if os.path.exists(subdir_path) and os.path.isdir(subdir_path):
-                    comic_dir = subdir_path
-                    print(f"使用兼容目录: {subdir_path}")
-
-            # 支持的图片命名格式
-            possible_filenames = [
-                f"{page_num:05d}.jpg",  # 00001.jpg
-                f"{page_num:05d}.png",  # 00001.png
-                f"{page_num:04d}.jpg",  # 0001.jpg
-                f"{page_num:04d}.png",  # 0001.png
-                f"{page_num:03d}.jpg",  # 001.jpg
-                f"{page_num:03d}.png",  # 001.png
-                f"{page_num:02d}.jpg",  # 01.jpg
-                f"{page_num:02d}.png",  # 01.png
-                f"{page_num}.jpg",      # 1.jpg
-                f"{page_num}.png",      # 1.png
-            ]
-
-            # 首先尝试精确匹配
-            for filename in possible_filenames:
-                page_path = os.path.join(comic_dir, filename)
-                if os.path.exists(page_path):
-                    print(f"找到页面: {page_path}")
-                    return page_path
-
-            # 如果精确匹配失败，尝试遍历目录中的所有图片
-            try:
-                image_extensions = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
-                all_images = []
-                
-                for filename in os.listdir(comic_dir):
-                    file_ext = os.path.splitext(filename)[1].lower()
-                    if file_ext in image_extensions:
-                        # 尝试提取页码
-                        try:
-                            # 移除扩展名
-                            base_name = os.path.splitext(filename)[0]
-                            # 尝试转换为数字
-                            page_num_from_file = int(''.join(filter(str.isdigit, base_name)))
-                            all_images.append((page_num_from_file, filename))
-                        except:
-                            # 如果无法提取页码，跳过
-                            continue
-                
-                # 按页码排序
-                all_images.sort(key=lambda x: x[0])
-                
-                # 查找指定页码
-                for img_page_num, filename in all_images:
-                    if img_page_num == page_num:
-                        page_path = os.path.join(comic_dir, filename)
-                        print(f"通过遍历找到页面: {page_path}")
-                        return page_path
-                
-                # 如果找不到指定页码，返回最接近的页码
-                if all_images:
-                    # 找到最接近的页码
-                    closest_page = min(all_images, key=lambda x: abs(x[0] - page_num))
-                    page_path = os.path.join(comic_dir, closest_page[1])
-                    print(f"使用最接近的页面: {page_path} (请求: {page_num}, 实际: {closest_page[0]})")
-                    return page_path
-                    
-            except Exception as e:
-                print(f"遍历目录失败: {e}")
+            found = self._lookup_page(jm_id, page_num, chapter_id)
+            if found:
+                page = self._page_ref(comic_dir, *found)
+                if self._page_exists(page):
+                    return page
+
+            # 清单缺失或已过期（文件被移动/删除），重建后再查一次
+            self.build_page_manifest(jm_id, comic_dir)
+            found = self._lookup_page(jm_id, page_num, chapter_id)
+            if found:
+                return self._page_ref(comic_dir, *found)
 
             print(f"找不到页面 {page_num}")
             return None
 
         except Exception as e:
-            print(f"获取漫画页面路径失败 {jm_id}-{page_num}: {e}")
+            print(f"获取漫画页面失败 {jm_id}-{page_num}: {e}")
             import traceback
             traceback.print_exc()
             return None
 
-    def delete_comic(self, jm_id: int) -> bool:
-        """删除漫画"""
-        import sqlite3
+    def get_page_window(
+        self,
+        jm_id: int,
+        start: int,
+        count: int,
+        chapter_id: Optional[str] = None,
+    ) -> List[tuple]:
+        """
+        批量获取连续页面的数据位置（一次查询页面清单）
 
-        try:
-            # 从数据库删除
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+        Returns:
+            [(页码, PageRef), ...]，只包含实际存在的页面
+        """
+        comic_dir = self.find_comic_dir(jm_id)
+        if not comic_dir or count <= 0:
+            return []
 
-            cursor.execute("DELETE FROM downloaded_comics WHERE jm_id = ?", (jm_id,))
-            conn.commit()
-            conn.close()
+        pages = self._query_page_window(comic_dir, jm_id, start, count, chapter_id)
+        if pages and all(self._page_exists(page) for _, page in pages):
+            return pages
+
+        # 清单缺失或已过期（文件被移动/删除），重建后再查一次
+        conn = get_db_connection(self.db_file)
+        if pages or not self._has_page_manifest(conn, jm_id):
+            self.build_page_manifest(jm_id, comic_dir)
+            pages = self._query_page_window(comic_dir, jm_id, start, count, chapter_id)
+
+        return [(page_num, page) for page_num, page in pages if self._page_exists(page)]
+
+    def _query_page_window(
+        self,
+        comic_dir: str,
+        jm_id: int,
+        start: int,
+        count: int,
+        chapter_id: Optional[str],
+    ) -> List[tuple]:
+        # 章节回退规则与 _lookup_page 一致
+        conn = get_db_connection(self.db_file)
+        for chapter_key in [chapter_id if chapter_id else str(jm_id), ""]:
+            rows = conn.execute(
+                """
+                SELECT page_num, filename, file_size, mtime, data_offset
+                FROM comic_pages
+                WHERE jm_id = ? AND chapter_id = ? AND page_num >= ?
+                ORDER BY page_num
+                LIMIT ?
+            """,
+                (jm_id, chapter_key, start, count),
+            ).fetchall()
+            if rows:
+                return [
+                    (page_num, self._page_ref(comic_dir, chapter_key, *row))
+                    for page_num, *row in rows
+                ]
+
+            # 章节存在但窗口超出末页时不再回退到其他章节
+            if conn.execute(
+                "SELECT 1 FROM comic_pages WHERE jm_id = ? AND chapter_id = ? LIMIT 1",
+                (jm_id, chapter_key),
+            ).fetchone():
+                return []
+        return []
+
+    def get_pdf_sections(
+        self, jm_id: int, chapter_id: Optional[str] = None
+    ) -> List[Tuple[str, List[PageRef]]]:
+        """
+        按章节顺序列出页面，用于生成 PDF
+
+        Args:
+            chapter_id: 只取指定章节，为空时取全部章节
+
+        Returns:
+            [(章节标题, [PageRef, ...]), ...]
+        """
+        sections = []
+        for chapter in self.get_comic_chapters(jm_id):
+            if chapter_id and chapter["id"] != chapter_id:
+                continue
+            if not chapter["pages"]:
+                continue
+
+            pages = self.get_page_window(jm_id, 0, chapter["pages"], chapter["id"])
+            title = chapter.get("title") or chapter["name"]
+            sections.append((title, [page for _, page in pages]))
+        return sections
+
+    def export_pdf(
+        self, jm_id: int, target_path: str, chapter_id: Optional[str] = None
+    ) -> int:
+        """
+        生成漫画 PDF（单章节，或全部章节合并并按章节添加书签）
 
+        Returns:
+            PDF 页数，没有页面时为 0 且不生成文件
+        """
+        sections = self.get_pdf_sections(jm_id, chapter_id)
+        comic = self.get_downloaded_comic(jm_id)
+        title = comic["title"] if comic else None
+        if chapter_id and sections and title:
+            title = f"{title} - {sections[0][0]}"
+
+        return build_pdf(sections, target_path, title, bookmarks=len(sections) > 1)
+
+    def pack_comic(self, jm_id: int) -> int:
+        """
+        把漫画的散图章节打包为 CBZ 容器（不压缩），打包后删除原散图
+
+        先写容器、再重建页面清单、最后删除散图，阅读中的请求始终能找到页面。
+
+        Returns:
+            打包的章节数
+        """
+        comic_dir = self.find_comic_dir(jm_id)
+        if not comic_dir:
+            return 0
+
+        chapters = [("", comic_dir, True)]
+        with os.scandir(comic_dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    chapters.append((entry.name, entry.path, False))
+
+        packed = []
+        for chapter_key, chapter_dir, skip_cover in chapters:
+            pages = self._scan_chapter_pages(chapter_dir, skip_cover)
+            if not pages:
+                continue
+
+            target_path = container_path(comic_dir, chapter_key)
+            filenames = [page[1] for page in pages]
+            # 已有容器时（例如上次打包后没删完散图）只在散图包含容器全部页面时覆盖
+            if os.path.exists(target_path) and not set(filenames).issuperset(
+                page[1] for page in self._scan_container_pages(target_path)
+            ):
+                print(f"章节容器中有散图缺失的页面，跳过打包: {target_path}")
+                continue
+
+            pack_chapter(chapter_dir, filenames, target_path)
+            packed.append((chapter_key, chapter_dir, filenames))
+
+        if not packed:
+            return 0
+
+        self.build_page_manifest(jm_id, comic_dir)
+
+        for chapter_key, chapter_dir, filenames in packed:
+            if chapter_key and set(os.listdir(chapter_dir)) == set(filenames):
+                shutil.rmtree(chapter_dir)
+            else:
+                for filename in filenames:
+                    os.remove(os.path.join(chapter_dir, filename))
+
+        self.disk_usage.refresh(comic_dir)
+        self.save_scan_state(jm_id, comic_dir)
+        print(f"漫画 {jm_id} 已打包 {len(packed)} 个章节")
+        return len(packed)
+
+    def delete_comic(self, jm_id: int) -> bool:
+        """删除漫画"""
+        try:
             # 删除文件
-            for dirname in os.listdir(self.downloaded_dir):
-                if dirname.startswith(f"{jm_id}_"):
-                    comic_dir = os.path.join(self.downloaded_dir, dirname)
-                    if os.path.exists(comic_dir):
-                        shutil.rmtree(comic_dir)
-                    break
+            comic_dir = self.find_comic_dir(jm_id)
+            if comic_dir and os.path.exists(comic_dir):
+                # Windows 上被映射的容器无法删除，先释放映射
+                container_reader.close_under(comic_dir)
+                shutil.rmtree(comic_dir)
+                self.disk_usage.forget(comic_dir)
+
+            # 从数据库删除
+            self.remove_comic_record(jm_id)
 
             return True
 
@@ -559,36 +1587,23 @@ class ComicManager:
 
     def update_read_progress(self, jm_id: int, page_num: int):
         """更新阅读进度"""
-        import sqlite3
-
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        conn = get_db_connection(self.db_file)
 
         try:
-            cursor.execute(
-                """
-                UPDATE downloaded_comics 
-                SET last_read_time = CURRENT_TIMESTAMP, read_progress = ?
-                WHERE jm_id = ?
-            """,
-                (page_num, jm_id),
-            )
-
-            conn.commit()
+            with conn:
+                conn.execute(
+                    """
+                    UPDATE downloaded_comics 
+                    SET last_read_time = CURRENT_TIMESTAMP, read_progress = ?
+                    WHERE jm_id = ?
+                """,
+                    (page_num, jm_id),
+                )
         except Exception as e:
             print(f"更新阅读进度失败 {jm_id}: {e}")
-        finally:
-            conn.close()
 
     def get_cache_size(self) -> int:
-        """获取缓存大小"""
-        total_size = 0
-        try:
-            for dirpath, dirnames, filenames in os.walk(self.downloaded_dir):
-                for filename in filenames:
-                    filepath = os.path.join(dirpath, filename)
-                    if os.path.exists(filepath):
-                        total_size += os.path.getsize(filepath)
-        except:
-            pass
-        return total_size
+        """获取书架占用空间（来自磁盘占用统计）"""
+        return self.disk_usage.get_scope_total("album") + self.disk_usage.get_usage(
+            "library"
+        )
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+磁盘占用统计
+
+按目录记录直接包含的文件大小和目录 mtime，写入、移动、删除文件时增量更新；
+后台对账只重新扫描 mtime 发生变化的目录，不再每次请求都遍历整棵目录树。
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+try:
+    from models.database import get_db_connection, init_database
+except ImportError:
+    from backend.models.database import get_db_connection, init_database
+
+# 后台对账间隔（秒）
+RECONCILE_INTERVAL = 600
+
+ALBUM_DIR_PATTERN = re.compile(r"^(\d+)_")
+
+
+class DiskUsageTracker:
+    """磁盘占用统计器"""
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        # 统计区域：根目录 -> (scope, key)，key 为 None 表示按漫画目录归属
+        self._areas = {}
+        self._lock = threading.RLock()
+        self._reconciler: Optional[threading.Thread] = None
+
+        init_database(self.db_file)
+
+    def register_library(self, root: str):
+        """登记书架目录，其下 ``<jm_id>_标题`` 目录计入对应漫画"""
+        self._areas[os.path.abspath(root)] = ("album", None)
+
+    def register_cache(self, name: str, root: str):
+        """登记缓存区，整个目录计入 cache/<name>"""
+        self._areas[os.path.abspath(root)] = ("cache", name)
+
+    def _resolve(self, path: str) -> Optional[tuple]:
+        """返回目录所属的 (scope, key)，不在任何区域内时返回 None"""
+        # 优先匹配最深的根目录，缓存区可能嵌套在其他目录下
+        for root in sorted(self._areas, key=len, reverse=True):
+            if path != root and not path.startswith(root + os.sep):
+                continue
+
+            scope, key = self._areas[root]
+            if key is not None:
+                return scope, key
+
+            relative = os.path.relpath(path, root)
+            match = ALBUM_DIR_PATTERN.match(relative.split(os.sep)[0])
+            if relative == "." or not match:
+                return "library", ""
+            return scope, match.group(1)
+        return None
+
+    # ------------------------------------------------------------------
+    # 增量更新
+    # ------------------------------------------------------------------
+
+    def record_file(self, file_path: str, delta_bytes: int, delta_files: int = 0):
+        """
+        记录单个文件的大小变化
+
+        Args:
+            file_path: 文件路径
+            delta_bytes: 字节变化量（删除时为负数）
+            delta_files: 文件数变化量（新建 1，删除 -1，覆盖 0）
+        """
+        dir_path = os.path.dirname(os.path.abspath(file_path))
+        owner = self._resolve(dir_path)
+        if owner is None or (not delta_bytes and not delta_files):
+            return
+
+        # 新目录以 mtime 0 入库，下次对账时会完整扫描一次
+        conn = get_db_connection(self.db_file)
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO disk_usage_dirs
+                (path, parent, scope, key, mtime_ns, bytes, file_count)
+                VALUES (?, ?, ?, ?, 0, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    bytes = bytes + excluded.bytes,
+                    file_count = file_count + excluded.file_count
+            """,
+                (
+                    dir_path,
+                    os.path.dirname(dir_path),
+                    owner[0],
+                    owner[1],
+                    delta_bytes,
+                    delta_files,
+                ),
+            )
+
+    def record_write(self, file_path: str, previous_size: Optional[int] = None):
+        """
+        文件写入后调用
+
+        Args:
+            file_path: 文件路径
+            previous_size: 写入前的文件大小，新建文件传 None
+        """
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return
+        self.record_file(
+            file_path,
+            size - (previous_size or 0),
+            1 if previous_size is None else 0,
+        )
+
+    def forget(self, path: str):
+        """目录被删除或移走后调用，移除该目录及其子目录的统计"""
+        path = os.path.abspath(path)
+        conn = get_db_connection(self.db_file)
+        with conn:
+            self._forget(conn, path)
+
+    def _forget(self, conn, path: str):
+        # 按主键范围删除整棵子树
+        prefix = path + os.sep
+        conn.execute(
+            """
+            DELETE FROM disk_usage_dirs
+            WHERE path = ? OR (path >= ? AND path < ?)
+        """,
+            (path, prefix, prefix[:-1] + chr(ord(os.sep) + 1)),
+        )
+        conn.execute(
+            "DELETE FROM disk_usage WHERE bytes <= 0 AND file_count <= 0"
+        )
+
+    # ------------------------------------------------------------------
+    # 对账
+    # ------------------------------------------------------------------
+
+    def refresh(self, path: str) -> int:
+        """
+        对账指定目录（含子目录），只重新扫描 mtime 变化过的目录
+
+        Returns:
+            重新扫描的目录数
+        """
+        path = os.path.abspath(path)
+        if self._resolve(path) is None:
+            return 0
+
+        # 每个目录单独提交，避免对账大书架时长时间占用写锁
+        with self._lock:
+            return self._refresh_dir(get_db_connection(self.db_file), path)
+
+    def _refresh_dir(self, conn, path: str) -> int:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            with conn:
+                self._forget(conn, path)
+            return 0
+
+        row = conn.execute(
+            "SELECT mtime_ns FROM disk_usage_dirs WHERE path = ?", (path,)
+        ).fetchone()
+        known_subdirs = {
+            sub
+            for (sub,) in conn.execute(
+                "SELECT path FROM disk_usage_dirs WHERE parent = ?", (path,)
+            )
+        }
+
+        scanned = 0
+        if row and row[0] == mtime_ns:
+            # 目录项没有变化，子目录列表沿用记录
+            subdirs = known_subdirs
+        else:
+            total_bytes = 0
+            file_count = 0
+            subdirs = set()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.add(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total_bytes += entry.stat(follow_symlinks=False).st_size
+                            file_count += 1
+            except OSError as e:
+                print(f"扫描目录失败 {path}: {e}")
+                return 0
+
+            scope, key = self._resolve(path)
+            with conn:
+                conn.execute(
+                    """
+                    INSERT INTO disk_usage_dirs
+                    (path, parent, scope, key, mtime_ns, bytes, file_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET
+                        mtime_ns = excluded.mtime_ns,
+                        bytes = excluded.bytes,
+                        file_count = excluded.file_count
+                """,
+                    (
+                        path,
+                        os.path.dirname(path),
+                        scope,
+                        key,
+                        mtime_ns,
+                        total_bytes,
+                        file_count,
+                    ),
+                )
+                for removed in known_subdirs - subdirs:
+                    self._forget(conn, removed)
+            scanned = 1
+
+        for subdir in subdirs:
+            scanned += self._refresh_dir(conn, subdir)
+        return scanned
+
+    def reconcile(self) -> int:
+        """对账所有登记的区域"""
+        scanned = 0
+        for root in list(self._areas):
+            if os.path.isdir(root):
+                scanned += self.refresh(root)
+        return scanned
+
+    def start_reconciler(self, interval: int = RECONCILE_INTERVAL):
+        """启动后台对账线程（启动时先对账一次）"""
+        if self._reconciler and self._reconciler.is_alive():
+            return
+
+        def run():
+            while True:
+                try:
+                    started = time.time()
+                    scanned = self.reconcile()
+                    if scanned:
+                        print(
+                            f"磁盘占用对账完成，重新扫描 {scanned} 个目录，"
+                            f"耗时 {time.time() - started:.2f} 秒"
+                        )
+                except Exception as e:
+                    print(f"磁盘占用对账失败: {e}")
+                time.sleep(interval)
+
+        self._reconciler = threading.Thread(target=run, daemon=True)
+        self._reconciler.start()
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    def get_usage(self, scope: str, key="") -> int:
+        """获取单个统计项的字节数"""
+        conn = get_db_connection(self.db_file)
+        row = conn.execute(
+            "SELECT bytes FROM disk_usage WHERE scope = ? AND key = ?",
+            (scope, str(key)),
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_scope_total(self, scope: str) -> int:
+        """获取某类统计项的总字节数"""
+        conn = get_db_connection(self.db_file)
+        row = conn.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM disk_usage WHERE scope = ?",
+            (scope,),
+        ).fetchone()
+        return row[0]
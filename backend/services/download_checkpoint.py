@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+下载检查点与进度
+
+每本漫画一个 JSON Lines 文件，每下载完成一张图片追加一行 {"name", "size", "sha1"}。
+重试时大小和摘要都一致的图片直接跳过；磁盘上存在但不在检查点里
+（例如进程退出时写了一半）的图片会先删除再重新下载。
+
+CheckpointDownloader 同时统计每章已完成的图片数、写入字节数和最近的下载速度。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+
+import jmcomic
+
+# 计算当前下载速度的时间窗口（秒）
+SPEED_WINDOW = 5.0
+
+
+def fsync_file(path: str):
+    """把文件内容刷到磁盘"""
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def fsync_dir(path: str):
+    """把目录项（新建、rename）刷到磁盘，Windows 不支持打开目录，直接跳过"""
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DownloadCheckpoint:
+    """单本漫画的下载检查点"""
+
+    def __init__(self, path: str, root: str):
+        """
+        Args:
+            path: 检查点文件路径
+            root: 图片下载目录，检查点中记录相对此目录的路径
+        """
+        self.path = path
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        # 相对路径 -> (大小, sha1)
+        self._entries: Dict[str, Tuple[int, str]] = {}
+        # 文件末尾是否有未写完的行，下次追加前先换行
+        self._torn = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                self._torn = not line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry["name"]] = (entry["size"], entry["sha1"])
+                except (ValueError, KeyError, TypeError):
+                    # 进程退出时最后一行可能只写了一半
+                    continue
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, file_path: str) -> str:
+        return os.path.relpath(os.path.abspath(file_path), self.root).replace(
+            os.sep, "/"
+        )
+
+    @staticmethod
+    def _digest(file_path: str) -> str:
+        digest = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def is_complete(self, file_path: str) -> bool:
+        """图片已下载完成且与检查点记录一致"""
+        entry = self._entries.get(self._key(file_path))
+        if entry is None:
+            return False
+        try:
+            if os.path.getsize(file_path) != entry[0]:
+                return False
+            return self._digest(file_path) == entry[1]
+        except OSError:
+            return False
+
+    def record(self, file_path: str):
+        """图片写入完成后记录"""
+        size = os.path.getsize(file_path)
+        sha1 = self._digest(file_path)
+        key = self._key(file_path)
+        line = json.dumps({"name": key, "size": size, "sha1": sha1}, ensure_ascii=False)
+
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(("\n" if self._torn else "") + line + "\n")
+            self._torn = False
+            self._entries[key] = (size, sha1)
+
+
+class CheckpointDownloader(jmcomic.JmDownloader):
+    """按检查点续传并统计进度的下载器"""
+
+    def __init__(
+        self,
+        option,
+        checkpoint: Optional[DownloadCheckpoint] = None,
+        on_progress: Optional[Callable[[Dict], None]] = None,
+    ):
+        """
+        Args:
+            checkpoint: 下载检查点，为 None 时不续传
+            on_progress: 每完成一张图片调用，参数见 snapshot()；
+                抛出的异常会停止后续图片下载，并保存在 interrupted 中
+        """
+        super().__init__(option)
+        self.checkpoint = checkpoint
+        self.on_progress = on_progress
+        self.interrupted: Optional[BaseException] = None
+
+        self._stats_lock = threading.Lock()
+        self._album_total = 0
+        self._album_chapters = 0
+        # 章节 ID -> {"chapter", "index", "title", "done", "total"}
+        self._chapters: Dict[str, Dict] = {}
+        self._done = 0
+        self._resumed = 0
+        self._bytes = 0
+        self._started = time.monotonic()
+        # (完成时间, 字节数)，用于计算最近的下载速度
+        self._recent = deque()
+
+    def before_album(self, album):
+        super().before_album(album)
+        self._album_total = album.page_count
+        self._album_chapters = len(album)
+
+    def before_photo(self, photo):
+        super().before_photo(photo)
+        with self._stats_lock:
+            self._chapters[photo.photo_id] = {
+                "chapter": photo.photo_id,
+                "index": photo.album_index,
+                "title": photo.name,
+                "done": 0,
+                "total": len(photo),
+            }
+
+    @jmcomic.catch_exception
+    def download_by_image_detail(self, image):
+        if self.interrupted is not None:
+            return
+
+        if self.checkpoint is not None:
+            save_path = self.option.decide_image_filepath(image)
+            if self.checkpoint.is_complete(save_path):
+                self._image_done(image, 0, resumed=True)
+                return
+            # 不在检查点里的文件可能不完整，删除后重新下载
+            if os.path.exists(save_path):
+                os.remove(save_path)
+
+        # 父类方法同样带 catch_exception，调用未装饰的版本，避免失败被记录两次
+        return jmcomic.JmDownloader.download_by_image_detail.__wrapped__(self, image)
+
+    def after_image(self, image, img_save_path):
+        super().after_image(image, img_save_path)
+        # 先落盘再记录检查点，记录过的图片在断电后也是完整的
+        fsync_file(img_save_path)
+        if self.checkpoint is not None:
+            self.checkpoint.record(img_save_path)
+        self._image_done(image, os.path.getsize(img_save_path))
+
+    def _image_done(self, image, size: int, resumed: bool = False):
+        now = time.monotonic()
+        with self._stats_lock:
+            self._done += 1
+            chapter = self._chapters.get(image.from_photo.photo_id)
+            if chapter is not None:
+                chapter["done"] += 1
+            if resumed:
+                self._resumed += 1
+            else:
+                self._bytes += size
+                self._recent.append((now, size))
+            while self._recent and now - self._recent[0][0] > SPEED_WINDOW:
+                self._recent.popleft()
+            snapshot = self._snapshot(now, chapter)
+
+        if self.on_progress is None or self.interrupted is not None:
+            return
+        try:
+            self.on_progress(snapshot)
+        except BaseException as e:
+            # 在下载线程中抛出会被直接丢弃，记录下来由调用方重新抛出
+            self.interrupted = e
+
+    def _snapshot(self, now: float, chapter: Optional[Dict]) -> Dict:
+        """
+        当前进度（在 _stats_lock 内调用）
+
+        Returns:
+            {"images_done", "images_total", "resumed", "bytes", "speed",
+             "elapsed", "chapter", "chapters_started", "chapters_total"}；speed 为最近 SPEED_WINDOW 秒的
+            字节/秒，chapter 为刚完成图片所在章节
+        """
+        window = max(min(SPEED_WINDOW, now - self._started), 1.0)
+        total = max(
+            self._album_total, sum(c["total"] for c in self._chapters.values())
+        )
+        return {
+            "images_done": self._done,
+            "images_total": total,
+            "resumed": self._resumed,
+            "bytes": self._bytes,
+            "speed": int(sum(size for _, size in self._recent) / window),
+            "elapsed": round(now - self._started, 1),
+            "chapter": dict(chapter) if chapter else None,
+            "chapters_started": len(self._chapters),
+            "chapters_total": self._album_chapters,
+        }
@@ -11,8 +11,6 @@ import sys
 from datetime import datetime
 from typing import Callable
 
-import aiohttp
-import img2pdf
 from PIL import Image
 
 # 添加后端模块路径
@@ -20,20 +18,42 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 try:
     from backend.services.jm_crawler import JMCrawler
+    from backend.services.download_checkpoint import fsync_dir
+    from backend.services.page_store import container_reader
+    from backend.services.http_pool import fetch_bytes
+    from backend.models.database import get_system_config
 except ImportError:
     try:
         from services.jm_crawler import JMCrawler
+        from services.download_checkpoint import fsync_dir
+        from services.page_store import container_reader
+        from services.http_pool import fetch_bytes
+        from models.database import get_system_config
     except ImportError:
         sys.path.append(
             os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
         )
         from backend.services.jm_crawler import JMCrawler
+        from backend.services.download_checkpoint import fsync_dir
+        from backend.services.page_store import container_reader
+        from backend.services.http_pool import fetch_bytes
+        from backend.models.database import get_system_config
+
+
+# 下载暂存目录名（位于书架目录下，完成后 rename 到漫画目录不跨文件系统）
+STAGING_DIRNAME = ".staging"
 
 
 class DownloadManager:
     """负责漫画的异步下载和落库。"""
 
-    def __init__(self):
+    def __init__(self, comic_manager=None, jm_crawler=None):
+        """
+        Args:
+            comic_manager: 应用共享的 ComicManager，不传时首次使用时创建
+            jm_crawler: 应用共享的 JMCrawler，暂存目录须为书架下的 STAGING_DIRNAME；
+                不传时自行创建
+        """
         self.base_dir = os.environ.get(
             "BASE_DIR",
             os.path.dirname(
@@ -47,10 +67,73 @@ class DownloadManager:
             "TEMP_CACHE_DIR", os.path.join(self.base_dir, "TempCache")
         )
 
+        self.staging_dir = os.path.join(self.downloaded_dir, STAGING_DIRNAME)
+
         os.makedirs(self.downloaded_dir, exist_ok=True)
         os.makedirs(self.temp_dir, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+        # 正在下载的漫画，书架扫描会跳过这些目录
+        self.active_downloads = set()
+
+        # 与应用共享同一个 ComicManager，避免每次下载重新初始化
+        self._comic_manager = comic_manager
+        self.jm_crawler = jm_crawler or JMCrawler(
+            disk_usage=comic_manager.disk_usage if comic_manager else None,
+            staging_dir=self.staging_dir,
+        )
+        if comic_manager:
+            comic_manager.disk_usage.register_cache("staging", self.staging_dir)
+
+    def discard_staging(self, jm_id: int):
+        """删除漫画的暂存目录和下载检查点（任务被取消、不再续传时调用）"""
+        stage_dir = self.jm_crawler.album_staging_dir(jm_id)
+        if os.path.isdir(stage_dir):
+            shutil.rmtree(stage_dir, ignore_errors=True)
+        self.jm_crawler.clear_checkpoint(jm_id)
+        if self._comic_manager is not None:
+            self._comic_manager.disk_usage.forget(stage_dir)
+
+    def sweep_staging(self, keep) -> int:
+        """
+        清理没有对应任务的暂存目录和检查点（例如上次运行中被取消或失败的下载）
+
+        Args:
+            keep: 仍需续传的漫画ID（排队中、已暂停或正在下载）
+
+        Returns:
+            清理的漫画数
+        """
+        keep = set(keep) | self.active_downloads
+        stale = set()
+        for name in os.listdir(self.staging_dir):
+            if name.isdigit() and int(name) not in keep:
+                stale.add(int(name))
+
+        checkpoint_dir = self.jm_crawler.checkpoint_dir
+        if os.path.isdir(checkpoint_dir):
+            for name in os.listdir(checkpoint_dir):
+                album_id = name.split(".", 1)[0]
+                if album_id.isdigit() and int(album_id) not in keep:
+                    stale.add(int(album_id))
+
+        for jm_id in stale:
+            self.discard_staging(jm_id)
+        if stale:
+            print(f"清理 {len(stale)} 个无人认领的下载暂存目录")
+        return len(stale)
+
+    @property
+    def comic_manager(self):
+        """共享的 ComicManager，构造时未传入则首次使用时创建"""
+        if self._comic_manager is None:
+            try:
+                from services.comic_manager import ComicManager
+            except ImportError:
+                from backend.services.comic_manager import ComicManager
 
-        self.jm_crawler = JMCrawler()
+            self._comic_manager = ComicManager()
+        return self._comic_manager
 
     def _clean_filename(self, filename: str) -> str:
         illegal_chars = [
@@ -101,17 +184,20 @@ class DownloadManager:
         self, jm_id: int, comic_info: dict, progress_callback: Callable
     ) -> bool:
         """异步下载漫画。"""
+        self.active_downloads.add(jm_id)
         try:
             safe_title = self._clean_filename(comic_info["title"])
             comic_dir = os.path.join(self.downloaded_dir, f"{jm_id}_{safe_title}")
-            os.makedirs(comic_dir, exist_ok=True)
+            # 下载完成前所有文件都写在暂存目录，漫画目录在最后一次 rename 时出现
+            stage_dir = self.jm_crawler.album_staging_dir(jm_id)
+            os.makedirs(stage_dir, exist_ok=True)
 
             progress_callback(5, "preparing", "准备下载环境...")
 
             if comic_info.get("cover"):
                 await self._download_image_async(
                     comic_info["cover"],
-                    os.path.join(comic_dir, "cover.jpg"),
+                    os.path.join(stage_dir, "cover.jpg"),
                 )
 
             progress_callback(15, "downloading", "正在下载漫画图片...")
@@ -122,31 +208,35 @@ class DownloadManager:
             if not success:
                 raise RuntimeError("下载失败，未生成可用文件")
 
-            progress_callback(90, "processing", "正在生成 PDF...")
-            pdf_path = os.path.join(comic_dir, f"{jm_id}.pdf")
-            await self._create_pdf_from_images(comic_dir, pdf_path)
-
             await self._save_comic_info(comic_dir, comic_info)
             await self._ensure_files_ready(comic_dir, jm_id)
 
+            if get_system_config("page_storage_mode") == "packed":
+                progress_callback(98, "processing", "正在打包章节...")
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.comic_manager.pack_comic, jm_id
+                )
+
             progress_callback(100, "completed", "下载完成")
             return True
 
         except Exception as e:
             progress_callback(0, "error", f"下载失败: {str(e)}")
             return False
+        finally:
+            self.active_downloads.discard(jm_id)
 
     async def _real_comic_download(
         self, jm_id: int, comic_dir: str, progress_callback: Callable
     ) -> bool:
         """执行真实下载流程，失败时直接报错，不再生成占位内容。"""
 
-        def update_progress(progress, status, message):
+        def update_progress(progress, status, message, detail=None):
             if status == "starting":
                 progress_callback(15, "downloading", "开始下载...")
             elif status == "downloading":
                 mapped_progress = 15 + (progress / 100) * 70
-                progress_callback(int(mapped_progress), "downloading", message)
+                progress_callback(int(mapped_progress), "downloading", message, detail)
             elif status == "processing":
                 progress_callback(85, "processing", message)
             elif status == "completed":
@@ -159,42 +249,19 @@ class DownloadManager:
             if not success:
                 return False
 
-            temp_download_dir = os.path.join(
-                self.base_dir, "TempCache", "downloads", str(jm_id)
-            )
-            if not os.path.exists(temp_download_dir):
+            stage_dir = self.jm_crawler.album_staging_dir(jm_id)
+            if not os.path.isdir(stage_dir):
                 return False
 
-            subdirs = [
-                name
-                for name in os.listdir(temp_download_dir)
-                if os.path.isdir(os.path.join(temp_download_dir, name))
-            ]
-
-            if len(subdirs) == 1 and subdirs[0] == str(jm_id):
-                chapter_dir = os.path.join(temp_download_dir, subdirs[0])
-                for filename in os.listdir(chapter_dir):
-                    shutil.move(
-                        os.path.join(chapter_dir, filename),
-                        os.path.join(comic_dir, filename),
-                    )
-            elif len(subdirs) > 1:
-                for subdir in subdirs:
-                    shutil.move(
-                        os.path.join(temp_download_dir, subdir),
-                        os.path.join(comic_dir, subdir),
-                    )
-            else:
-                for filename in os.listdir(temp_download_dir):
-                    shutil.move(
-                        os.path.join(temp_download_dir, filename),
-                        os.path.join(comic_dir, filename),
-                    )
+            # 从这里开始漫画进入书架，调度器不再响应暂停/取消
+            progress_callback(96, "publishing", "正在保存到书架...")
+            self._flatten_single_chapter(stage_dir, jm_id)
+            self._publish_staged(stage_dir, comic_dir)
 
-            try:
-                shutil.rmtree(temp_download_dir)
-            except Exception:
-                pass
+            disk_usage = self.comic_manager.disk_usage
+            disk_usage.forget(stage_dir)
+            disk_usage.refresh(comic_dir)
+            self.jm_crawler.clear_checkpoint(jm_id)
 
             return True
 
@@ -202,49 +269,70 @@ class DownloadManager:
             print(f"真实下载失败 {jm_id}: {e}")
             raise RuntimeError(f"真实下载失败: {e}") from e
 
+    @staticmethod
+    def _flatten_single_chapter(stage_dir: str, jm_id: int):
+        """只有一个与漫画同号的章节目录时，把图片提到漫画根目录"""
+        subdirs = [
+            name
+            for name in os.listdir(stage_dir)
+            if os.path.isdir(os.path.join(stage_dir, name))
+        ]
+        if subdirs != [str(jm_id)]:
+            return
+
+        chapter_dir = os.path.join(stage_dir, subdirs[0])
+        for filename in os.listdir(chapter_dir):
+            os.replace(
+                os.path.join(chapter_dir, filename), os.path.join(stage_dir, filename)
+            )
+        os.rmdir(chapter_dir)
+
+    def _publish_staged(self, stage_dir: str, comic_dir: str):
+        """
+        把暂存目录移到漫画目录
+
+        漫画目录不存在时整体 rename；已存在（重新下载）时逐项替换，
+        暂存目录与书架同在一个文件系统，两种情况都只改目录项，不复制数据。
+        """
+        if not os.path.exists(comic_dir):
+            os.rename(stage_dir, comic_dir)
+        else:
+            # 重新下载会替换已有文件，Windows 上被映射的容器不能被替换
+            container_reader.close_under(comic_dir)
+            self._merge_dir(stage_dir, comic_dir)
+            shutil.rmtree(stage_dir, ignore_errors=True)
+        fsync_dir(os.path.dirname(comic_dir))
+
+    def _merge_dir(self, source: str, target: str):
+        for name in os.listdir(source):
+            source_path = os.path.join(source, name)
+            target_path = os.path.join(target, name)
+            if os.path.isdir(source_path) and os.path.isdir(target_path):
+                self._merge_dir(source_path, target_path)
+            else:
+                os.replace(source_path, target_path)
+
     async def _download_image_async(self, url: str, save_path: str):
-        """异步下载图片。"""
+        """下载图片（封面）。"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    url, timeout=aiohttp.ClientTimeout(total=30)
-                ) as response:
-                    if response.status != 200:
-                        return
-
-                    content = await response.read()
-                    image = Image.open(io.BytesIO(content))
-                    if image.mode == "RGBA":
-                        rgb_image = Image.new("RGB", image.size, (255, 255, 255))
-                        rgb_image.paste(image, mask=image.split()[3])
-                        image = rgb_image
-
-                    image.save(save_path, "JPEG", quality=85)
+            # 在线程池中使用进程共享的连接池，不阻塞事件循环
+            content = await asyncio.get_running_loop().run_in_executor(
+                None, fetch_bytes, url
+            )
+            image = Image.open(io.BytesIO(content))
+            if image.mode == "RGBA":
+                rgb_image = Image.new("RGB", image.size, (255, 255, 255))
+                rgb_image.paste(image, mask=image.split()[3])
+                image = rgb_image
+
+            previous_size = (
+                os.path.getsize(save_path) if os.path.exists(save_path) else None
+            )
+            image.save(save_path, "JPEG", quality=85)
+            self.comic_manager.disk_usage.record_write(save_path, previous_size)
         except Exception as e:
             print(f"异步下载图片失败 {url}: {e}")
 
-    async def _create_pdf_from_images(self, comic_dir: str, pdf_path: str):
-        """从根目录图片创建 PDF。章节目录仍以图片阅读为主。"""
-        try:
-            image_files = []
-            for filename in sorted(os.listdir(comic_dir)):
-                if filename.lower().endswith((".jpg", ".jpeg", ".png")):
-                    if filename != "cover.jpg":
-                        image_files.append(os.path.join(comic_dir, filename))
-
-            if not image_files:
-                return
-
-            try:
-                pdf_data = img2pdf.convert(image_files)
-                if pdf_data:
-                    with open(pdf_path, "wb") as f:
-                        f.write(pdf_data)
-            except Exception as pdf_error:
-                print(f"img2pdf 转换失败: {pdf_error}")
-        except Exception as e:
-            print(f"创建 PDF 失败: {e}")
-
     async def _save_comic_info(self, comic_dir: str, comic_info: dict):
         """保存漫画元信息。"""
         try:
@@ -253,10 +341,12 @@ class DownloadManager:
                 "id": comic_info.get("id"),
                 "title": comic_info.get("title"),
                 "author": comic_info.get("author"),
+                "authors": comic_info.get("authors", []),
                 "tags": comic_info.get("tags", []),
                 "description": comic_info.get("description"),
                 "favorites": comic_info.get("favorites", 0),
                 "pages": comic_info.get("pages", 0),
+                "chapters": comic_info.get("chapters", []),
                 "download_time": self._get_current_time(),
             }
 
@@ -268,65 +358,47 @@ class DownloadManager:
             print(f"保存漫画信息失败: {e}")
 
     async def _ensure_files_ready(self, comic_dir: str, jm_id: int):
-        """等待文件落盘后再写数据库。"""
-        try:
-            await asyncio.sleep(1)
+        """
+        校验下载结果后写数据库
 
+        图片在下载器中已逐张 fsync，漫画目录由一次 rename 发布，这里只检查一遍
+        是否有空文件，不再等待。
+        """
+        try:
+            image_exts = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
             required_files = []
+            empty_files = []
+
+            def collect(directory: str, skip_cover: bool):
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if not entry.is_file() or not entry.name.lower().endswith(
+                            image_exts
+                        ):
+                            continue
+                        if skip_cover and entry.name.startswith("cover"):
+                            continue
+                        required_files.append(entry.path)
+                        if entry.stat().st_size == 0:
+                            empty_files.append(entry.path)
+
             subdirs = [
                 name
                 for name in os.listdir(comic_dir)
                 if os.path.isdir(os.path.join(comic_dir, name))
             ]
-
             if subdirs:
                 for subdir in subdirs:
-                    chapter_path = os.path.join(comic_dir, subdir)
-                    images = [
-                        filename
-                        for filename in os.listdir(chapter_path)
-                        if filename.lower().endswith(
-                            (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
-                        )
-                    ]
-                    required_files.extend(
-                        os.path.join(chapter_path, filename) for filename in images
-                    )
+                    collect(os.path.join(comic_dir, subdir), False)
             else:
-                images = [
-                    filename
-                    for filename in os.listdir(comic_dir)
-                    if filename.lower().endswith(
-                        (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
-                    )
-                    and not filename.startswith("cover")
-                ]
-                required_files.extend(
-                    os.path.join(comic_dir, filename) for filename in images
-                )
-
-            wait_time = 0
-            while wait_time < 10:
-                all_ready = True
-                for file_path in required_files:
-                    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-                        all_ready = False
-                        break
-
-                if all_ready:
-                    break
+                collect(comic_dir, True)
 
-                await asyncio.sleep(1)
-                wait_time += 1
+            if empty_files:
+                print(f"漫画 {jm_id} 有 {len(empty_files)} 个空文件: {empty_files[:5]}")
 
             print(f"漫画 {jm_id} 文件准备就绪，共 {len(required_files)} 个文件")
 
-            try:
-                from services.comic_manager import ComicManager
-            except ImportError:
-                from backend.services.comic_manager import ComicManager
-
-            comic_manager = ComicManager()
+            comic_manager = self.comic_manager
             info_path = os.path.join(comic_dir, "info.json")
             comic_info = {}
             if os.path.exists(info_path):
@@ -336,7 +408,7 @@ class DownloadManager:
                     comic_info = json.load(f)
 
             comic_info["id"] = jm_id
-            success = comic_manager.add_downloaded_comic(jm_id, comic_info)
+            success = comic_manager.add_downloaded_comic(jm_id, comic_info, comic_dir)
             if success:
                 print(f"漫画 {jm_id} 已添加到数据库")
             else:
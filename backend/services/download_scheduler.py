@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+"""
+下载调度器
+
+所有下载请求先写入 SQLite 中的 download_queue，由固定数量的工作线程按
+优先级（高优先）和入队顺序依次执行。工作线程数取自 system_config.max_concurrent_downloads，
+可在运行时调整；排队中的任务在应用重启后继续执行。
+"""
+
+import json
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+try:
+    from models.database import get_db_connection, get_system_config, set_system_config
+except ImportError:
+    from backend.models.database import (
+        get_db_connection,
+        get_system_config,
+        set_system_config,
+    )
+
+# 工作线程数上限
+MAX_WORKERS = 16
+
+# 仍在队列中（未结束）的任务状态
+ACTIVE_STATUSES = ("queued", "running", "paused")
+
+# 可以恢复（重新排队）的任务状态，失败的任务保留暂存目录和检查点，恢复后断点续传
+RESUMABLE_STATUSES = ("paused", "error")
+
+# 下载流程进入该阶段后漫画已写入书架，不再响应暂停/取消
+PUBLISHING_STATUS = "publishing"
+
+
+class DownloadInterrupted(BaseException):
+    """
+    下载被暂停或取消
+
+    继承 BaseException，不会被下载流程中的 ``except Exception`` 吞掉。
+    """
+
+    def __init__(self, action: str):
+        super().__init__(action)
+        self.action = action
+
+
+class DownloadScheduler:
+    """持久化下载队列和工作线程池"""
+
+    def __init__(self, download_manager, db_file: str):
+        self.download_manager = download_manager
+        self.db_file = db_file
+
+        self._condition = threading.Condition()
+        self._target_workers = 0
+        self._worker_count = 0
+        # download_id -> 运行中任务的实时进度
+        self._progress: Dict[str, Dict] = {}
+        # download_id -> "paused" / "cancelled"，运行中的任务在下一次进度回调时停止
+        self._stop_requests: Dict[str, str] = {}
+        # 已进入 PUBLISHING_STATUS 阶段的运行中任务，不再接受暂停/取消
+        self._published: set = set()
+
+    # ------------------------------------------------------------------
+    # 工作线程
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """恢复上次中断的任务并按配置启动工作线程"""
+        conn = get_db_connection(self.db_file)
+        with conn:
+            recovered = conn.execute(
+                """
+                UPDATE download_queue
+                SET status = 'queued', message = '应用重启，重新排队',
+                    update_time = CURRENT_TIMESTAMP
+                WHERE status = 'running'
+            """
+            ).rowcount
+        if recovered:
+            print(f"下载队列恢复 {recovered} 个中断的任务")
+
+        # 已取消、失败或被删除的任务留下的暂存目录不会再被续传
+        try:
+            self.download_manager.sweep_staging(self.resumable_ids())
+        except OSError as e:
+            print(f"清理下载暂存目录失败: {e}")
+
+        try:
+            workers = int(get_system_config("max_concurrent_downloads") or 3)
+        except ValueError:
+            workers = 3
+        self.resize(workers, persist=False)
+
+    def resumable_ids(self) -> set:
+        """仍在队列中或可以恢复（失败）的漫画ID，它们的暂存目录需要保留"""
+        statuses = ACTIVE_STATUSES + ("error",)
+        conn = get_db_connection(self.db_file)
+        return {
+            jm_id
+            for (jm_id,) in conn.execute(
+                f"""
+                SELECT DISTINCT jm_id FROM download_queue
+                WHERE status IN ({",".join("?" * len(statuses))})
+            """,
+                statuses,
+            )
+        }
+
+    @property
+    def workers(self) -> int:
+        return self._target_workers
+
+    def resize(self, workers: int, persist: bool = True) -> int:
+        """
+        调整工作线程数，多余的线程完成当前任务后退出
+
+        Returns:
+            调整后的线程数
+        """
+        workers = max(1, min(int(workers), MAX_WORKERS))
+        with self._condition:
+            self._target_workers = workers
+            while self._worker_count < workers:
+                self._worker_count += 1
+                threading.Thread(target=self._worker_loop, daemon=True).start()
+            self._condition.notify_all()
+
+        if persist:
+            set_system_config("max_concurrent_downloads", str(workers))
+        return workers
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._worker_count > self._target_workers:
+                        self._worker_count -= 1
+                        return
+                    job = self._claim_next()
+                    if job:
+                        break
+                    self._condition.wait()
+
+            try:
+                self._run_job(*job)
+            except Exception as e:
+                print(f"下载任务异常 {job[0]}: {e}")
+
+    def _claim_next(self) -> Optional[tuple]:
+        """取出下一个排队任务并标记为 running（在 _condition 内调用）"""
+        conn = get_db_connection(self.db_file)
+        row = conn.execute(
+            """
+            SELECT download_id, jm_id, comic_info FROM download_queue
+            WHERE status = 'queued'
+            ORDER BY priority DESC, id
+            LIMIT 1
+        """
+        ).fetchone()
+        if row is None:
+            return None
+
+        with conn:
+            conn.execute(
+                """
+                UPDATE download_queue
+                SET status = 'running', progress = 0, message = '开始下载...',
+                    update_time = CURRENT_TIMESTAMP
+                WHERE download_id = ?
+            """,
+                (row[0],),
+            )
+        self._progress[row[0]] = {
+            "progress": 0,
+            "status": "starting",
+            "message": "开始下载...",
+        }
+        return row[0], row[1], json.loads(row[2])
+
+    def _run_job(self, download_id: str, jm_id: int, comic_info: Dict):
+        progress = self._progress[download_id]
+
+        def progress_callback(value, status, message, detail=None):
+            if status == PUBLISHING_STATUS:
+                with self._condition:
+                    self._published.add(download_id)
+                    self._stop_requests.pop(download_id, None)
+            action = self._stop_requests.get(download_id)
+            if action:
+                raise DownloadInterrupted(action)
+            progress.update({"progress": value, "status": status, "message": message})
+            if detail is not None:
+                # 逐图进度：已完成/总图片数、字节数、下载速度和当前章节
+                progress["detail"] = detail
+
+        try:
+            # 在 _condition 外查询：目录索引未命中时可能要扫描书架目录
+            if self.download_manager.comic_manager.is_comic_downloaded(jm_id):
+                # 已在书架中的漫画（例如发布后才收到暂停请求的任务）不再重新下载
+                status, message = "completed", "漫画已下载"
+                progress["progress"] = 100
+            else:
+                success = self.download_manager.download_comic(
+                    jm_id, comic_info, progress_callback
+                )
+                status = "completed" if success else "error"
+                message = progress["message"]
+            print(f"漫画 {jm_id} 下载任务结束: {status}")
+        except DownloadInterrupted as interrupted:
+            status = interrupted.action
+            message = "已暂停" if status == "paused" else "已取消"
+            print(f"漫画 {jm_id} 下载任务{message}")
+            if status == "cancelled":
+                # 取消后不会再续传，删除已下载的部分
+                self.download_manager.discard_staging(jm_id)
+        finally:
+            self._stop_requests.pop(download_id, None)
+            self._published.discard(download_id)
+            self._progress.pop(download_id, None)
+
+        self._finish(download_id, status, progress["progress"], message)
+
+    def _finish(self, download_id: str, status: str, progress: int, message: str):
+        conn = get_db_connection(self.db_file)
+        with conn:
+            conn.execute(
+                """
+                UPDATE download_queue
+                SET status = ?, progress = ?, message = ?, update_time = CURRENT_TIMESTAMP
+                WHERE download_id = ?
+            """,
+                (status, progress if status == "completed" else 0, message, download_id),
+            )
+
+    # ------------------------------------------------------------------
+    # 队列操作
+    # ------------------------------------------------------------------
+
+    def enqueue(self, jm_id: int, comic_info: Dict, priority: int = 0) -> Dict:
+        """
+        加入下载队列，同一漫画已在队列中时返回已有任务
+
+        Returns:
+            任务信息，见 get_job
+        """
+        conn = get_db_connection(self.db_file)
+        existing = conn.execute(
+            f"""
+            SELECT download_id FROM download_queue
+            WHERE jm_id = ? AND status IN ({",".join("?" * len(ACTIVE_STATUSES))})
+            ORDER BY id DESC LIMIT 1
+        """,
+            (jm_id, *ACTIVE_STATUSES),
+        ).fetchone()
+        if existing:
+            return self.get_job(existing[0])
+
+        download_id = (
+            f"{jm_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:4]}"
+        )
+        with self._condition:
+            with conn:
+                conn.execute(
+                    """
+                    INSERT INTO download_queue
+                    (download_id, jm_id, comic_info, priority, message)
+                    VALUES (?, ?, ?, ?, '排队中')
+                """,
+                    (
+                        download_id,
+                        jm_id,
+                        json.dumps(comic_info, ensure_ascii=False),
+                        priority,
+                    ),
+                )
+            self._condition.notify()
+        return self.get_job(download_id)
+
+    def pause(self, download_id: str) -> bool:
+        """暂停任务：排队中的任务不再被取出，运行中的任务在下一次进度回调时停止"""
+        return self._stop(download_id, "paused")
+
+    def cancel(self, download_id: str) -> bool:
+        """取消任务"""
+        return self._stop(download_id, "cancelled")
+
+    def _stop(self, download_id: str, action: str) -> bool:
+        conn = get_db_connection(self.db_file)
+        with self._condition:
+            row = conn.execute(
+                "SELECT status, jm_id FROM download_queue WHERE download_id = ?",
+                (download_id,),
+            ).fetchone()
+            if row is None:
+                return False
+            # 失败的任务只能取消（放弃续传），不能暂停
+            if row[0] not in ACTIVE_STATUSES and not (
+                row[0] == "error" and action == "cancelled"
+            ):
+                return False
+
+            if row[0] == "running":
+                if download_id in self._published:
+                    return False
+                self._stop_requests[download_id] = action
+                return True
+
+            if row[0] == "paused" and action == "paused":
+                return True
+            self._finish(
+                download_id, action, 0, "已暂停" if action == "paused" else "已取消"
+            )
+        if action == "cancelled":
+            # 暂停过或失败的任务可能已下载了一部分
+            self.download_manager.discard_staging(row[1])
+        return True
+
+    def resume(self, download_id: str) -> bool:
+        """恢复已暂停或失败的任务（重新排队），漫画已在书架中时由工作线程直接标记为完成"""
+        placeholders = ",".join("?" * len(RESUMABLE_STATUSES))
+        conn = get_db_connection(self.db_file)
+        with self._condition:
+            row = conn.execute(
+                f"""
+                SELECT jm_id FROM download_queue
+                WHERE download_id = ? AND status IN ({placeholders})
+            """,
+                (download_id, *RESUMABLE_STATUSES),
+            ).fetchone()
+            if row is not None and conn.execute(
+                f"""
+                SELECT 1 FROM download_queue
+                WHERE jm_id = ? AND status IN ({",".join("?" * len(ACTIVE_STATUSES))})
+            """,
+                (row[0], *ACTIVE_STATUSES),
+            ).fetchone():
+                # 失败后同一本漫画又被重新加入了队列
+                return False
+
+            with conn:
+                updated = conn.execute(
+                    f"""
+                    UPDATE download_queue
+                    SET status = 'queued', message = '排队中', update_time = CURRENT_TIMESTAMP
+                    WHERE download_id = ? AND status IN ({placeholders})
+                """,
+                    (download_id, *RESUMABLE_STATUSES),
+                ).rowcount
+            if updated:
+                self._condition.notify()
+        return bool(updated)
+
+    def set_priority(self, download_id: str, priority: int) -> bool:
+        """调整未开始任务的优先级（数值越大越先下载）"""
+        conn = get_db_connection(self.db_file)
+        with conn:
+            updated = conn.execute(
+                """
+                UPDATE download_queue SET priority = ?, update_time = CURRENT_TIMESTAMP
+                WHERE download_id = ? AND status IN ('queued', 'paused')
+            """,
+                (priority, download_id),
+            ).rowcount
+        return bool(updated)
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    _JOB_COLUMNS = "download_id, jm_id, comic_info, priority, status, progress, message, create_time"
+
+    def get_job(self, download_id: str) -> Optional[Dict]:
+        """
+        获取任务信息
+
+        Returns:
+            {"download_id", "jm_id", "title", "priority", "status", "progress",
+             "message", "position", "create_time"}；position 为排队位置（从 1 开始），
+            不在排队中时为 None
+        """
+        conn = get_db_connection(self.db_file)
+        row = conn.execute(
+            f"SELECT {self._JOB_COLUMNS} FROM download_queue WHERE download_id = ?",
+            (download_id,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        job = self._row_to_job(row)
+        if job["status"] == "queued":
+            job["position"] = conn.execute(
+                """
+                SELECT COUNT(*) + 1 FROM download_queue
+                WHERE status = 'queued'
+                  AND (priority > ? OR (priority = ? AND id < (
+                      SELECT id FROM download_queue WHERE download_id = ?
+                  )))
+            """,
+                (job["priority"], job["priority"], download_id),
+            ).fetchone()[0]
+            job["message"] = f"排队中（第 {job['position']} 位）"
+        return job
+
+    def list_jobs(self) -> List[Dict]:
+        """未结束的任务，运行中的在前，其余按出队顺序"""
+        conn = get_db_connection(self.db_file)
+        rows = conn.execute(
+            f"""
+            SELECT {self._JOB_COLUMNS} FROM download_queue
+            WHERE status IN ({",".join("?" * len(ACTIVE_STATUSES))})
+            ORDER BY status = 'running' DESC, status = 'paused', priority DESC, id
+        """,
+            ACTIVE_STATUSES,
+        ).fetchall()
+
+        jobs = []
+        position = 0
+        for row in rows:
+            job = self._row_to_job(row)
+            if job["status"] == "queued":
+                position += 1
+                job["position"] = position
+                job["message"] = f"排队中（第 {position} 位）"
+            jobs.append(job)
+        return jobs
+
+    def _row_to_job(self, row) -> Dict:
+        (
+            download_id,
+            jm_id,
+            comic_info,
+            priority,
+            status,
+            progress,
+            message,
+            create_time,
+        ) = row
+        job = {
+            "download_id": download_id,
+            "jm_id": jm_id,
+            "title": json.loads(comic_info).get("title", ""),
+            "priority": priority,
+            "status": status,
+            "progress": progress or 0,
+            "message": message or "",
+            "position": None,
+            "create_time": create_time,
+        }
+
+        # 运行中的任务使用内存中的实时进度（status 为下载流程中的阶段）
+        live = self._progress.get(download_id)
+        if status == "running" and live:
+            job.update(live)
+        return job
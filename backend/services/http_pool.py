@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+共享 HTTP 连接池
+
+封面等直接请求 CDN 的地方共用进程内一个 requests.Session：连接保持 keep-alive，
+每个主机最多 POOL_MAXSIZE 个连接，超出时等待空闲连接而不是新建。
+JM 接口请求走 jmcomic 客户端，由 JMCrawler 共享同一个客户端。
+"""
+
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 保留连接池的主机数
+POOL_CONNECTIONS = 16
+# 每个主机的连接数上限
+POOL_MAXSIZE = 8
+
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/120.0.0.0 Safari/537.36"
+    ),
+}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """进程共享的 Session，首次调用时创建"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    pool_block=True,
+                    max_retries=Retry(
+                        total=2,
+                        backoff_factor=0.5,
+                        status_forcelist=(502, 503, 504),
+                        allowed_methods=("GET", "HEAD"),
+                    ),
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(DEFAULT_HEADERS)
+                _session = session
+    return _session
+
+
+def fetch_bytes(url: str, timeout: float = 30) -> bytes:
+    """GET 请求并返回响应内容，非 2xx 状态抛出 requests.HTTPError"""
+    response = get_session().get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+页面图片派生缓存
+
+按请求的宽/高生成缩小版本（JPEG 使用 draft 模式在解码阶段直接降采样），
+并可按客户端 Accept 头转码为 WebP/AVIF（system_config.enable_image_transcoding，默认关闭），
+未指定尺寸时按原尺寸转码。既不缩放也不转码时直接返回原图。
+结果写入磁盘缓存，按最近访问时间做 LRU 淘汰，缓存总大小受 system_config 限制。
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
+
+from PIL import Image
+
+try:
+    from models.database import get_db_connection, get_system_config
+except ImportError:
+    from backend.models.database import get_db_connection, get_system_config
+
+# 允许的目标尺寸（请求尺寸向上取整到最近一档，避免缓存被任意尺寸撑爆）
+SIZE_BUCKETS = (160, 320, 480, 640, 800, 1080, 1280, 1600, 1920, 2560)
+
+# 默认缓存上限（字节），可通过 system_config.derivative_cache_size_limit 调整
+DEFAULT_CACHE_SIZE_LIMIT = 512 * 1024 * 1024
+
+# 淘汰到上限的该比例以下，避免每次写入都触发淘汰
+EVICT_TARGET_RATIO = 0.9
+
+# 命中时最多每隔多少秒更新一次访问时间
+TOUCH_INTERVAL = 60
+
+# 输出格式 -> (扩展名, MIME, 保存参数)
+OUTPUT_FORMATS = {
+    "JPEG": (".jpg", "image/jpeg", {"quality": 85}),
+    "WEBP": (".webp", "image/webp", {"quality": 80, "method": 4}),
+    "AVIF": (".avif", "image/avif", {"quality": 60, "speed": 8}),
+}
+
+# 协商时的优先顺序（体积从小到大）
+NEGOTIATION_ORDER = ("AVIF", "WEBP")
+
+Image.init()
+SUPPORTED_OUTPUT_FORMATS = {fmt for fmt in OUTPUT_FORMATS if fmt in Image.SAVE}
+
+
+def snap_size(value: Optional[int]) -> Optional[int]:
+    """把请求尺寸向上取整到 SIZE_BUCKETS 中的一档"""
+    if not value or value <= 0:
+        return None
+    for bucket in SIZE_BUCKETS:
+        if value <= bucket:
+            return bucket
+    return SIZE_BUCKETS[-1]
+
+
+def negotiate_format(accept_header: Optional[str]) -> str:
+    """
+    根据 Accept 头选择输出格式
+
+    Returns:
+        "AVIF"、"WEBP" 或 "JPEG"（客户端未声明支持或 Pillow 不支持编码时）
+    """
+    accepted = set()
+    for part in (accept_header or "").split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(media_type.lower())
+
+    for image_format in NEGOTIATION_ORDER:
+        mimetype = OUTPUT_FORMATS[image_format][1]
+        if mimetype in accepted and image_format in SUPPORTED_OUTPUT_FORMATS:
+            return image_format
+    return "JPEG"
+
+
+class ImageDerivativeCache:
+    """图片派生（缩放、转码）磁盘缓存"""
+
+    def __init__(self, cache_dir: str, db_file: str, disk_usage=None):
+        self.cache_dir = cache_dir
+        self.db_file = db_file
+        self.disk_usage = disk_usage
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # 同一派生图只生成一次，按键哈希分段加锁
+        self._locks = [threading.Lock() for _ in range(64)]
+        self._evict_lock = threading.Lock()
+        # 键 -> 上次写入访问时间，命中时不必每次都写数据库
+        self._touched = {}
+        # 缓存总大小，首次使用时从数据库汇总，之后随写入、淘汰增量维护
+        self._total_size: Optional[int] = None
+        # 保护 _touched 和 _total_size
+        self._state_lock = threading.Lock()
+
+    def _size_limit(self) -> int:
+        try:
+            return int(get_system_config("derivative_cache_size_limit"))
+        except (TypeError, ValueError):
+            return DEFAULT_CACHE_SIZE_LIMIT
+
+    def get_derivative(
+        self,
+        source,
+        key_prefix: str,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        image_format: str = "JPEG",
+    ) -> tuple:
+        """
+        获取缩放/转码后的图片
+
+        Args:
+            source: 原图位置（PageRef，散图或打包章节中的页面）
+            key_prefix: 缓存分组，如 "<jm_id>/<page>"，只能由服务端可信的值组成
+            width: 最大宽度
+            height: 最大高度
+            image_format: 输出格式，见 OUTPUT_FORMATS
+
+        Returns:
+            (路径, MIME)；不需要处理或处理失败时返回 (None, None)，由调用方直接返回原图
+        """
+        width, height = snap_size(width), snap_size(height)
+        if image_format not in SUPPORTED_OUTPUT_FORMATS:
+            image_format = "JPEG"
+        if not width and not height and image_format == "JPEG":
+            return None, None
+
+        extension, mimetype, _ = OUTPUT_FORMATS[image_format]
+
+        # 签名包含原图实际路径（即清单命中的章节），键不取自请求参数；
+        # 原图变化（大小、mtime 或容器内位置）后键随之变化，旧派生图由 LRU 淘汰
+        signature = hashlib.sha1(
+            f"{source.path}:{source.offset}:{source.size}:{source.mtime}".encode(
+                "utf-8"
+            )
+        ).hexdigest()[:12]
+        # 原尺寸转码的结果不带尺寸档，同一页每种格式只缓存一份
+        size_part = f"w{width or 0}_h{height or 0}" if width or height else "orig"
+        key = f"{key_prefix}/{size_part}_{signature}{extension}"
+        cache_path = os.path.join(self.cache_dir, *key.split("/"))
+        if not self._inside_cache_dir(cache_path):
+            print(f"派生图缓存路径越界，已忽略: {key}")
+            return None, None
+
+        if os.path.exists(cache_path):
+            self._touch(key)
+            return cache_path, mimetype
+
+        lock = self._locks[hash(key) % len(self._locks)]
+        with lock:
+            if os.path.exists(cache_path):
+                return cache_path, mimetype
+            try:
+                if not self._render(source, cache_path, width, height, image_format):
+                    return None, None
+            except Exception as e:
+                print(f"生成派生图失败 {source.path}: {e}")
+                return None, None
+
+        size = os.path.getsize(cache_path)
+        conn = get_db_connection(self.db_file)
+        with conn:
+            # 文件被外部删除后重新生成时会替换旧记录
+            replaced = conn.execute(
+                "SELECT size FROM derivative_cache WHERE key = ?", (key,)
+            ).fetchone()
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO derivative_cache (key, path, size, last_access)
+                VALUES (?, ?, ?, ?)
+            """,
+                (key, cache_path, size, time.time()),
+            )
+        self._adjust_total_size(size - (replaced[0] if replaced else 0))
+        if self.disk_usage is not None:
+            self.disk_usage.record_file(cache_path, size, 1)
+
+        self._evict_if_needed()
+        return cache_path, mimetype
+
+    def _render(
+        self,
+        source,
+        cache_path: str,
+        width: Optional[int],
+        height: Optional[int],
+        image_format: str,
+    ) -> bool:
+        """缩放/转码并写入缓存，既不需要缩放也不需要转码时返回 False"""
+        with Image.open(source.open()) as image:
+            target = (width or image.width, height or image.height)
+            needs_resize = image.width > target[0] or image.height > target[1]
+            if not needs_resize and image_format == "JPEG":
+                return False
+
+            # JPEG 解码时按 1/2、1/4、1/8 降采样，比完整解码后再缩放快得多；
+            # 不需要缩放时 target 即原尺寸，draft 和 thumbnail 都不会改变图片
+            image.draft("RGB", target)
+            image = image.convert("RGB")
+            image.thumbnail(target, Image.LANCZOS)
+
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            try:
+                image.save(temp_path, image_format, **OUTPUT_FORMATS[image_format][2])
+                os.replace(temp_path, cache_path)
+            except BaseException:
+                # 编码失败或磁盘写满时不留下半个临时文件
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                raise
+        return True
+
+    def _inside_cache_dir(self, path: str) -> bool:
+        """路径解析后仍在缓存目录内"""
+        root = os.path.realpath(self.cache_dir)
+        return os.path.realpath(path).startswith(os.path.join(root, ""))
+
+    def _touch(self, key: str):
+        now = time.time()
+        # 同一进程内 TOUCH_INTERVAL 秒内已写过的键不再访问数据库（UPDATE 即使不命中也要拿写锁）
+        with self._state_lock:
+            if now - self._touched.get(key, 0) < TOUCH_INTERVAL:
+                return
+            if len(self._touched) > 4096:
+                self._touched = {
+                    k: t for k, t in self._touched.items() if now - t < TOUCH_INTERVAL
+                }
+            self._touched[key] = now
+
+        conn = get_db_connection(self.db_file)
+        with conn:
+            conn.execute(
+                """
+                UPDATE derivative_cache SET last_access = ?
+                WHERE key = ? AND last_access < ?
+            """,
+                (now, key, now - TOUCH_INTERVAL),
+            )
+
+    def _sum_size(self) -> int:
+        conn = get_db_connection(self.db_file)
+        return conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM derivative_cache"
+        ).fetchone()[0]
+
+    def get_total_size(self) -> int:
+        with self._state_lock:
+            if self._total_size is None:
+                self._total_size = self._sum_size()
+            return self._total_size
+
+    def _adjust_total_size(self, delta: int):
+        with self._state_lock:
+            if self._total_size is not None:
+                self._total_size += delta
+
+    def _evict_if_needed(self):
+        """超过上限时按最近访问时间从旧到新删除"""
+        limit = self._size_limit()
+        if self.get_total_size() <= limit or not self._evict_lock.acquire(False):
+            return
+
+        try:
+            conn = get_db_connection(self.db_file)
+            # 淘汰很少发生，借机用数据库汇总校准增量维护的总大小
+            total = self._sum_size()
+            with self._state_lock:
+                self._total_size = total
+            excess = total - int(limit * EVICT_TARGET_RATIO)
+            rows = conn.execute(
+                "SELECT key, path, size FROM derivative_cache ORDER BY last_access"
+            )
+
+            evicted = []
+            freed = 0
+            for key, path, size in rows:
+                if excess <= 0:
+                    break
+                if not self._inside_cache_dir(path):
+                    # 不删除缓存目录以外的文件，只清掉记录
+                    evicted.append((key,))
+                    freed += size
+                    continue
+                try:
+                    os.remove(path)
+                    if self.disk_usage is not None:
+                        self.disk_usage.record_file(path, -size, -1)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"删除缓存文件失败 {path}: {e}")
+                    continue
+                evicted.append((key,))
+                freed += size
+                excess -= size
+
+            with conn:
+                conn.executemany("DELETE FROM derivative_cache WHERE key = ?", evicted)
+            self._adjust_total_size(-freed)
+            print(f"缩略图缓存淘汰 {len(evicted)} 个文件")
+        finally:
+            self._evict_lock.release()
+
+    def clear(self):
+        """清空派生缓存记录（文件由调用方删除）"""
+        conn = get_db_connection(self.db_file)
+        with conn:
+            conn.execute("DELETE FROM derivative_cache")
+        with self._state_lock:
+            self._total_size = 0
+            self._touched = {}
@@ -4,25 +4,55 @@ JM 漫画爬虫服务。
 """
 
 import concurrent.futures
+import copy
 import io
 import json
 import os
 import re
 import shutil
-import time
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 
 import jmcomic
-import requests
 import yaml
 from PIL import Image
 
+try:
+    from services.download_checkpoint import CheckpointDownloader, DownloadCheckpoint
+    from services.http_pool import fetch_bytes
+except ImportError:
+    from backend.services.download_checkpoint import (
+        CheckpointDownloader,
+        DownloadCheckpoint,
+    )
+    from backend.services.http_pool import fetch_bytes
+
+
+# 无会话的 postman 类型 -> 复用连接的会话版本（curl_cffi 会话按线程持有 curl 句柄）
+SESSION_POSTMANS = {
+    "curl_cffi": "curl_cffi_session",
+    "requests": "requests-session",
+}
+
+
+# 旧版默认配置中每章下载后生成 PDF 的插件，PDF 改为按需导出后从配置中移除
+LEGACY_PDF_PLUGIN = {
+    "plugin": "img2pdf",
+    "kwargs": {"img_dir": ".", "pdf_dir": ".", "filename_rule": "Pid"},
+}
+
 
 class JMCrawler:
     """JM 漫画爬虫服务。"""
 
-    def __init__(self):
+    def __init__(self, disk_usage=None, staging_dir: Optional[str] = None):
+        """
+        Args:
+            disk_usage: 磁盘占用统计器
+            staging_dir: 下载暂存目录，图片写入 ``<staging_dir>/<album_id>/<photo_id>``；
+                默认为 TempCache/downloads
+        """
         self.base_dir = os.environ.get(
             "BASE_DIR",
             os.path.dirname(
@@ -39,13 +69,24 @@ class JMCrawler:
             root_option_file if os.path.exists(root_option_file) else backend_option_file
         )
 
+        self.staging_dir = staging_dir or os.path.join(
+            self.base_dir, "TempCache", "downloads"
+        )
+
         os.makedirs(self.temp_cache, exist_ok=True)
         self._ensure_option_file()
 
+        self._option = None
+        self._option_mtime = None
+        self._option_lock = threading.Lock()
+
         self.jm_option = jmcomic.JmOption.from_file(self.option_file)
         self.cover_cache_file = os.path.join(self.temp_cache, "cover_cache.json")
         self.cover_cache = self._load_cover_cache()
 
+        # 可选的磁盘占用统计器，写入缓存封面时增量记录
+        self.disk_usage = disk_usage
+
     def _build_default_option_content(self) -> Dict:
         return {
             "client": {
@@ -77,18 +118,6 @@ class JMCrawler:
                 "image": {"decode": True, "suffix": ".jpg"},
                 "threading": {"batch_count": 30, "max_workers": 5},
             },
-            "plugins": {
-                "after_photo": [
-                    {
-                        "plugin": "img2pdf",
-                        "kwargs": {
-                            "img_dir": ".",
-                            "pdf_dir": ".",
-                            "filename_rule": "Pid",
-                        },
-                    }
-                ]
-            },
             "dir_rule": {
                 "rule": "{Aid}/{Pid}",
                 "base_dir": os.path.join(self.base_dir, "TempCache", "downloads"),
@@ -143,15 +172,64 @@ class JMCrawler:
             self._write_option_file(default_content)
             return
 
-        merged_content = self._merge_option_content(current_content, default_content)
+        merged_content = self._merge_option_content(
+            copy.deepcopy(current_content), default_content
+        )
+        self._drop_legacy_pdf_plugin(merged_content)
         if merged_content != current_content:
             self._write_option_file(merged_content)
 
+    @staticmethod
+    def _drop_legacy_pdf_plugin(option_content: Dict):
+        """移除未经修改的旧版默认 img2pdf 插件，用户自己配置的插件保留"""
+        plugins = option_content.get("plugins")
+        if not isinstance(plugins, dict):
+            return
+
+        after_photo = plugins.get("after_photo")
+        if isinstance(after_photo, list) and LEGACY_PDF_PLUGIN in after_photo:
+            after_photo = [item for item in after_photo if item != LEGACY_PDF_PLUGIN]
+            if after_photo:
+                plugins["after_photo"] = after_photo
+            else:
+                plugins.pop("after_photo")
+        if not plugins:
+            option_content.pop("plugins")
+
     def _build_option(self):
         return jmcomic.create_option_by_file(self.option_file)
 
-    def _build_client(self):
-        return self._build_option().build_jm_client()
+    def _shared_option(self):
+        """
+        进程共享的配置，jm_option.yml 修改后重新加载
+
+        build_jm_client 的结果缓存在配置对象上，共享配置即共享客户端和它的连接；
+        无会话的请求方式换成对应的会话版本，连接可以复用。
+        """
+        try:
+            mtime = os.path.getmtime(self.option_file)
+        except OSError:
+            mtime = None
+
+        with self._option_lock:
+            if self._option is None or mtime != self._option_mtime:
+                option = self._build_option()
+                postman = option.client.postman.src_dict
+                postman["type"] = SESSION_POSTMANS.get(
+                    postman.get("type"), postman.get("type")
+                )
+                # 下载位置由调用方决定，不使用 jm_option.yml 中的 base_dir
+                option.dir_rule.base_dir = self.staging_dir
+                self._option = option
+                self._option_mtime = mtime
+            return self._option
+
+    def _build_download_option(self):
+        return self._shared_option()
+
+    def get_client(self):
+        """共享的 JM 客户端，其他服务访问 JM 时也用它，复用同一个连接池"""
+        return self._shared_option().build_jm_client()
 
     def _parse_count(self, value) -> int:
         if value is None:
@@ -204,7 +282,7 @@ class JMCrawler:
     def get_comic_info(self, album_id: int) -> Optional[Dict]:
         """获取漫画详细信息。"""
         try:
-            client = self._build_client()
+            client = self.get_client()
             album = client.get_album_detail(album_id)
             if not album:
                 return None
@@ -213,6 +291,7 @@ class JMCrawler:
                 "id": album_id,
                 "title": getattr(album, "title", "Unknown"),
                 "author": getattr(album, "author", "Unknown"),
+                "authors": list(getattr(album, "authors", []) or []),
                 "cover": "",
                 "tags": list(getattr(album, "tags", []) or []),
                 "description": getattr(album, "description", ""),
@@ -222,6 +301,12 @@ class JMCrawler:
                 "works": list(getattr(album, "works", []) or []),
                 "actors": list(getattr(album, "actors", []) or []),
                 "keywords": list(getattr(album, "keywords", []) or []),
+                "chapters": [
+                    {"id": str(photo_id), "title": photo_title, "index": index}
+                    for index, (photo_id, _, photo_title) in enumerate(
+                        getattr(album, "episode_list", []) or []
+                    )
+                ],
             }
 
             cover_url = self.get_cover_url(album_id)
@@ -245,7 +330,7 @@ class JMCrawler:
             return self.cover_cache[cache_key]
 
         try:
-            client = self._build_client()
+            client = self.get_client()
             domain_list = getattr(client, "domain_list", []) or []
             domain = domain_list[0] if domain_list else "www.cdnhth.club"
             cover_url = f"https://{domain}/media/albums/{album_id}.jpg"
@@ -371,7 +456,7 @@ class JMCrawler:
         if not cleaned_ids:
             return {}
 
-        client = self._build_client()
+        client = self.get_client()
         details = {}
         max_workers = min(6, len(cleaned_ids))
 
@@ -444,7 +529,7 @@ class JMCrawler:
                 sort_order = "desc"
             page = max(1, int(page or 1))
 
-            client = self._build_client()
+            client = self.get_client()
 
             try:
                 search_results = self._search_site(
@@ -513,37 +598,109 @@ class JMCrawler:
             traceback.print_exc()
             return []
 
+    @property
+    def checkpoint_dir(self) -> str:
+        """检查点目录，放在漫画下载目录之外，移动下载结果时不会被带走"""
+        return os.path.join(self.staging_dir, ".checkpoints")
+
+    def _checkpoint_path(self, album_id: int) -> str:
+        return os.path.join(self.checkpoint_dir, f"{album_id}.jsonl")
+
+    def _open_checkpoint(self, album_id: int, option) -> DownloadCheckpoint:
+        return DownloadCheckpoint(
+            self._checkpoint_path(album_id), option.dir_rule.base_dir
+        )
+
+    def album_staging_dir(self, album_id: int) -> str:
+        """漫画的下载暂存目录"""
+        return os.path.join(self.staging_dir, str(album_id))
+
+    def clear_checkpoint(self, album_id: int):
+        """下载结果已入库或任务被取消后删除检查点"""
+        path = self._checkpoint_path(album_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def _progress_reporter(progress_callback, start: int = 30, end: int = 90):
+        """把下载器的逐图进度换算为 start~end 区间内的进度回调"""
+
+        def report(detail: Dict):
+            total = detail["images_total"]
+            done = detail["images_done"]
+            value = start + int((end - start) * done / total) if total else start
+            chapter = detail["chapter"]
+            chapter_text = (
+                f"第 {chapter['index']} 章 {chapter['done']}/{chapter['total']}，"
+                if chapter
+                else ""
+            )
+            speed = round(detail["speed"] / (1024 * 1024), 2)
+            progress_callback(
+                value,
+                "downloading",
+                f"{chapter_text}共 {done}/{total} 张，{speed} MB/s",
+                detail,
+            )
+
+        return report
+
+    @staticmethod
+    def _raise_for_failures(downloader):
+        """
+        有图片或章节下载失败时抛出异常
+
+        jmcomic 会吞掉单张图片的异常，只记在 download_failed_* 中；
+        暂存目录和检查点保留，任务重新开始时只补下失败的部分。
+        """
+        if not downloader.has_download_failures:
+            return
+        failed_images = downloader.download_failed_image
+        failed_photos = downloader.download_failed_photo
+        for _, error in (failed_photos + failed_images)[:5]:
+            print(f"下载失败记录: {error}")
+        raise RuntimeError(
+            f"{len(failed_images)} 张图片、{len(failed_photos)} 个章节下载失败"
+        )
+
     def download_comic(self, album_id: int, progress_callback=None) -> bool:
         """下载漫画。"""
         try:
             if progress_callback:
                 progress_callback(0, "starting", "开始下载...")
 
-            download_dir = os.path.join(
-                self.base_dir, "TempCache", "downloads", str(album_id)
-            )
+            download_dir = self.album_staging_dir(album_id)
             os.makedirs(download_dir, exist_ok=True)
 
             if progress_callback:
                 progress_callback(10, "preparing", "准备下载环境...")
 
-            option = self._build_option()
+            option = self._build_download_option()
+            checkpoint = self._open_checkpoint(album_id, option)
 
             if progress_callback:
-                progress_callback(30, "downloading", "正在获取漫画信息...")
+                if len(checkpoint):
+                    progress_callback(
+                        30, "downloading", f"断点续传：已完成 {len(checkpoint)} 张"
+                    )
+                else:
+                    progress_callback(30, "downloading", "正在获取漫画信息...")
 
             try:
-                jmcomic.download_album(
-                    album_id,
-                    option=option,
-                    callback=None,
-                    check_exception=False,
+                on_progress = (
+                    self._progress_reporter(progress_callback)
+                    if progress_callback
+                    else None
                 )
+                with CheckpointDownloader(option, checkpoint, on_progress) as downloader:
+                    downloader.download_album(album_id)
+                if downloader.interrupted is not None:
+                    raise downloader.interrupted
+                self._raise_for_failures(downloader)
 
+                # download_album 在所有图片线程结束后才返回，图片已在 after_image 中落盘
                 if progress_callback:
-                    progress_callback(80, "downloading", "漫画下载中...")
-
-                time.sleep(2)
+                    progress_callback(90, "downloading", "图片下载完成")
             except Exception as e:
                 print(f"JMComic 下载失败: {e}")
                 return self._simple_download(album_id, progress_callback)
@@ -582,7 +739,7 @@ class JMCrawler:
             if progress_callback:
                 progress_callback(40, "downloading", "使用备用方式下载...")
 
-            option = self._build_option()
+            option = self._build_download_option()
             client = option.build_jm_client()
 
             album = client.get_album_detail(album_id)
@@ -601,8 +758,17 @@ class JMCrawler:
             if progress_callback:
                 progress_callback(80, "downloading", "下载漫画内容...")
 
-            downloader = jmcomic.JmDownloader(option)
-            downloader.download_album(album_id)
+            checkpoint = self._open_checkpoint(album_id, option)
+            on_progress = (
+                self._progress_reporter(progress_callback, 80, 95)
+                if progress_callback
+                else None
+            )
+            with CheckpointDownloader(option, checkpoint, on_progress) as downloader:
+                downloader.download_album(album_id)
+            if downloader.interrupted is not None:
+                raise downloader.interrupted
+            self._raise_for_failures(downloader)
 
             if progress_callback:
                 progress_callback(95, "processing", "下载完成")
@@ -616,25 +782,23 @@ class JMCrawler:
     def _download_cover(self, cover_url: str, album_id: int) -> Optional[str]:
         """下载封面图片。"""
         try:
-            headers = {
-                "User-Agent": (
-                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36"
-                )
-            }
-            response = requests.get(cover_url, headers=headers, timeout=30)
-            response.raise_for_status()
+            content = fetch_bytes(cover_url)
 
             cover_filename = f"cover_{album_id}.jpg"
             cover_path = os.path.join(self.temp_cache, cover_filename)
 
-            image = Image.open(io.BytesIO(response.content))
+            image = Image.open(io.BytesIO(content))
             if image.mode == "RGBA":
                 rgb_image = Image.new("RGB", image.size, (255, 255, 255))
                 rgb_image.paste(image, mask=image.split()[3])
                 image = rgb_image
 
+            previous_size = (
+                os.path.getsize(cover_path) if os.path.exists(cover_path) else None
+            )
             image.save(cover_path, "JPEG", quality=85)
+            if self.disk_usage is not None:
+                self.disk_usage.record_write(cover_path, previous_size)
             return cover_path
 
         except Exception as e:
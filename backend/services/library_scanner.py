@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+书架扫描器
+
+对比 downloaded_comics 表和 DownloadedComics 目录：
+- 新出现的 ``<jm_id>_标题`` 目录入库（add）
+- 目录已不存在的记录移除（remove）
+- 漫画目录的 inode、mtime 变化时重新生成页面清单等信息（update）
+
+普通扫描只比较书架目录一层的 stat 结果，不进入漫画目录；
+深度扫描（手动触发）再列出每本漫画的章节子目录，发现章节内增删图片的变化。
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+try:
+    from models.database import get_db_connection
+except ImportError:
+    from backend.models.database import get_db_connection
+
+ALBUM_DIR_PATTERN = re.compile(r"^(\d+)_")
+
+# 内存中保留的最近事件数
+MAX_RECENT_EVENTS = 500
+
+
+class LibraryScanner:
+    """书架与磁盘目录同步"""
+
+    def __init__(self, comic_manager, download_manager=None):
+        self.comic_manager = comic_manager
+        self.download_manager = download_manager
+
+        self._scan_lock = threading.Lock()
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._events = deque(maxlen=MAX_RECENT_EVENTS)
+        self._event_seq = 0
+        self._thread: Optional[threading.Thread] = None
+        self.last_result: Optional[Dict] = None
+
+    # ------------------------------------------------------------------
+    # 事件
+    # ------------------------------------------------------------------
+
+    def add_listener(self, callback: Callable[[Dict], None]):
+        """订阅扫描事件，回调参数为 {"seq", "type", "jm_id", "dirname", "time"}"""
+        self._listeners.append(callback)
+
+    def get_events(self, since: int = 0) -> List[Dict]:
+        """获取序号大于 since 的最近事件"""
+        return [event for event in list(self._events) if event["seq"] > since]
+
+    def _emit(self, event_type: str, jm_id: int, dirname: str):
+        self._event_seq += 1
+        event = {
+            "seq": self._event_seq,
+            "type": event_type,
+            "jm_id": jm_id,
+            "dirname": dirname,
+            "time": time.time(),
+        }
+        self._events.append(event)
+        print(f"书架扫描: {event_type} {jm_id} {dirname}")
+
+        for callback in list(self._listeners):
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"书架扫描事件回调失败: {e}")
+
+    # ------------------------------------------------------------------
+    # 扫描
+    # ------------------------------------------------------------------
+
+    @property
+    def is_running(self) -> bool:
+        return self._scan_lock.locked()
+
+    def start(self, deep: bool = False) -> bool:
+        """在后台线程中扫描一次，已有扫描在进行时返回 False"""
+        if self._thread and self._thread.is_alive():
+            return False
+
+        self._thread = threading.Thread(target=self.scan, args=(deep,), daemon=True)
+        self._thread.start()
+        return True
+
+    def scan(self, deep: bool = False) -> Dict:
+        """
+        同步扫描一次书架
+
+        Args:
+            deep: 漫画目录未变化时是否继续比较章节子目录的 mtime
+
+        Returns:
+            {"added", "removed", "updated", "albums", "duration", "time"}
+        """
+        with self._scan_lock:
+            started = time.time()
+            result = {"added": 0, "removed": 0, "updated": 0, "albums": 0}
+
+            # 列目录之前取正在下载的漫画：列目录之后才发布完成的漫画不在 on_disk 中，
+            # 但仍在 active_downloads 里，不会被当成已删除
+            busy = self._busy_ids()
+            try:
+                on_disk = self._scan_library_dir()
+            except OSError as e:
+                print(f"扫描书架目录失败: {e}")
+                return self.last_result or {}
+
+            conn = get_db_connection(self.comic_manager.db_file)
+            known = {
+                jm_id: (dirname, inode, mtime_ns, chapter_mtimes)
+                for jm_id, dirname, inode, mtime_ns, chapter_mtimes in conn.execute(
+                    """
+                    SELECT jm_id, dirname, inode, mtime_ns, chapter_mtimes
+                    FROM library_scan_state
+                """
+                )
+            }
+            in_db = {
+                jm_id
+                for (jm_id,) in conn.execute("SELECT jm_id FROM downloaded_comics")
+            }
+            busy |= self._busy_ids()
+
+            for jm_id, signature in on_disk.items():
+                if jm_id in busy:
+                    continue
+
+                dirname = signature[0]
+                comic_dir = os.path.join(self.comic_manager.downloaded_dir, dirname)
+                if jm_id not in in_db:
+                    if self.comic_manager.add_downloaded_comic(
+                        jm_id, self._load_comic_info(jm_id, comic_dir), comic_dir
+                    ):
+                        result["added"] += 1
+                        self._emit("add", jm_id, dirname)
+                    continue
+
+                state = known.get(jm_id)
+                if state is None or state[:3] != signature:
+                    changed = True
+                elif not deep:
+                    changed = False
+                else:
+                    try:
+                        chapter_mtimes = self.comic_manager.chapter_mtimes(comic_dir)
+                    except OSError:
+                        continue
+                    if state[3] is None:
+                        # 升级前的记录没有章节 mtime，补记一次，不触发重建
+                        self.comic_manager.save_scan_state(jm_id, comic_dir)
+                    changed = state[3] is not None and state[3] != chapter_mtimes
+
+                if changed and self.comic_manager.refresh_comic_files(jm_id, comic_dir):
+                    result["updated"] += 1
+                    self._emit("update", jm_id, dirname)
+
+            for jm_id in (in_db | set(known)) - set(on_disk) - busy:
+                if self.comic_manager.find_comic_dir(jm_id, rebuild=False):
+                    # 列目录之后才登记的目录（例如刚发布完成的下载）
+                    busy.add(jm_id)
+                    continue
+                dirname = known.get(jm_id, ("",))[0]
+                self.comic_manager.remove_comic_record(jm_id)
+                if jm_id in in_db:
+                    result["removed"] += 1
+                    self._emit("remove", jm_id, dirname)
+
+            # 目录索引以本次扫描结果为准，请求路径上不再需要重建
+            self.comic_manager.rebuild_dir_index(
+                {jm_id: signature[0] for jm_id, signature in on_disk.items()},
+                keep=busy | self._busy_ids(),
+            )
+
+            result["albums"] = len(on_disk)
+            result["duration"] = round(time.time() - started, 3)
+            result["time"] = started
+            self.last_result = result
+
+            if result["added"] or result["removed"] or result["updated"]:
+                print(
+                    f"书架扫描完成: 新增 {result['added']}，移除 {result['removed']}，"
+                    f"更新 {result['updated']}，耗时 {result['duration']} 秒"
+                )
+            return result
+
+    def _scan_library_dir(self) -> Dict[int, tuple]:
+        """列出书架目录，返回 jm_id -> (dirname, inode, mtime_ns)"""
+        albums = {}
+        with os.scandir(self.comic_manager.downloaded_dir) as entries:
+            for entry in entries:
+                match = ALBUM_DIR_PATTERN.match(entry.name)
+                if not match or not entry.is_dir(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                albums.setdefault(
+                    int(match.group(1)),
+                    (entry.name, stat.st_ino, stat.st_mtime_ns),
+                )
+        return albums
+
+    def _busy_ids(self) -> set:
+        if self.download_manager is None:
+            return set()
+        return set(self.download_manager.active_downloads)
+
+    def _load_comic_info(self, jm_id: int, comic_dir: str) -> Dict:
+        """读取目录中的 info.json，手动放入的目录则以目录名作为标题"""
+        info_path = os.path.join(comic_dir, "info.json")
+        if os.path.exists(info_path):
+            try:
+                with open(info_path, "r", encoding="utf-8") as f:
+                    comic_info = json.load(f)
+                comic_info["id"] = jm_id
+                return comic_info
+            except Exception as e:
+                print(f"读取漫画信息失败 {info_path}: {e}")
+
+        dirname = os.path.basename(comic_dir)
+        return {"id": jm_id, "title": ALBUM_DIR_PATTERN.sub("", dirname) or dirname}
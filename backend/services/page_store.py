@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+章节页面存储
+
+章节可以是散图目录，也可以打包成一个不压缩的 CBZ（ZIP_STORED）容器。
+容器中每页数据连续存放，页面清单记录每页的数据偏移，读取时直接对容器做 mmap 切片，
+不需要逐页 open/stat/close，也不再为每页占用一个 inode。
+"""
+
+import io
+import mmap
+import os
+import struct
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+# 容器扩展名，多章节漫画的容器名为 "<章节ID>.cbz"
+CONTAINER_EXT = ".cbz"
+
+# 根目录散图（单章节漫画）打包后的容器名
+ROOT_CONTAINER = "_pages.cbz"
+
+# 同时保持映射的容器数
+MAX_OPEN_CONTAINERS = 32
+
+# ZIP 本地文件头：签名、版本、标志、压缩方式、时间、日期、CRC、大小、原始大小、文件名长度、扩展字段长度
+_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+
+
+class PageRef(NamedTuple):
+    """页面数据位置：散图为文件路径，打包章节为容器路径 + 数据偏移"""
+
+    path: str
+    offset: Optional[int]
+    size: int
+    mtime: float
+    name: str
+
+    @property
+    def packed(self) -> bool:
+        return self.offset is not None
+
+    @classmethod
+    def from_file(cls, path: str) -> "PageRef":
+        stat = os.stat(path)
+        return cls(path, None, stat.st_size, stat.st_mtime, os.path.basename(path))
+
+    def read(self) -> bytes:
+        """读取页面数据"""
+        if self.packed:
+            return container_reader.read(self.path, self.offset, self.size, self.mtime)
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def open(self):
+        """返回可交给 Pillow 的文件路径或文件对象"""
+        if self.packed:
+            return io.BytesIO(self.read())
+        return self.path
+
+
+def container_path(comic_dir: str, chapter_id: str) -> str:
+    """章节对应的容器路径"""
+    if not chapter_id:
+        return os.path.join(comic_dir, ROOT_CONTAINER)
+    return os.path.join(comic_dir, chapter_id + CONTAINER_EXT)
+
+
+def container_chapter_id(filename: str) -> Optional[str]:
+    """由容器文件名得到章节ID，不是容器时返回 None"""
+    if not filename.endswith(CONTAINER_EXT):
+        return None
+    if filename == ROOT_CONTAINER:
+        return ""
+    return filename[: -len(CONTAINER_EXT)]
+
+
+def read_container_index(path: str) -> List[tuple]:
+    """
+    读取容器索引
+
+    Returns:
+        [(文件名, 数据偏移, 大小), ...]，跳过目录和压缩过的条目
+    """
+    entries = []
+    with open(path, "rb") as f, zipfile.ZipFile(f) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or info.compress_type != zipfile.ZIP_STORED:
+                continue
+            # 中央目录里的扩展字段长度可能与本地文件头不同，以本地文件头为准
+            f.seek(info.header_offset)
+            header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            offset = info.header_offset + _LOCAL_HEADER.size + header[9] + header[10]
+            entries.append((info.filename, offset, info.file_size))
+    return entries
+
+
+def pack_chapter(source_dir: str, filenames: List[str], target_path: str) -> int:
+    """
+    把章节图片打包为不压缩的容器（先写临时文件再原子替换）
+
+    Returns:
+        容器大小（字节）
+    """
+    temp_path = f"{target_path}.{threading.get_ident()}.tmp"
+    try:
+        with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_STORED) as archive:
+            for filename in filenames:
+                archive.write(os.path.join(source_dir, filename), arcname=filename)
+        # Windows 上被映射的文件不能被替换，先释放旧容器的映射
+        container_reader.close(target_path)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return os.path.getsize(target_path)
+
+
+class ContainerReader:
+    """容器的 mmap 缓存（LRU），按清单中的容器 mtime 判断映射是否过期"""
+
+    def __init__(self, max_open: int = MAX_OPEN_CONTAINERS):
+        self.max_open = max_open
+        # 路径 -> (mtime, mmap)
+        self._maps: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, path: str, offset: int, size: int, mtime: float) -> bytes:
+        with self._lock:
+            cached = self._maps.get(path)
+            if cached is None or cached[0] != mtime:
+                self._close(path)
+                cached = (mtime, self._map(path))
+                self._maps[path] = cached
+                while len(self._maps) > self.max_open:
+                    self._close(next(iter(self._maps)))
+            else:
+                self._maps.move_to_end(path)
+
+            if offset + size > len(cached[1]):
+                raise ValueError(f"页面超出容器范围: {path}")
+            return cached[1][offset : offset + size]
+
+    @staticmethod
+    def _map(path: str) -> mmap.mmap:
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self, path: str):
+        """容器被替换或删除前释放映射（Windows 上被映射的文件不能替换或删除）"""
+        with self._lock:
+            self._close(path)
+
+    def close_under(self, directory: str):
+        """释放目录下所有容器的映射"""
+        prefix = os.path.join(directory, "")
+        with self._lock:
+            for path in [path for path in self._maps if path.startswith(prefix)]:
+                self._close(path)
+
+    def _close(self, path: str):
+        cached = self._maps.pop(path, None)
+        if cached is not None:
+            cached[1].close()
+
+
+container_reader = ContainerReader()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+流式 PDF 生成
+
+逐页把图片写入 PDF 文件，写完一页即释放，内存占用与漫画页数无关。
+JPEG 原图直接以 DCTDecode 嵌入，不重新编码；其他格式转为 JPEG 后嵌入。
+多章节时为每章生成一个书签（大纲）。
+"""
+
+import io
+import os
+from typing import BinaryIO, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+try:
+    from services.page_store import PageRef
+except ImportError:
+    from backend.services.page_store import PageRef
+
+# 图片没有 DPI 信息时按 96 DPI 换算页面尺寸
+DEFAULT_DPI = 96
+
+# 非 JPEG 图片转码质量
+JPEG_QUALITY = 90
+
+PRODUCER = "JMComicReader"
+
+
+def _pdf_string(text: str) -> bytes:
+    """PDF 文本字符串：ASCII 用字面量，其他用带 BOM 的 UTF-16BE 十六进制串"""
+    if all(32 <= ord(char) < 127 for char in text):
+        escaped = (
+            text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        )
+        return f"({escaped})".encode("ascii")
+    return b"<FEFF" + text.encode("utf-16-be").hex().upper().encode("ascii") + b">"
+
+
+def _prepare_image(data: bytes) -> Tuple[bytes, int, int, str, float]:
+    """
+    把页面图片转换为可嵌入的 JPEG
+
+    Returns:
+        (JPEG 数据, 宽, 高, 颜色空间, DPI)
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        dpi = image.info.get("dpi", (DEFAULT_DPI,))[0] or DEFAULT_DPI
+
+        if image.format == "JPEG" and image.mode in ("RGB", "L"):
+            colorspace = "/DeviceRGB" if image.mode == "RGB" else "/DeviceGray"
+            return data, width, height, colorspace, dpi
+
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            flattened = Image.new("RGB", image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.split()[3])
+            image = flattened
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=JPEG_QUALITY)
+        colorspace = "/DeviceRGB" if image.mode == "RGB" else "/DeviceGray"
+        return buffer.getvalue(), width, height, colorspace, dpi
+
+
+class StreamingPdfWriter:
+    """
+    边生成边写出的 PDF 写入器
+
+    页面对象写出后只保留对象号和偏移量；页面树、书签和交叉引用表在 close() 时写出。
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self._position = 0
+        # 对象号 -> 文件偏移
+        self._offsets = {}
+        self._next_id = 1
+        self._page_ids: List[int] = []
+        # (书签标题, 指向的页序号)
+        self._bookmarks: List[Tuple[str, int]] = []
+
+        self._pages_id = self._reserve()
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_ids)
+
+    def _write(self, data: bytes):
+        self._stream.write(data)
+        self._position += len(data)
+
+    def _reserve(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id: int, body: bytes):
+        self._offsets[obj_id] = self._position
+        self._write(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+
+    def _write_stream(self, obj_id: int, entries: bytes, data: bytes):
+        self._offsets[obj_id] = self._position
+        self._write(b"%d 0 obj\n<< %s /Length %d >>\nstream\n" % (obj_id, entries, len(data)))
+        self._write(data)
+        self._write(b"\nendstream\nendobj\n")
+
+    def add_bookmark(self, title: str):
+        """在下一页处添加书签"""
+        self._bookmarks.append((title, len(self._page_ids)))
+
+    def add_page(self, data: bytes):
+        """添加一页图片"""
+        jpeg, width, height, colorspace, dpi = _prepare_image(data)
+        page_width = width * 72 / dpi
+        page_height = height * 72 / dpi
+
+        image_id = self._reserve()
+        self._write_stream(
+            image_id,
+            b"/Type /XObject /Subtype /Image /Width %d /Height %d "
+            b"/ColorSpace %s /BitsPerComponent 8 /Filter /DCTDecode"
+            % (width, height, colorspace.encode("ascii")),
+            jpeg,
+        )
+
+        content_id = self._reserve()
+        self._write_stream(
+            content_id,
+            b"",
+            b"q %.4f 0 0 %.4f 0 0 cm /Im0 Do Q" % (page_width, page_height),
+        )
+
+        page_id = self._reserve()
+        self._write_object(
+            page_id,
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.4f %.4f] "
+            b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+            % (self._pages_id, page_width, page_height, image_id, content_id),
+        )
+        self._page_ids.append(page_id)
+
+    def _write_outline(self) -> Optional[int]:
+        bookmarks = [
+            (title, self._page_ids[index])
+            for title, index in self._bookmarks
+            if index < len(self._page_ids)
+        ]
+        if not bookmarks:
+            return None
+
+        outline_id = self._reserve()
+        item_ids = [self._reserve() for _ in bookmarks]
+        for i, (title, page_id) in enumerate(bookmarks):
+            links = b""
+            if i > 0:
+                links += b" /Prev %d 0 R" % item_ids[i - 1]
+            if i < len(bookmarks) - 1:
+                links += b" /Next %d 0 R" % item_ids[i + 1]
+            self._write_object(
+                item_ids[i],
+                b"<< /Title %s /Parent %d 0 R%s /Dest [%d 0 R /Fit] >>"
+                % (_pdf_string(title), outline_id, links, page_id),
+            )
+        self._write_object(
+            outline_id,
+            b"<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>"
+            % (item_ids[0], item_ids[-1], len(item_ids)),
+        )
+        return outline_id
+
+    def close(self, title: Optional[str] = None):
+        """写出页面树、书签、文档信息和交叉引用表"""
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self._page_ids)
+        self._write_object(
+            self._pages_id,
+            b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._page_ids)),
+        )
+
+        outline_id = self._write_outline()
+
+        info_id = self._reserve()
+        info = b"/Producer " + _pdf_string(PRODUCER)
+        if title:
+            info = b"/Title " + _pdf_string(title) + b" " + info
+        self._write_object(info_id, b"<< " + info + b" >>")
+
+        catalog_id = self._reserve()
+        catalog = b"/Type /Catalog /Pages %d 0 R" % self._pages_id
+        if outline_id is not None:
+            catalog += b" /Outlines %d 0 R /PageMode /UseOutlines" % outline_id
+        self._write_object(catalog_id, b"<< " + catalog + b" >>")
+
+        xref_offset = self._position
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % self._next_id)
+        for obj_id in range(1, self._next_id):
+            self._write(b"%010d 00000 n \n" % self._offsets[obj_id])
+        self._write(
+            b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (self._next_id, catalog_id, info_id, xref_offset)
+        )
+
+
+def build_pdf(
+    sections: Iterable[Tuple[str, List[PageRef]]],
+    target_path: str,
+    title: Optional[str] = None,
+    bookmarks: bool = True,
+) -> int:
+    """
+    按章节生成 PDF，先写临时文件，完成后替换目标文件
+
+    Args:
+        sections: [(章节标题, [PageRef, ...]), ...]
+        title: 文档标题
+        bookmarks: 是否为每个有标题的章节添加书签
+
+    Returns:
+        写入的页数，为 0 时不生成文件
+    """
+    temp_path = target_path + ".tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            writer = StreamingPdfWriter(f)
+            for section_title, pages in sections:
+                if bookmarks and section_title:
+                    writer.add_bookmark(section_title)
+                for page in pages:
+                    try:
+                        writer.add_page(page.read())
+                    except Exception as e:
+                        print(f"PDF 跳过无法读取的页面 {page.path} {page.name}: {e}")
+            writer.close(title)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if writer.page_count == 0:
+            os.remove(temp_path)
+            return 0
+
+        os.replace(temp_path, target_path)
+        return writer.page_count
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+PDF 导出缓存
+
+PDF 不再在下载时生成，第一次导出时用 pdf_builder 生成并写入磁盘缓存。
+缓存键包含页面清单版本，漫画内容变化后自动生成新文件；按最近访问时间做 LRU 淘汰，
+缓存总大小受 system_config 限制。
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+try:
+    from models.database import get_db_connection, get_system_config
+except ImportError:
+    from backend.models.database import get_db_connection, get_system_config
+
+# 默认缓存上限（字节），可通过 system_config.pdf_cache_size_limit 调整
+DEFAULT_CACHE_SIZE_LIMIT = 2 * 1024 * 1024 * 1024
+
+# 淘汰到上限的该比例以下，避免每次写入都触发淘汰
+EVICT_TARGET_RATIO = 0.9
+
+# 命中时最多每隔多少秒更新一次访问时间
+TOUCH_INTERVAL = 60
+
+
+class PdfExportCache:
+    """按需生成的 PDF 磁盘缓存"""
+
+    def __init__(self, cache_dir: str, db_file: str, comic_manager, disk_usage=None):
+        self.cache_dir = cache_dir
+        self.db_file = db_file
+        self.comic_manager = comic_manager
+        self.disk_usage = disk_usage
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # 同一 PDF 只生成一次，按键哈希分段加锁
+        self._locks = [threading.Lock() for _ in range(16)]
+        self._evict_lock = threading.Lock()
+
+    def _size_limit(self) -> int:
+        try:
+            return int(get_system_config("pdf_cache_size_limit"))
+        except (TypeError, ValueError):
+            return DEFAULT_CACHE_SIZE_LIMIT
+
+    def get_pdf(self, jm_id: int, chapter_id: Optional[str] = None) -> Optional[str]:
+        """
+        获取漫画（或单个章节）的 PDF，缓存中没有时生成
+
+        Returns:
+            PDF 路径；漫画或章节不存在、没有页面时返回 None
+        """
+        if not self.comic_manager.get_downloaded_comic(jm_id):
+            return None
+        # 章节 ID 来自请求参数，只接受漫画实际存在的章节，之后才能用于拼接缓存路径
+        if chapter_id and chapter_id not in {
+            chapter["id"] for chapter in self.comic_manager.get_comic_chapters(jm_id)
+        }:
+            return None
+        # 页面清单缺失时先生成，版本号才与实际页面一致
+        self.comic_manager.get_page_manifest(jm_id)
+        version = self.comic_manager.get_page_version(jm_id)
+
+        name = f"chapter_{chapter_id}" if chapter_id else "all"
+        key = f"{jm_id}/{name}_{version}.pdf"
+        cache_path = os.path.join(self.cache_dir, *key.split("/"))
+        root = os.path.realpath(self.cache_dir)
+        if not os.path.realpath(cache_path).startswith(os.path.join(root, "")):
+            print(f"PDF 缓存路径越界，已忽略: {key}")
+            return None
+
+        if os.path.exists(cache_path):
+            self._touch(key)
+            return cache_path
+
+        lock = self._locks[hash(key) % len(self._locks)]
+        with lock:
+            if os.path.exists(cache_path):
+                return cache_path
+
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            started = time.time()
+            pages = self.comic_manager.export_pdf(jm_id, cache_path, chapter_id)
+            if not pages:
+                return None
+            print(
+                f"生成 PDF {key}: {pages} 页，耗时 {round(time.time() - started, 2)} 秒"
+            )
+
+        size = os.path.getsize(cache_path)
+        conn = get_db_connection(self.db_file)
+        # 同一漫画/章节的旧版本 PDF 已过期，直接删除
+        stale = [
+            row
+            for row in conn.execute(
+                "SELECT key, path, size FROM pdf_cache WHERE jm_id = ? AND key != ?",
+                (jm_id, key),
+            )
+            if row[0].rsplit("_", 1)[0] == f"{jm_id}/{name}"
+        ]
+        # 删除失败（例如 Windows 上文件仍被打开发送）的保留记录，之后由 LRU 淘汰再次尝试
+        removed = [
+            (stale_key,)
+            for stale_key, path, stale_size in stale
+            if self._remove_file(path, stale_size)
+        ]
+
+        with conn:
+            conn.executemany("DELETE FROM pdf_cache WHERE key = ?", removed)
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO pdf_cache (key, jm_id, path, size, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                (key, jm_id, cache_path, size, time.time()),
+            )
+        if self.disk_usage is not None:
+            self.disk_usage.record_file(cache_path, size, 1)
+
+        self._evict_if_needed(keep=key)
+        return cache_path
+
+    def _touch(self, key: str):
+        now = time.time()
+        conn = get_db_connection(self.db_file)
+        with conn:
+            conn.execute(
+                """
+                UPDATE pdf_cache SET last_access = ?
+                WHERE key = ? AND last_access < ?
+            """,
+                (now, key, now - TOUCH_INTERVAL),
+            )
+
+    def get_total_size(self) -> int:
+        conn = get_db_connection(self.db_file)
+        return conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM pdf_cache"
+        ).fetchone()[0]
+
+    def _evict_if_needed(self, keep: Optional[str] = None):
+        """超过上限时按最近访问时间从旧到新删除（刚生成的文件除外）"""
+        limit = self._size_limit()
+        if self.get_total_size() <= limit or not self._evict_lock.acquire(False):
+            return
+
+        try:
+            conn = get_db_connection(self.db_file)
+            excess = self.get_total_size() - int(limit * EVICT_TARGET_RATIO)
+            rows = conn.execute(
+                "SELECT key, path, size FROM pdf_cache WHERE key != ? ORDER BY last_access",
+                (keep or "",),
+            ).fetchall()
+
+            evicted = []
+            for key, path, size in rows:
+                if excess <= 0:
+                    break
+                if self._remove_file(path, size):
+                    evicted.append((key,))
+                    excess -= size
+
+            with conn:
+                conn.executemany("DELETE FROM pdf_cache WHERE key = ?", evicted)
+            print(f"PDF 缓存淘汰 {len(evicted)} 个文件")
+        finally:
+            self._evict_lock.release()
+
+    def _remove_file(self, path: str, size: int) -> bool:
+        try:
+            os.remove(path)
+            if self.disk_usage is not None:
+                self.disk_usage.record_file(path, -size, -1)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"删除 PDF 缓存失败 {path}: {e}")
+            return False
+        return True
+
+    def invalidate(self, jm_id: int):
+        """删除漫画的全部缓存 PDF（漫画被删除时调用）"""
+        conn = get_db_connection(self.db_file)
+        rows = conn.execute(
+            "SELECT key, path, size FROM pdf_cache WHERE jm_id = ?", (jm_id,)
+        ).fetchall()
+        removed = [(key,) for key, path, size in rows if self._remove_file(path, size)]
+        with conn:
+            conn.executemany("DELETE FROM pdf_cache WHERE key = ?", removed)
+
+    def clear(self):
+        """清空 PDF 缓存记录（文件由调用方删除）"""
+        conn = get_db_connection(self.db_file)
+        with conn:
+            conn.execute("DELETE FROM pdf_cache")
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+章节打包转换
+
+把书架中仍为散图的漫画逐本打包为 CBZ 容器（见 page_store），在后台线程中执行，
+正在下载的漫画会被跳过。
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+try:
+    from models.database import get_db_connection
+except ImportError:
+    from backend.models.database import get_db_connection
+
+
+class StorageConverter:
+    """散图漫画到打包章节的后台转换"""
+
+    def __init__(self, comic_manager, download_manager=None):
+        self.comic_manager = comic_manager
+        self.download_manager = download_manager
+
+        self._thread: Optional[threading.Thread] = None
+        self.status: Dict = {
+            "running": False,
+            "total": 0,
+            "converted": 0,
+            "skipped": 0,
+            "failed": [],
+            "current": None,
+            "started": None,
+            "finished": None,
+        }
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """启动后台转换，已有转换在进行时返回 False"""
+        if self.is_running:
+            return False
+
+        self._thread = threading.Thread(target=self.convert_all, daemon=True)
+        self._thread.start()
+        return True
+
+    def _loose_comics(self) -> list:
+        """页面清单中仍有散图页面的漫画"""
+        conn = get_db_connection(self.comic_manager.db_file)
+        return [
+            jm_id
+            for (jm_id,) in conn.execute(
+                """
+                SELECT DISTINCT jm_id FROM comic_pages
+                WHERE data_offset IS NULL
+                ORDER BY jm_id
+            """
+            )
+        ]
+
+    def convert_all(self) -> Dict:
+        """同步转换所有散图漫画"""
+        jm_ids = self._loose_comics()
+        self.status.update(
+            {
+                "running": True,
+                "total": len(jm_ids),
+                "converted": 0,
+                "skipped": 0,
+                "failed": [],
+                "current": None,
+                "started": time.time(),
+                "finished": None,
+            }
+        )
+
+        for jm_id in jm_ids:
+            busy = (
+                self.download_manager is not None
+                and jm_id in self.download_manager.active_downloads
+            )
+            if busy:
+                self.status["skipped"] += 1
+                continue
+
+            self.status["current"] = jm_id
+            try:
+                if self.comic_manager.pack_comic(jm_id):
+                    self.status["converted"] += 1
+                else:
+                    self.status["skipped"] += 1
+            except Exception as e:
+                print(f"打包漫画失败 {jm_id}: {e}")
+                self.status["failed"].append({"jm_id": jm_id, "message": str(e)})
+
+        self.status.update(
+            {"running": False, "current": None, "finished": time.time()}
+        )
+        print(
+            f"章节打包完成: 转换 {self.status['converted']} 本，"
+            f"跳过 {self.status['skipped']} 本，失败 {len(self.status['failed'])} 本"
+        )
+        return self.status
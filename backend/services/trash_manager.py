@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+批量删除
+
+删除请求只做两件事：从数据库移除漫画记录、把目录原子重命名到回收区（与书架在同一文件系统）。
+真正的 rmtree 由后台线程执行并汇报进度，请求线程不会被大目录阻塞。
+"""
+
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Optional
+
+try:
+    from models.database import get_db_connection
+    from services.page_store import container_reader
+except ImportError:
+    from backend.models.database import get_db_connection
+    from backend.services.page_store import container_reader
+
+# 回收区目录名（位于书架目录下，保证 rename 不跨文件系统）
+TRASH_DIRNAME = ".trash"
+
+# 已完成的删除任务保留多久（秒），之后不再能查询进度
+JOB_TTL = 3600
+
+# 内存中最多保留的删除任务数（超出时先丢弃最早完成的）
+MAX_JOBS = 100
+
+
+class TrashManager:
+    """漫画删除与后台空间回收"""
+
+    def __init__(self, comic_manager, download_manager=None):
+        self.comic_manager = comic_manager
+        self.download_manager = download_manager
+        self.disk_usage = comic_manager.disk_usage
+
+        self.trash_dir = os.path.join(comic_manager.downloaded_dir, TRASH_DIRNAME)
+        os.makedirs(self.trash_dir, exist_ok=True)
+        self.disk_usage.register_cache("trash", self.trash_dir)
+
+        # job_id -> 删除任务进度
+        self.jobs: Dict[str, Dict] = {}
+        # job_id -> 完成时间，用于清理过期任务
+        self._finished: Dict[str, float] = {}
+        self._jobs_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动后台回收线程，并接管上次未回收完的目录"""
+        if self._worker and self._worker.is_alive():
+            return
+
+        self._enqueue_orphans()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def delete_comics(self, jm_ids: Iterable[int]) -> Dict:
+        """
+        删除多本漫画，立即返回删除任务
+
+        Returns:
+            任务进度字典，见 get_job
+        """
+        job_id = f"delete_{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        job = {
+            "job_id": job_id,
+            "status": "pending",
+            "total": 0,
+            "removed": [],
+            "skipped": [],
+            "failed": [],
+            "reclaimed": 0,
+            "reclaimed_bytes": 0,
+            "pending_bytes": 0,
+        }
+        with self._jobs_lock:
+            self._prune_jobs()
+            self.jobs[job_id] = job
+
+        busy = set()
+        if self.download_manager is not None:
+            busy = set(self.download_manager.active_downloads)
+
+        queued = []
+        index_rebuilt = False
+
+        for jm_id in dict.fromkeys(jm_ids):
+            if jm_id in busy:
+                job["skipped"].append(jm_id)
+                continue
+
+            try:
+                comic_dir = self.comic_manager.find_comic_dir(jm_id, rebuild=False)
+                if comic_dir is None and not index_rebuilt:
+                    # 索引可能过期（目录被改名或手动放入），重建一次后再判断；
+                    # 不走 find_comic_dir 的限频重建，否则会把仍存在的目录当成已删除
+                    self.comic_manager.rebuild_dir_index(keep=busy)
+                    index_rebuilt = True
+                    comic_dir = self.comic_manager.find_comic_dir(jm_id, rebuild=False)
+                if comic_dir is None and not self.comic_manager.has_comic_record(jm_id):
+                    job["skipped"].append(jm_id)
+                    continue
+
+                size = self.disk_usage.get_usage("album", jm_id)
+                trash_path = None
+                if comic_dir:
+                    trash_path = os.path.join(
+                        self.trash_dir,
+                        f"{os.path.basename(comic_dir)}.{uuid.uuid4().hex[:8]}",
+                    )
+                    # Windows 上被映射的容器会阻止重命名，先释放映射
+                    container_reader.close_under(comic_dir)
+                    os.rename(comic_dir, trash_path)
+                    self.disk_usage.forget(comic_dir)
+
+                # 目录已不存在时只清掉数据库记录，同样算删除成功
+                self.comic_manager.remove_comic_record(jm_id)
+                job["removed"].append(jm_id)
+
+                if trash_path:
+                    queued.append((jm_id, trash_path, size, job_id))
+            except Exception as e:
+                print(f"删除漫画失败 {jm_id}: {e}")
+                job["failed"].append({"jm_id": jm_id, "message": str(e)})
+
+        # 一次性入队，避免回收线程在任务统计完成前就处理到一半
+        job["total"] = len(queued)
+        job["pending_bytes"] = sum(item[2] for item in queued)
+        job["status"] = "running" if queued else "completed"
+        if not queued:
+            with self._jobs_lock:
+                self._finished[job_id] = time.time()
+        if queued:
+            conn = get_db_connection(self.comic_manager.db_file)
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO trash_queue (jm_id, trash_path, size, job_id)
+                    VALUES (?, ?, ?, ?)
+                """,
+                    queued,
+                )
+            self._wakeup.set()
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """获取删除任务进度"""
+        return self.jobs.get(job_id)
+
+    def _prune_jobs(self):
+        """
+        丢弃完成超过 JOB_TTL 的任务，任务数仍超过 MAX_JOBS 时丢弃最早完成的
+
+        在 _jobs_lock 内调用；未完成的任务不会被丢弃。
+        """
+        expired = time.time() - JOB_TTL
+        finished = sorted(self._finished.items(), key=lambda item: item[1])
+        excess = len(self.jobs) + 1 - MAX_JOBS
+        for job_id, finished_at in finished:
+            if finished_at >= expired and excess <= 0:
+                break
+            self.jobs.pop(job_id, None)
+            del self._finished[job_id]
+            excess -= 1
+
+    def _enqueue_orphans(self):
+        """回收区里不在队列中的目录（例如重命名后进程退出）补入队列"""
+        conn = get_db_connection(self.comic_manager.db_file)
+        queued = {
+            path for (path,) in conn.execute("SELECT trash_path FROM trash_queue")
+        }
+
+        orphans = []
+        for name in os.listdir(self.trash_dir):
+            path = os.path.join(self.trash_dir, name)
+            if path not in queued:
+                orphans.append((path,))
+
+        if orphans:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO trash_queue (trash_path) VALUES (?)", orphans
+                )
+            print(f"回收区发现 {len(orphans)} 个待清理项目")
+
+    def _run(self):
+        conn = get_db_connection(self.comic_manager.db_file)
+
+        while True:
+            self._wakeup.clear()
+            rows = conn.execute(
+                "SELECT id, trash_path, size, job_id FROM trash_queue ORDER BY id"
+            ).fetchall()
+            if not rows:
+                self._wakeup.wait()
+                continue
+
+            for row_id, trash_path, size, job_id in rows:
+                self._reclaim(conn, row_id, trash_path, size or 0, job_id)
+
+    def _reclaim(self, conn, row_id: int, trash_path: str, size: int, job_id):
+        try:
+            if os.path.isdir(trash_path):
+                shutil.rmtree(trash_path)
+            elif os.path.exists(trash_path):
+                os.remove(trash_path)
+        except Exception as e:
+            # 删除失败的目录留在回收区，下次启动时重新入队
+            print(f"回收空间失败 {trash_path}: {e}")
+
+        self.disk_usage.forget(trash_path)
+        with conn:
+            conn.execute("DELETE FROM trash_queue WHERE id = ?", (row_id,))
+
+        job = self.jobs.get(job_id) if job_id else None
+        if job:
+            job["reclaimed"] += 1
+            job["reclaimed_bytes"] += size
+            job["pending_bytes"] = max(0, job["pending_bytes"] - size)
+            if job["reclaimed"] >= job["total"]:
+                job["status"] = "completed"
+                with self._jobs_lock:
+                    self._finished[job_id] = time.time()
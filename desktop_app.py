@@ -180,8 +180,9 @@ def run_desktop():
     configure_windows_app_id()
     base_dir = configure_runtime_env()
 
-    from backend.app import app
+    from backend.app import app, start_background_services
 
+    start_background_services()
     port = find_free_port()
     url = f"http://127.0.0.1:{port}"
     server = FlaskServerThread(app, "127.0.0.1", port)
@@ -20,9 +20,7 @@ DEPENDENCIES = [
     "jmcomic>=1.0.0",
     "requests>=2.31.0",
     "pillow>=10.0.0",
-    "img2pdf>=0.4.4",
     "aiofiles>=23.0.0",
-    "aiohttp>=3.9.0",
     "pywebview>=5.0",
 ]
 
@@ -157,9 +155,7 @@ def verify_installation():
         "jmcomic": "JMComic",
         "requests": "Requests",
         "PIL": "Pillow",
-        "img2pdf": "img2pdf",
         "aiofiles": "aiofiles",
-        "aiohttp": "aiohttp",
         "webview": "pywebview",
     }
     
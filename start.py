@@ -12,7 +12,7 @@ import sys
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 # 导入Flask应用
-from backend.app import app
+from backend.app import app, start_background_services
 
 if __name__ == "__main__":
     print("=" * 50)
@@ -27,6 +27,8 @@ if __name__ == "__main__":
     print("=" * 50)
     print()
 
+    start_background_services()
+
     # 禁用自动重载，使用生产模式设置
     app.run(
         host="0.0.0.0",